@@ -0,0 +1,288 @@
+"""
+offline analytics over the ndjson events written by `LogHandler`:
+
+    python -m trappsec.analyze events.log events.log.1.gz --event trappsec.trap_hit --since 2024-01-30
+    python -m trappsec.analyze /var/log/app/*.log --ip 203.0.113.0/24 --format csv --jobs 4
+
+lines are matched on their raw bytes before they are parsed, so filters that
+exclude most of a log skip most of the json decoding. aggregations are computed
+in a single pass with bounded memory and merged across files, which are spread
+over `--jobs` processes.
+"""
+import re
+import csv
+import sys
+import gzip
+import json
+import mmap
+import argparse
+import datetime
+from fnmatch import fnmatchcase
+
+from .networks import NetworkSet
+
+_TIMESTAMP = re.compile(rb'"timestamp":\s*(-?[0-9.eE+-]+)')
+
+def read_lines(path: str):
+    """yields the raw lines of a plain or gzipped log, `-` reads stdin."""
+    if path == "-":
+        yield from sys.stdin.buffer
+        return
+
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            yield from f
+        return
+
+    # plain files are memory-mapped, so large logs are paged in rather than read
+    with open(path, "rb") as f:
+        try:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return
+        with m:
+            yield from iter(m.readline, b"")
+
+def parse_time(value: str) -> float:
+    """unix timestamp or iso 8601 date/datetime, naive values are utc."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    dt = datetime.datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+class EventFilter:
+    """
+    every criterion is optional and they all have to match. exact values are
+    first looked for in the raw line, so lines that can't match are never parsed.
+    `path` is a glob and `ip` a list of addresses or cidrs.
+    """
+    def __init__(self, event: str = None, type: str = None, intent: str = None, path: str = None, ip: list = None, user: str = None,
+                 since: float = None, until: float = None):
+        self.exact = {k: v for k, v in (("event", event), ("type", type), ("user", user)) if v is not None}
+        self.intent = intent
+        self.path = path
+        self.networks = NetworkSet(ip) if ip else None
+        self.since = since
+        self.until = until
+
+        # values as LogHandler's json.dumps escapes them, quotes left out as users may be numbers
+        self.needles = [json.dumps(v)[1:-1].encode("utf-8") for v in list(self.exact.values()) + [intent] if v is not None]
+
+    def parse(self, line: bytes):
+        """returns the event on `line` if it matches, None otherwise."""
+        for needle in self.needles:
+            if needle not in line:
+                return None
+
+        if self.since is not None or self.until is not None:
+            m = _TIMESTAMP.search(line)
+            if m is None:
+                return None
+            ts = float(m.group(1))
+            if (self.since is not None and ts < self.since) or (self.until is not None and ts >= self.until):
+                return None
+
+        # log formatters may prefix the json document
+        start = line.find(b"{")
+        if start < 0:
+            return None
+        try:
+            event = json.loads(line[start:])
+        except ValueError:
+            return None
+        if not isinstance(event, dict):
+            return None
+
+        for key, value in self.exact.items():
+            if str(event.get(key)) != value:
+                return None
+        if self.intent is not None and not _has_intent(event, self.intent):
+            return None
+        if self.path is not None and not fnmatchcase(str(event.get("path")), self.path):
+            return None
+        if self.networks is not None and event.get("ip") not in self.networks:
+            return None
+        return event
+
+def _has_intent(event: dict, intent: str) -> bool:
+    if event.get("intent") == intent:
+        return True
+    return any(f.get("intent") == intent for f in event.get("found_fields") or ())
+
+class TopK:
+    """
+    approximate heavy hitters: once more than twice `capacity` keys are counted,
+    all but the `capacity` largest are dropped, so memory stays bounded however
+    many distinct keys a log has.
+    """
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.counts = {}
+
+    def add(self, key, n: int = 1):
+        counts = self.counts
+        counts[key] = counts.get(key, 0) + n
+        if len(counts) > 2 * self.capacity:
+            self.counts = dict(self.top(self.capacity))
+
+    def merge(self, other: "TopK"):
+        for key, n in other.counts.items():
+            self.add(key, n)
+
+    def top(self, n: int) -> list:
+        return sorted(self.counts.items(), key=lambda kv: (-kv[1], str(kv[0])))[:n]
+
+class Summary:
+    """single pass aggregation of events, mergeable across files."""
+    def __init__(self, bucket: float = 3600, capacity: int = 1000):
+        self.bucket = bucket
+        self.total = 0
+        self.first = None
+        self.last = None
+        self.events = {}
+        self.ips = TopK(capacity)
+        self.users = TopK(capacity)
+        self.trap_paths = TopK(capacity)
+        self.trap_hits = {}
+        self.watch_fields = {}
+
+    def add(self, event: dict):
+        self.total += 1
+        name = event.get("event")
+        self.events[name] = self.events.get(name, 0) + 1
+
+        ts = event.get("timestamp")
+        if isinstance(ts, (int, float)):
+            self.first = ts if self.first is None else min(self.first, ts)
+            self.last = ts if self.last is None else max(self.last, ts)
+
+        if event.get("ip"):
+            self.ips.add(event["ip"])
+        if event.get("user"):
+            self.users.add(str(event["user"]))
+
+        if name == "trappsec.trap_hit":
+            self.trap_paths.add(event.get("path"))
+            if isinstance(ts, (int, float)):
+                start = int(ts // self.bucket * self.bucket)
+                self.trap_hits[start] = self.trap_hits.get(start, 0) + 1
+
+        for found in event.get("found_fields") or ():
+            fields = self.watch_fields.setdefault(found.get("intent"), {})
+            key = f"{found.get('type')}:{found.get('field')}"
+            fields[key] = fields.get(key, 0) + 1
+
+    def merge(self, other: "Summary"):
+        self.total += other.total
+        for bound, pick in (("first", min), ("last", max)):
+            values = [v for v in (getattr(self, bound), getattr(other, bound)) if v is not None]
+            setattr(self, bound, pick(values) if values else None)
+
+        for name, n in other.events.items():
+            self.events[name] = self.events.get(name, 0) + n
+        for start, n in other.trap_hits.items():
+            self.trap_hits[start] = self.trap_hits.get(start, 0) + n
+        for intent, fields in other.watch_fields.items():
+            mine = self.watch_fields.setdefault(intent, {})
+            for key, n in fields.items():
+                mine[key] = mine.get(key, 0) + n
+
+        self.ips.merge(other.ips)
+        self.users.merge(other.users)
+        self.trap_paths.merge(other.trap_paths)
+
+    def report(self, top: int = 10) -> dict:
+        return {
+            "total": self.total,
+            "first": _iso(self.first),
+            "last": _iso(self.last),
+            "events": dict(sorted(self.events.items(), key=lambda kv: -kv[1])),
+            "top_ips": dict(self.ips.top(top)),
+            "top_users": dict(self.users.top(top)),
+            "top_trap_paths": dict(self.trap_paths.top(top)),
+            "trap_hits": {_iso(start): n for start, n in sorted(self.trap_hits.items())},
+            "watch_fields": {
+                str(intent): dict(sorted(fields.items(), key=lambda kv: -kv[1]))
+                for intent, fields in self.watch_fields.items()
+            },
+        }
+
+def _iso(ts):
+    if ts is None:
+        return None
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).isoformat()
+
+def analyze_file(path: str, event_filter: EventFilter, bucket: float = 3600, capacity: int = 1000) -> Summary:
+    summary = Summary(bucket, capacity)
+    for line in read_lines(path):
+        event = event_filter.parse(line)
+        if event is not None:
+            summary.add(event)
+    return summary
+
+def analyze(paths: list, event_filter: EventFilter, bucket: float = 3600, capacity: int = 1000, jobs: int = 1) -> Summary:
+    """aggregates `paths` into one summary, using up to `jobs` processes."""
+    summary = Summary(bucket, capacity)
+    if jobs > 1 and len(paths) > 1 and "-" not in paths:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(min(jobs, len(paths))) as pool:
+            futures = [pool.submit(analyze_file, path, event_filter, bucket, capacity) for path in paths]
+            for future in futures:
+                summary.merge(future.result())
+        return summary
+
+    for path in paths:
+        summary.merge(analyze_file(path, event_filter, bucket, capacity))
+    return summary
+
+def write_csv(report: dict, out):
+    # one `section,key,value` row per aggregate
+    writer = csv.writer(out)
+    writer.writerow(["section", "key", "value"])
+    for key in ("total", "first", "last"):
+        writer.writerow(["summary", key, report[key]])
+    for section in ("events", "top_ips", "top_users", "top_trap_paths", "trap_hits"):
+        for key, value in report[section].items():
+            writer.writerow([section, key, value])
+    for intent, fields in report["watch_fields"].items():
+        for key, value in fields.items():
+            writer.writerow(["watch_fields", f"{intent}|{key}", value])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m trappsec.analyze", description="summarize trappsec ndjson event logs.")
+    parser.add_argument("paths", nargs="+", help="log files, plain or .gz, `-` for stdin")
+    parser.add_argument("--event", help="event name, e.g. trappsec.trap_hit")
+    parser.add_argument("--type", choices=("signal", "alert"))
+    parser.add_argument("--intent")
+    parser.add_argument("--path", help="glob matched against the request path")
+    parser.add_argument("--ip", action="append", help="address or cidr, may be repeated")
+    parser.add_argument("--user")
+    parser.add_argument("--since", type=parse_time, help="unix timestamp or iso 8601")
+    parser.add_argument("--until", type=parse_time, help="unix timestamp or iso 8601")
+    parser.add_argument("--top", type=int, default=10, help="entries in top lists (default: 10)")
+    parser.add_argument("--bucket", type=float, default=3600, help="trap hit histogram bucket in seconds (default: 3600)")
+    parser.add_argument("--jobs", type=int, default=1, help="processes to spread files over (default: 1)")
+    parser.add_argument("--format", choices=("json", "csv"), default="json")
+    args = parser.parse_args(argv)
+
+    event_filter = EventFilter(args.event, args.type, args.intent, args.path, args.ip, args.user, args.since, args.until)
+    # tracking more candidates than are shown keeps the top entries accurate
+    report = analyze(args.paths, event_filter, args.bucket, max(1000, args.top * 10), args.jobs).report(args.top)
+
+    if args.format == "csv":
+        write_csv(report, sys.stdout)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""
+framework agnostic asgi middleware, for starlette, quart, litestar or any
+other asgi application:
+
+    ts = trappsec.Sentry(None, service="billing-api", environment="production")
+    app = TrappsecMiddleware(app, ts)
+
+callbacks such as `identify_user` receive the asgi `scope` and may be `async def`.
+"""
+import asyncio
+
+from .utils import strip_cookies, parse_cookies
+from .multipart import MultipartFilter, get_boundary
+from .canary import scan_scope
+from .inspection import inspect_query, inspect_body, MAX_BODY_SIZE
+
+def scope_header(scope, name: bytes, default=None):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return default
+
+def scope_ip(scope):
+    client = scope.get("client")
+    return client[0] if client else "0.0.0.0"
+
+def scope_path(scope):
+    path = scope["path"]
+    root_path = scope.get("root_path", "")
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):] or "/"
+    return path
+
+def scope_method(scope):
+    return scope["method"]
+
+def scope_user_agent(scope):
+    return scope_header(scope, b"user-agent", "unknown")
+
+async def read_body(receive, limit: int) -> bytes:
+    """reads a request body, or None once it grows past `limit` bytes."""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            return None
+        chunks.append(message.get("body", b""))
+        size += len(chunks[-1])
+        if size > limit:
+            return None
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+class TrappsecMiddleware:
+    """
+    serves traps and inspects watched fields directly on the asgi scope, using
+    the compiled ruleset. `ip`, `path`, `method` and `user_agent` are extractors
+    called with the scope and replace the defaults below.
+    """
+    def __init__(self, app, ts, ip=None, path=None, method=None, user_agent=None):
+        if ts.integration is not None:
+            raise Exception("trappsec error: sentry is already attached to an application.")
+
+        self.app = app
+        self.ts = ts
+        ts.integration = self
+
+        self.path = path or scope_path
+        if ip or not ts.identity.ip:
+            ts.identity.ip = ip or scope_ip
+        ts.request.path = self.path
+        ts.request.method = method or scope_method
+        ts.request.user_agent = user_agent or scope_user_agent
+
+    def setup(self):
+        pass
+
+    def index_watches(self, ruleset):
+        # watches are matched against the request path, there are no routes to attach them to
+        pass
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            if scope["type"] == "lifespan":
+                self.ts.init_app()
+            return await self.app(scope, receive, send)
+
+        ruleset = self.ts._ruleset or self.ts.init_app()._ruleset
+        if self.ts._quarantine is not None:
+            quarantined = await self.ts._acheck_quarantine(scope)
+            if quarantined is not None:
+                return await self._respond(send, *quarantined, self.ts._quarantine_trap.get("tarpit"))
+
+        beacon = self.ts._beacon
+        if beacon is not None and scope["method"] == "POST" and self.path(scope) == beacon.path:
+            body = await read_body(receive, beacon.max_body)
+            beacon.submit(body, await self.ts._aget_ip(scope), self.ts.request.user_agent(scope))
+            await send({"type": "http.response.start", "status": 204, "headers": []})
+            return await send({"type": "http.response.body", "body": b""})
+
+        canary = self.ts._canary
+        if canary is not None:
+            receive = await self._scan_canaries(canary, scope, receive)
+
+        path = self.path(scope)
+        trap = ruleset.match_trap(path, scope["method"])
+        if trap is not None:
+            return await self._serve_trap(scope, send, trap)
+
+        watch = ruleset.match_watch(path)
+        if watch is None:
+            return await self.app(scope, receive, send)
+
+        await WatchInspector(self.ts, watch)(self.app, scope, receive, send)
+
+    async def _scan_canaries(self, canary, scope, receive):
+        async def on_found(found, location):
+            await self.ts._atrigger_canary_event(scope, found, location)
+
+        return await scan_scope(canary, scope, receive, on_found, self.ts._canary_scan_body)
+
+    async def _serve_trap(self, scope, send, trap):
+        response_body, response_config = await self.ts._atrigger_trap_event(scope, trap)
+        await self._respond(send, response_body, response_config, trap.get("tarpit"))
+
+    async def _respond(self, send, response_body, response_config, tarpit=None):
+        # streamed bodies are iterators of bytes chunks
+        streamed = hasattr(response_body, "__next__")
+        if isinstance(response_body, str):
+            response_body = response_body.encode("utf-8")
+        elif not streamed and not isinstance(response_body, bytes):
+            response_body = str(response_body).encode("utf-8")
+
+        headers = [(b"content-type", response_config["mime_type"].encode("latin-1"))]
+        if not tarpit and not streamed:
+            headers.append((b"content-length", str(len(response_body)).encode("latin-1")))
+
+        await send({"type": "http.response.start", "status": response_config["status_code"], "headers": headers})
+
+        if not tarpit and not streamed:
+            return await send({"type": "http.response.body", "body": response_body})
+
+        # without a tarpit, sleep(0) still lets other requests run between generated chunks
+        chunks, interval = self.ts._tarpit_chunks(response_body, tarpit) if tarpit else (response_body, 0)
+        for chunk in chunks:
+            await asyncio.sleep(interval)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+class WatchInspector:
+    """
+    inspects the fields of one watch on the asgi scope and calls the application
+    with them stripped. built once per watch, it only runs the checks the watch
+    needs. callbacks receive `request(scope)`, or the scope itself.
+    """
+    def __init__(self, ts, watch, request=None):
+        self.ts = ts
+        self.watch = watch
+        self.request = request
+        self.headers = bool(watch["header_fields"] or watch["cookie_fields"])
+        self.query = watch["query_prefilter"] is not None
+        self.body = bool(watch["body_fields"])
+
+    async def __call__(self, app, scope, receive, send):
+        ts, watch = self.ts, self.watch
+        scope = dict(scope)
+        req = self.request(scope) if self.request is not None else scope
+
+        # fields are inspected synchronously, so async defaults are awaited first
+        resolved = await ts._aresolve_defaults(req, watch)
+        with ts._using(resolved):
+            found_fields = self._inspect_headers(scope, req) if self.headers else []
+
+            query_string = scope.get("query_string", b"")
+            if self.query and query_string:
+                mod, stripped = inspect_query(ts, req, query_string, watch)
+                if mod:
+                    found_fields.extend(mod)
+                    scope["query_string"] = stripped
+
+            boundary = None
+            if self.body:
+                ctype = scope_header(scope, b"content-type", "")
+                boundary = get_boundary(ctype) if ctype.startswith("multipart/form-data") else None
+                if boundary is None and ("application/json" in ctype or "application/x-www-form-urlencoded" in ctype):
+                    receive = await self._inspect_body(scope, req, receive, ctype, found_fields)
+
+        if boundary is not None:
+            return await self._stream_multipart(app, scope, req, receive, send, boundary, found_fields, resolved)
+
+        if found_fields:
+            await ts._atrigger_watch_event(req, found_fields)
+
+        await app(scope, receive, send)
+
+    def _inspect_headers(self, scope, req):
+        header_fields = self.watch["header_fields"]
+        cookie_fields = self.watch["cookie_fields"]
+
+        # single pass over the raw headers; asgi header names are already lowercase
+        h_dict, raw_cookie = {}, None
+        for name, value in scope["headers"]:
+            name = name.decode("latin-1")
+            if name in header_fields:
+                h_dict[name] = value.decode("latin-1")
+            elif name == "cookie":
+                raw_cookie = value.decode("latin-1")
+
+        h_mod, c_mod = [], []
+        if h_dict:
+            _, h_mod = self.ts._detect_honey_fields(h_dict, header_fields, req, "header")
+
+        if cookie_fields and raw_cookie:
+            c_dict = parse_cookies(raw_cookie, cookie_fields)
+            if c_dict:
+                _, c_mod = self.ts._detect_honey_fields(c_dict, cookie_fields, req, "cookie")
+
+        if h_mod or c_mod:
+            headers = []
+            for name, value in scope["headers"]:
+                key = name.decode("latin-1")
+                if h_mod and key in header_fields:
+                    continue
+                if c_mod and key == "cookie":
+                    value = strip_cookies(value.decode("latin-1"), cookie_fields).encode("latin-1")
+                headers.append((name, value))
+            scope["headers"] = headers
+
+        return h_mod + c_mod
+
+    async def _inspect_body(self, scope, req, receive, ctype, found_fields):
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                # the client went away, let the application see it
+                return self._replay(b"".join(chunks), receive, message)
+
+            chunks.append(message.get("body", b""))
+            size += len(chunks[-1])
+            more_body = message.get("more_body", False)
+            if not more_body or size > MAX_BODY_SIZE:
+                break
+
+        body = b"".join(chunks)
+        if size > MAX_BODY_SIZE:
+            # passed through uninspected, the application reads the rest itself if there is any
+            return self._replay(body, receive, more_body=more_body)
+
+        mod, stripped = inspect_body(self.ts, req, body, ctype, self.watch)
+        if mod:
+            found_fields.extend(mod)
+            body = stripped
+            scope["headers"] = [(k, v) for k, v in scope["headers"] if k != b"content-length"]
+            scope["headers"].append((b"content-length", str(len(body)).encode("latin-1")))
+
+        return self._replay(body, receive)
+
+    def _replay(self, body, receive, pending=None, more_body=False):
+        state = {"sent": False}
+
+        async def replay_receive():
+            if not state["sent"]:
+                state["sent"] = True
+                return {"type": "http.request", "body": body, "more_body": more_body or pending is not None}
+            if pending is not None:
+                return pending
+            return await receive()
+
+        return replay_receive
+
+    async def _stream_multipart(self, app, scope, req, receive, send, boundary, found_fields, resolved):
+        # multipart bodies are filtered as the application reads them
+        body_fields = self.watch["body_fields"]
+        state = {"complete": False}
+
+        def inspect(name, value):
+            try:
+                with self.ts._using(resolved):
+                    _, mod = self.ts._detect_honey_fields({name: value}, body_fields, req)
+            except Exception as e:
+                self.ts.logger.error("error inspecting multipart field: %s", e)
+                return False
+            found_fields.extend(mod)
+            return bool(mod)
+
+        multipart_filter = MultipartFilter(boundary, body_fields, inspect)
+
+        async def complete():
+            if not state["complete"]:
+                state["complete"] = True
+                if found_fields:
+                    await self.ts._atrigger_watch_event(req, found_fields)
+
+        async def filtered_receive():
+            message = await receive()
+            if message["type"] == "http.request" and not state["complete"]:
+                body = multipart_filter.feed(message.get("body", b""))
+                if not message.get("more_body", False):
+                    body += multipart_filter.finish()
+                if multipart_filter.done:
+                    await complete()
+                message = dict(message, body=body)
+            return message
+
+        async def inspecting_send(message):
+            # the app may answer without reading the body, finish inspecting it first
+            if message["type"] == "http.response.start" and not state["complete"]:
+                while not state["complete"]:
+                    if (await filtered_receive())["type"] != "http.request":
+                        await complete()
+            await send(message)
+
+        await app(scope, filtered_receive, inspecting_send)
@@ -0,0 +1,185 @@
+"""
+ingestion of client-side lure events sent with `navigator.sendBeacon`:
+
+    navigator.sendBeacon("/_trappsec/beacon", JSON.stringify({
+        t: PAGE_TOKEN,              // from ts.beacon_token(request), rendered into the page
+        p: location.pathname,
+        e: [{k: "ghost_method", n: "getSystemConfig"}, {k: "storage_tamper", n: "role", v: "admin"}],
+    }));
+
+the endpoint only queues the raw body and answers 204. a background thread
+verifies the page token, drops malformed batches, coalesces identical events
+from the same actor over `window` seconds and feeds them to the handlers as
+`trappsec.client_hit` events carrying a `count`.
+"""
+import hmac
+import json
+import time
+import atexit
+import base64
+import struct
+import hashlib
+import threading
+import ipaddress
+from collections import deque
+
+from .utils import after_fork_in_child
+
+MAC_SIZE = 12
+MAX_USER = 64
+# version, issue time, ip size
+_HEAD = struct.Struct("<BIB")
+
+class BeaconTokens:
+    """
+    stateless page tokens: the issue time, and optionally the ip and user the
+    page was rendered for, signed with an hmac.
+    """
+    VERSION = 1
+
+    def __init__(self, secret, ttl: float = 86400, bind_ip: bool = False):
+        if not secret:
+            raise ValueError("beacon: `secret` is required.")
+        self.key = secret.encode("utf-8") if isinstance(secret, str) else secret
+        self.ttl = ttl
+        self.bind_ip = bind_ip
+
+    def _mac(self, payload: bytes) -> bytes:
+        return hmac.new(self.key, payload, hashlib.sha256).digest()[:MAC_SIZE]
+
+    def issue(self, ip: str = None, user=None, now: float = None) -> str:
+        packed_ip = b""
+        if ip and self.bind_ip:
+            try:
+                packed_ip = ipaddress.ip_address(ip).packed
+            except ValueError:
+                pass
+
+        payload = _HEAD.pack(self.VERSION, int(now or time.time()), len(packed_ip))
+        payload += packed_ip + (str(user).encode("utf-8")[:MAX_USER] if user is not None else b"")
+        return base64.urlsafe_b64encode(payload + self._mac(payload)).decode("ascii").rstrip("=")
+
+    def verify(self, token, ip: str = None, now: float = None) -> dict:
+        """returns who a token was issued to, or None if it is invalid, expired or bound to another ip."""
+        if not isinstance(token, str) or len(token) > 256:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        except Exception:
+            return None
+
+        payload, mac = raw[:-MAC_SIZE], raw[-MAC_SIZE:]
+        if len(payload) < _HEAD.size or not hmac.compare_digest(mac, self._mac(payload)):
+            return None
+
+        version, issued, ip_size = _HEAD.unpack_from(payload)
+        now = now or time.time()
+        if version != self.VERSION or ip_size not in (0, 4, 16) or not (issued - 60 <= now <= issued + self.ttl):
+            return None
+
+        bound = payload[_HEAD.size:_HEAD.size + ip_size]
+        if bound:
+            try:
+                if ip is None or ipaddress.ip_address(ip).packed != bound:
+                    return None
+            except ValueError:
+                return None
+
+        user = payload[_HEAD.size + ip_size:]
+        return {"issued_at": issued, "user": user.decode("utf-8", "replace") if user else None}
+
+class BeaconIngest:
+    """
+    queues beacon bodies as they arrive and processes them on a background
+    thread every `window` seconds. at most `max_queue` bodies wait, the oldest
+    dropped first, and each is read up to `max_events` events.
+    """
+    def __init__(self, ts, secret, path: str = "/_trappsec/beacon", ttl: float = 86400, window: float = 5.0, intents: dict = None,
+                 bind_ip: bool = False, max_queue: int = 10000, max_body: int = 65536, max_events: int = 50):
+        self.ts = ts
+        self.tokens = BeaconTokens(secret, ttl, bind_ip)
+        self.path = path
+        self.window = window
+        self.intents = intents or {}
+        self.max_queue = max_queue
+        self.max_body = max_body
+        self.max_events = max_events
+
+        self._start()
+        # threads don't survive a fork, restart the worker in each child
+        after_fork_in_child(self._start)
+        atexit.register(self.flush)
+
+    def _start(self):
+        self._queue = deque(maxlen=self.max_queue)
+        self._lock = threading.Lock()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def submit(self, body: bytes, ip: str, user_agent: str):
+        """called by the endpoint, does nothing but queue the body."""
+        if body and len(body) <= self.max_body:
+            self._queue.append((time.time(), body, ip, user_agent))
+
+    def _loop(self):
+        while True:
+            time.sleep(self.window)
+            try:
+                self.flush()
+            except Exception as e:
+                self.ts.logger.error(f"error processing beacons: {e}")
+
+    def flush(self):
+        """processes every queued beacon and emits the coalesced events."""
+        with self._lock:
+            coalesced = {}
+            while self._queue:
+                received, body, ip, user_agent = self._queue.popleft()
+                self._read(received, body, ip, user_agent, coalesced)
+
+            for ctx in coalesced.values():
+                self.ts._trigger(ctx)
+
+    def _read(self, received, body, ip, user_agent, coalesced):
+        if self.ts._ignored(ip):
+            return
+        try:
+            batch = json.loads(body)
+        except ValueError:
+            return
+        if not isinstance(batch, dict) or not isinstance(batch.get("e"), list):
+            return
+
+        token = self.tokens.verify(batch.get("t"), ip, received)
+        if token is None:
+            return
+
+        user = token["user"]
+        page = batch.get("p") if isinstance(batch.get("p"), str) else None
+        for event in batch["e"][:self.max_events]:
+            if not isinstance(event, dict) or not isinstance(event.get("k"), str) or not isinstance(event.get("n"), str):
+                continue
+
+            kind, name = event["k"][:64], event["n"][:256]
+            key = (user or ip, kind, name)
+            ctx = coalesced.get(key)
+            if ctx is not None:
+                ctx["count"] += 1
+                continue
+
+            ctx = coalesced[key] = {
+                "timestamp": received,
+                "event": "trappsec.client_hit",
+                "type": "signal",
+                "path": page,
+                "method": "POST",
+                "user_agent": user_agent,
+                "ip": ip,
+                "intent": self.intents.get(kind),
+                "kind": kind,
+                "name": name,
+                "value": event.get("v"),
+                "count": 1,
+            }
+            if user:
+                ctx["type"] = "alert"
+                ctx["user"] = user
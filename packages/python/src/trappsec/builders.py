@@ -1,15 +1,23 @@
 import typing
 import copy
 
+from .response_cache import ResponseCache
+from .networks import NetworkSet
+from .timeline import DistinctTrapsRule, SequenceRule
+
 NO_DEFAULT = object()
 
 class TrapBuilder:
-    def __init__(self, ts, path):
+    def __init__(self, ts, path, templates: dict = None):
         self.ts = ts
+        self.templates = ts._templates if templates is None else templates
         self.config = {
             "path": path, 
             "methods": ["GET", "POST"],
             "intent": None,
+            "tarpit": None,
+            "cache": None,
+            "ignore": None,
             "response.authenticated": copy.deepcopy(self.ts.default_responses["authenticated"]),
             "response.unauthenticated": copy.deepcopy(self.ts.default_responses["unauthenticated"]),
         }
@@ -21,14 +29,42 @@ class TrapBuilder:
     def intent(self, intent: str):
         self.config["intent"] = intent
         return self
+
+    def tarpit(self, delay: float, drip_bytes: int = 1):
+        if delay <= 0:
+            raise ValueError("trap_builder: `delay` must be greater than 0.")
+        if drip_bytes < 1:
+            raise ValueError("trap_builder: `drip_bytes` must be at least 1.")
+
+        self.config["tarpit"] = {"delay": delay, "drip_bytes": drip_bytes}
+        return self
+
+    def ignore_networks(self, networks: list):
+        self.config["ignore"] = NetworkSet(networks) or None
+        return self
+
+    def cache(self, ttl: float, key: typing.Union[str, typing.Callable] = None, max_entries: int = 1024):
+        if ttl <= 0:
+            raise ValueError("trap_builder: `ttl` must be greater than 0.")
+        if max_entries < 1:
+            raise ValueError("trap_builder: `max_entries` must be at least 1.")
+        if key is not None and not callable(key) and key not in ("ip", "user", "role", "path"):
+            raise ValueError("trap_builder: `key` must be a callable or one of 'ip', 'user', 'role' or 'path'.")
+
+        self.config["cache"] = {"key": key, "store": ResponseCache(ttl, max_entries)}
+        return self
     
-    def _respond(self, key: str, status: int = None, body: typing.Union[dict, typing.Callable] = None, mime_type: str = None, template: str = None):
+    def _respond(self, key: str, status: int = None, body: typing.Union[dict, typing.Callable] = None, mime_type: str = None, template: str = None,
+                 stream: typing.Callable = None):
         key = "response." + key
+        if stream is not None and body is not None:
+            raise TypeError("response_builder: `stream` cannot be used together with `body`.")
+
         if template:
-            if any(arg is not None for arg in (status, body, mime_type)):
-                raise TypeError("response_builder: `template` cannot be used together with `status`, `body`, or `mime_type`.")
+            if any(arg is not None for arg in (status, body, mime_type, stream)):
+                raise TypeError("response_builder: `template` cannot be used together with `status`, `body`, `mime_type` or `stream`.")
         
-            tmpl = self.ts._templates.get(template)
+            tmpl = self.templates.get(template)
             if not tmpl: 
                 raise ValueError(f"response_builder: template '{template}' not found.")
             
@@ -38,29 +74,75 @@ class TrapBuilder:
                 self.config[key]["status_code"] = status
             
             if body: 
+                self.config[key].pop("stream", None)
                 self.config[key]["response_body"] = body
             
+            if stream is not None:
+                # a body would be rendered instead of the stream
+                self.config[key].pop("response_body", None)
+                self.config[key]["stream"] = stream
+                mime_type = mime_type or getattr(stream, "mime_type", None)
+
             if mime_type: 
                 self.config[key]["mime_type"] = mime_type
         
         return self
 
-    def respond(self, status: int = None, body: typing.Union[dict, typing.Callable] = None, mime_type: str = None, template: str = None):
-        self._respond("authenticated", status, body, mime_type, template)
+    def respond(self, status: int = None, body: typing.Union[dict, typing.Callable] = None, mime_type: str = None, template: str = None,
+                stream: typing.Callable = None):
+        self._respond("authenticated", status, body, mime_type, template, stream)
         return self
 
-    def if_unauthenticated(self, status: int = None, body: typing.Union[dict, typing.Callable] = None, mime_type: str = None, template: str = None):
-        self._respond("unauthenticated", status, body, mime_type, template)
+    def if_unauthenticated(self, status: int = None, body: typing.Union[dict, typing.Callable] = None, mime_type: str = None, template: str = None,
+                           stream: typing.Callable = None):
+        self._respond("unauthenticated", status, body, mime_type, template, stream)
         return self
 
     def build(self):
         return self.config
 
+def _read_wordlist(source):
+    if isinstance(source, str):
+        with open(source, "r", encoding="utf-8", errors="replace") as f:
+            yield from f
+    else:
+        yield from source
+
+class WordlistTrapBuilder(TrapBuilder):
+    """
+    a single trap config shared by every path of a wordlist. entries are
+    normalized to start with `/`, blank lines and `#` comments are skipped and
+    a trailing `*` matches any path with that prefix.
+    """
+    def __init__(self, ts, source, name: str):
+        super().__init__(ts, name)
+
+        paths, prefixes = set(), set()
+        for line in _read_wordlist(source):
+            entry = line.strip().split("?", 1)[0]
+            if not entry or entry.startswith("#"):
+                continue
+            if not entry.startswith("/"):
+                entry = "/" + entry
+
+            if entry.endswith("*"):
+                prefixes.add(entry.rstrip("*"))
+            else:
+                paths.add(entry)
+
+        if not paths and not prefixes:
+            raise ValueError("trap_builder: wordlist has no paths.")
+
+        self.config["paths"] = frozenset(paths)
+        self.config["prefixes"] = tuple(sorted(prefixes))
+
 class WatchBuilder:
     def __init__(self, path):
         self.path = path
         self._query = {}
         self._body = {}
+        self._header = {}
+        self._cookie = {}
     
     def query(self, name: str, default: typing.Any = NO_DEFAULT, intent: str = None):
         self._query[name] = {"default": default, "intent": intent}
@@ -70,9 +152,46 @@ class WatchBuilder:
         self._body[name] = {"default": default, "intent": intent}
         return self
     
+    def header(self, name: str, default: typing.Any = NO_DEFAULT, intent: str = None):
+        # header names are case-insensitive, keep them lowercase for lookups
+        self._header[name.lower()] = {"default": default, "intent": intent}
+        return self
+
+    def cookie(self, name: str, default: typing.Any = NO_DEFAULT, intent: str = None):
+        self._cookie[name] = {"default": default, "intent": intent}
+        return self
+    
     def build(self):
         return {
             "path": self.path,
             "query_fields": self._query,
-            "body_fields": self._body
+            "body_fields": self._body,
+            "header_fields": self._header,
+            "cookie_fields": self._cookie
         }
+
+
+class EscalationBuilder:
+    def __init__(self, name):
+        self.name = name
+        self._intent = None
+        self._rule = None
+
+    def intent(self, intent: str):
+        self._intent = intent
+        return self
+
+    def distinct_traps(self, count: int, within: float):
+        self._rule = (DistinctTrapsRule, {"count": count, "within": within})
+        return self
+
+    def sequence(self, first: dict, then: dict, within: float):
+        self._rule = (SequenceRule, {"first": first, "then": then, "within": within})
+        return self
+
+    def build(self):
+        if self._rule is None:
+            raise ValueError(f"escalation_builder: escalation '{self.name}' has no rule.")
+
+        rule_class, kwargs = self._rule
+        return rule_class(self.name, intent=self._intent, **kwargs)
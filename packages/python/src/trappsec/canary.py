@@ -0,0 +1,244 @@
+import re
+import hmac
+import time
+import struct
+import base64
+import hashlib
+import ipaddress
+
+MAC_SIZE = 10
+MAX_LABEL = 16
+# version, issue time, trap id, ip size. the longest token adds a v6 address,
+# a full label and the mac
+_HEAD = struct.Struct("<BI4sB")
+_MIN_TOKEN = -(-(_HEAD.size + MAC_SIZE) * 8 // 5)
+_MAX_TOKEN = -(-(_HEAD.size + 16 + MAX_LABEL + MAC_SIZE) * 8 // 5)
+
+_PLACEHOLDER = r"\{\{canary(?::([A-Za-z0-9_.-]{1,%d}))?\}\}" % MAX_LABEL
+_PLACEHOLDER_STR = re.compile(_PLACEHOLDER)
+_PLACEHOLDER_BYTES = re.compile(_PLACEHOLDER.encode("ascii"))
+
+def trap_id(path: str) -> bytes:
+    return hashlib.blake2b(path.encode("utf-8"), digest_size=4).digest()
+
+class CanaryTokens:
+    """
+    stateless canary tokens. a token carries the trap, label, issue time and the
+    ip it was handed to, and is signed with an hmac, so verifying one needs no
+    stored table. tokens look like `<prefix><base32>` and a single regex over the
+    raw request bytes finds candidates, so requests without any are nearly free.
+    """
+    VERSION = 1
+
+    def __init__(self, secret, prefix: str = "ak_", max_candidates: int = 8):
+        if not secret:
+            raise ValueError("canary: `secret` is required.")
+        if not re.match(r"^[A-Za-z0-9_-]+$", prefix or ""):
+            raise ValueError("canary: `prefix` must be a non-empty string of letters, digits, `_` or `-`.")
+
+        self.key = secret.encode("utf-8") if isinstance(secret, str) else secret
+        self.prefix = prefix
+        self.max_candidates = max_candidates
+        self.max_length = len(prefix) + _MAX_TOKEN
+        self.pattern = re.compile(re.escape(prefix.encode("ascii")) + rb"[a-z2-7]{%d,%d}(?![a-z2-7])" % (_MIN_TOKEN, _MAX_TOKEN))
+
+    def _mac(self, payload: bytes) -> bytes:
+        return hmac.new(self.key, payload, hashlib.sha256).digest()[:MAC_SIZE]
+
+    def issue(self, trap_path: str, ip: str = None, label: str = "", now: float = None) -> str:
+        packed_ip = b""
+        if ip:
+            try:
+                packed_ip = ipaddress.ip_address(ip).packed
+            except ValueError:
+                pass
+
+        payload = _HEAD.pack(self.VERSION, int(now or time.time()), trap_id(trap_path), len(packed_ip))
+        payload += packed_ip + label.encode("ascii")[:MAX_LABEL]
+        token = base64.b32encode(payload + self._mac(payload)).decode("ascii").rstrip("=").lower()
+        return self.prefix + token
+
+    def verify(self, token) -> dict:
+        """returns what a token was issued for, or None if it isn't one of ours."""
+        if isinstance(token, bytes):
+            token = token.decode("ascii", "replace")
+        if not token.startswith(self.prefix):
+            return None
+
+        encoded = token[len(self.prefix):].upper()
+        try:
+            raw = base64.b32decode(encoded + "=" * (-len(encoded) % 8))
+        except Exception:
+            return None
+
+        # unused trailing bits would let one token be spelled several ways
+        if base64.b32encode(raw).decode("ascii").rstrip("=") != encoded:
+            return None
+
+        payload, mac = raw[:-MAC_SIZE], raw[-MAC_SIZE:]
+        if len(payload) < _HEAD.size or not hmac.compare_digest(mac, self._mac(payload)):
+            return None
+
+        version, issued, trap, ip_size = _HEAD.unpack_from(payload)
+        if version != self.VERSION or ip_size not in (0, 4, 16):
+            return None
+
+        ip = payload[_HEAD.size:_HEAD.size + ip_size]
+        return {
+            "token": token,
+            "trap_id": trap.hex(),
+            "label": payload[_HEAD.size + ip_size:].decode("ascii", "replace") or None,
+            "issued_at": issued,
+            "issued_to": str(ipaddress.ip_address(ip)) if ip else None,
+        }
+
+    def render(self, body, trap_path: str, ip: str = None):
+        """replaces `{{canary}}` and `{{canary:<label>}}` placeholders with fresh tokens."""
+        now = time.time()
+        if isinstance(body, bytes):
+            if b"{{canary" not in body:
+                return body
+            return _PLACEHOLDER_BYTES.sub(lambda m: self.issue(trap_path, ip, (m.group(1) or b"").decode("ascii"), now).encode("ascii"), body)
+
+        if isinstance(body, str) and "{{canary" in body:
+            return _PLACEHOLDER_STR.sub(lambda m: self.issue(trap_path, ip, m.group(1) or "", now), body)
+        return body
+
+    def scan(self, data: bytes, seen: set = None) -> list:
+        """verifies candidate tokens in raw bytes, skipping those already in `seen`."""
+        found = []
+        for i, m in enumerate(self.pattern.finditer(data)):
+            if i >= self.max_candidates:
+                break
+
+            token = m.group(0)
+            if seen is not None:
+                if token in seen:
+                    continue
+                seen.add(token)
+
+            canary = self.verify(token)
+            if canary is not None:
+                found.append(canary)
+        return found
+
+class BodyScanner:
+    """
+    scans a request body for canary tokens as it streams through, keeping enough
+    of the previous chunk that a token split across chunks is still found.
+    bodies larger than `limit` are only scanned up to it.
+    """
+    def __init__(self, tokens: CanaryTokens, on_found, limit: int = 1024 * 1024):
+        self.tokens = tokens
+        self.on_found = on_found
+        self.limit = limit
+        self.scanned = 0
+        self.tail = b""
+        self.seen = set()
+
+    def feed(self, chunk: bytes):
+        if not chunk or self.scanned >= self.limit:
+            return
+
+        chunk = chunk[:self.limit - self.scanned]
+        self.scanned += len(chunk)
+        data = self.tail + chunk
+
+        # a candidate touching the end of the data may continue in the next chunk
+        cut = len(data)
+        for m in self.tokens.pattern.finditer(data, max(0, len(data) - self.tokens.max_length)):
+            if m.end() == len(data):
+                cut = m.start()
+
+        self._scan(data[:cut])
+        self.tail = data[max(0, cut - self.tokens.max_length):]
+
+    def finish(self):
+        self._scan(self.tail)
+        self.tail = b""
+
+    def _scan(self, data):
+        found = self.tokens.scan(data, self.seen)
+        if found:
+            self.on_found(found)
+
+class ScanningInput:
+    """file-like wrapper scanning a wsgi input stream for canary tokens as the application reads it."""
+    def __init__(self, stream, content_length: int, scanner: BodyScanner):
+        self.stream = stream
+        self.remaining = content_length
+        self.scanner = scanner
+
+    def _seen(self, data: bytes) -> bytes:
+        self.scanner.feed(data)
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        if not data or (self.remaining is not None and self.remaining <= 0):
+            self.scanner.finish()
+        return data
+
+    def read(self, *args) -> bytes:
+        return self._seen(self.stream.read(*args))
+
+    def readline(self, *args) -> bytes:
+        return self._seen(self.stream.readline(*args))
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+def scan_environ(tokens: CanaryTokens, environ: dict, content_length: int, on_found, scan_body: bool = True):
+    """
+    scans the headers and query string of a wsgi environ for canary tokens, and
+    wraps its input so the body is scanned as the application reads it, never
+    buffered for it. `on_found(found, location)` is called for every hit.
+    """
+    headers = "\n".join(v for k, v in environ.items() if k.startswith("HTTP_") and isinstance(v, str))
+    found = tokens.scan(headers.encode("latin-1", "replace"))
+    if found:
+        on_found(found, "header")
+
+    query = environ.get("QUERY_STRING")
+    found = tokens.scan(query.encode("latin-1", "replace")) if query else None
+    if found:
+        on_found(found, "query")
+
+    if scan_body and content_length:
+        scanner = BodyScanner(tokens, lambda found: on_found(found, "body"))
+        environ["wsgi.input"] = ScanningInput(environ["wsgi.input"], content_length, scanner)
+
+async def scan_scope(tokens: CanaryTokens, scope: dict, receive, on_found, scan_body: bool = True):
+    """
+    the asgi counterpart of `scan_environ`: `on_found` is awaited, and the
+    returned `receive` scans the body as the application reads it.
+    """
+    found = tokens.scan(b"\n".join(value for _, value in scope["headers"]))
+    if found:
+        await on_found(found, "header")
+
+    query = scope.get("query_string")
+    found = tokens.scan(query) if query else None
+    if found:
+        await on_found(found, "query")
+
+    if not scan_body:
+        return receive
+
+    in_body = []
+    scanner = BodyScanner(tokens, in_body.extend)
+
+    async def scanning_receive():
+        message = await receive()
+        if message["type"] == "http.request":
+            scanner.feed(message.get("body", b""))
+            if not message.get("more_body", False):
+                scanner.finish()
+            if in_body:
+                await on_found(in_body[:], "body")
+                del in_body[:]
+        return message
+
+    return scanning_receive
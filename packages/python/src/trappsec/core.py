@@ -1,18 +1,40 @@
+import os
 import time
 import json
+import random
+import hashlib
 import typing
-import socket
+import inspect
 import logging
+import threading
+import contextlib
+import contextvars
 
 from .handlers import LogHandler
-from .builders import TrapBuilder, WatchBuilder, NO_DEFAULT
+from .builders import TrapBuilder, WordlistTrapBuilder, WatchBuilder, EscalationBuilder, NO_DEFAULT
+from .ruleset import Ruleset, RulesWatcher, parse_rules_file
+from .timeline import ActorTimeline
+from .counters import LocalCounters, SharedCounters
+from .profiling import CallbackProfiler
+from .canary import CanaryTokens
+from .networks import NetworkSet
+from .quarantine import Quarantine
+from .utils import after_fork_in_child, is_async
+
+# results of callbacks the async api awaited for the current request, by callback
+_resolved = contextvars.ContextVar("trappsec_resolved", default=None)
+# the event loop the async api runs on, blocking handlers are moved off it
+_event_loop = contextvars.ContextVar("trappsec_event_loop", default=None)
 
 class IdentityContext:
     def __init__(self):
         self.ip = None
         self.auth = None
 
-    def get_context(self, request_obj):
+    def get_ip(self, request_obj):
+        return self.ip(request_obj) if self.ip else None
+
+    def get_context(self, request_obj, ip=None):
         u, r = None, None
         
         if self.auth:
@@ -23,7 +45,7 @@ class IdentityContext:
         return {
             "user": u,
             "role": r,
-            "ip": self.ip(request_obj) if self.ip else None
+            "ip": ip if ip is not None else self.get_ip(request_obj)
         }
 
 class RequestContext:
@@ -45,7 +67,8 @@ class Sentry:
         if not self.logger.handlers:
             logging.basicConfig(format="%(message)s", level=logging.WARNING)
         
-        self.hostname = socket.gethostname()
+        # resolved with the first event, not at startup
+        self._hostname = None
         self.service = service
         self.environment = environment
 
@@ -57,7 +80,31 @@ class Sentry:
         self._traps = []
         self._watches = []
         self._templates = {}
+        self._file_rules = ([], [])
+        self._rules_watcher = None
+        self._ruleset = None
+        self._init_lock = threading.Lock()
         self._handlers = [LogHandler(self.logger)]
+        self._escalations = []
+        self._timeline = None
+        self._forward_signals = True
+        self._counters = LocalCounters()
+        self._rate_limit = None
+        self._dedup_window = None
+        self._profiler = None
+        self._canary = None
+        self._geoip = None
+        self._ignored_networks = None
+        self._quarantine = None
+        self._quarantine_trap = None
+        self._user_callback = None
+        self._ip_callback = None
+        self._shaper = None
+        self._beacon = None
+
+        # upper bound on tarpitted responses held open at once by integrations
+        # that pin a worker thread per connection (flask).
+        self.tarpit_limit = 16
 
         self.default_responses = {
             "authenticated": {
@@ -72,7 +119,31 @@ class Sentry:
             }
         }
 
-        self._register(app)
+        # without an app, trappsec.asgi / trappsec.wsgi middlewares attach themselves later
+        if app is not None:
+            self._register(app)
+        after_fork_in_child(self._after_fork)
+
+    def _after_fork(self):
+        # another thread may have held the lock at fork time
+        self._init_lock = threading.Lock()
+
+    def init_app(self):
+        """
+        compiles rules and installs integration hooks right away instead of on the
+        first request. safe to call more than once or from concurrent requests;
+        only the first call does any work.
+        """
+        if self._ruleset is not None:
+            return self
+
+        with self._init_lock:
+            if self._ruleset is None:
+                if self.integration is not None:
+                    self.integration.setup()
+                # publishing the ruleset marks initialization as done
+                self._compile_rules()
+        return self
     
     def template(self, name: str, status_code: int, response_body: dict, mime_type: str = "application/json"):
         self._templates[name] = {"status_code": status_code, "response_body": response_body, "mime_type": mime_type}
@@ -83,12 +154,75 @@ class Sentry:
         self._traps.append(builder)
         return builder
 
+    def traps_from_wordlist(self, source: typing.Union[str, typing.Iterable[str]], template: str = None, intent: str = None):
+        """
+        plants a trap on every path of a wordlist file (or iterable of paths),
+        read line by line. all of them share one trap config and are matched as
+        a single ruleset entry, so large scanner wordlists stay cheap. `template`
+        answers both authenticated and unauthenticated requests. returns the
+        builder, to configure responses, methods or a tarpit for all of them.
+        """
+        name = "wordlist:" + (os.path.basename(source) if isinstance(source, str) else str(len(self._traps)))
+        builder = WordlistTrapBuilder(self, source, name)
+        # wordlists are for scanners, so the template answers unauthenticated requests too
+        if template:
+            builder.respond(template=template).if_unauthenticated(template=template)
+        if intent:
+            builder.intent(intent)
+
+        self._traps.append(builder)
+        return builder
+
     def watch(self, path: str):
         builder = WatchBuilder(path)
         self._watches.append(builder)
         return builder
 
-    def add_webhook(self, url: str, secret: str = None, headers: dict = None, heartbeat_interval: int = None, template: typing.Callable = None):
+    def escalate(self, name: str):
+        builder = EscalationBuilder(name)
+        self._escalations.append(builder)
+        return builder
+
+    def timeline(self, key: str = "ip", max_actors: int = 10000, max_events: int = 32, ttl: float = 3600, forward_signals: bool = True):
+        """
+        keeps a bounded history of recent events per actor and evaluates escalation
+        rules against it. with `forward_signals=False`, unauthenticated signals are
+        only recorded and handlers receive alerts and escalations alone.
+        """
+        self._timeline = ActorTimeline([], key, max_actors, max_events, ttl)
+        self._forward_signals = forward_signals
+        return self
+
+    def rate_limit(self, max_events: int, per: float, key: str = "ip"):
+        """
+        emits at most `max_events` events per actor (`ip` or `user`) every `per`
+        seconds. with `user`, unauthenticated events are limited by ip.
+        """
+        if key not in ("ip", "user"):
+            raise ValueError("rate_limit: `key` must be 'ip' or 'user'.")
+        self._rate_limit = (max_events, per, key)
+        return self
+
+    def dedup(self, window: float):
+        """drops repeats of the same event from the same actor on the same path within `window` seconds."""
+        self._dedup_window = window
+        return self
+
+    def share_state(self, path: str = None, buckets: int = 8192):
+        """
+        keeps rate limit and dedup counters in a memory-mapped file so every worker
+        process on the host that uses the same `path` shares one budget. the
+        default path is per service. a file that can't be shared safely is logged
+        and the counters stay local to each process.
+        """
+        try:
+            self._counters = SharedCounters(path, buckets, self.service)
+        except (OSError, ValueError) as e:
+            self.logger.error(f"can't share counters, keeping them per process: {e}")
+        return self
+
+    def add_webhook(self, url: str, secret: str = None, headers: dict = None, heartbeat_interval: int = None, template: typing.Callable = None,
+                    codec: str = "json", batch_size: int = 1, flush_interval: float = 1.0):
         from .handlers import WebhookHandler
         handler = WebhookHandler(
             url=url, 
@@ -97,7 +231,10 @@ class Sentry:
             service=self.service, 
             environment=self.environment,
             heartbeat_interval=heartbeat_interval,
-            template=template
+            template=self._callback("webhook_template", template, lambda event: event) if template else None,
+            codec=codec,
+            batch_size=batch_size,
+            flush_interval=flush_interval,
         )
         self._handlers.append(handler)
         return self
@@ -108,13 +245,293 @@ class Sentry:
         return self
 
     def identify_user(self, callback: typing.Callable):
-        self.identity.auth = callback
+        """`callback` may be `async def` with the fastapi integration, asgi middleware and `atrigger`."""
+        self._user_callback = callback
+        self.identity.auth = self._callback("identify_user", callback, lambda r: None)
         return self
 
     def override_source_ip(self, callback: typing.Callable):
-        self.identity.ip = callback
+        self._ip_callback = callback
+        self.identity.ip = self._callback("override_source_ip", callback, lambda r: None)
+        return self
+
+    def profile_callbacks(self, budget_ms: float = None, trip_after: int = None, cooldown: float = 30, on_sample: typing.Callable = None):
+        """
+        times `identify_user`, `override_source_ip`, callable response bodies, callable
+        watch defaults and webhook templates. calls slower than `budget_ms` are logged,
+        `on_sample(name, seconds)` receives every timing and, with `trip_after`, a
+        callback over budget that many times in a row is replaced by its fallback
+        for `cooldown` seconds.
+        """
+        self._profiler = CallbackProfiler(budget_ms, trip_after, cooldown, on_sample)
         return self
 
+    def callback_stats(self):
+        return self._profiler.stats() if self._profiler else {}
+
+    def _run_callback(self, name, fn, arg, fallback):
+        resolved = _resolved.get()
+        if resolved is not None and fn in resolved:
+            return resolved[fn]
+
+        profiler = self._profiler
+        result = fn(arg) if profiler is None else profiler.call(name, fn, arg, fallback)
+
+        if inspect.isawaitable(result):
+            # nothing awaited this one: async callbacks need an async integration or api
+            if hasattr(result, "close"):
+                result.close()
+            self.logger.error(f"callback `{name}` is async, which is only supported with fastapi, the asgi middleware or atrigger.")
+            return fallback(arg)
+        return result
+
+    async def _arun_callback(self, name, fn, arg, fallback):
+        profiler = self._profiler
+        if profiler is not None:
+            return await profiler.acall(name, fn, arg, fallback)
+
+        result = fn(arg)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    @contextlib.contextmanager
+    def _using(self, resolved: dict):
+        # lets the sync event code below use callback results awaited beforehand
+        import asyncio
+
+        tokens = (_resolved.set(resolved), _event_loop.set(asyncio.get_running_loop()))
+        try:
+            yield
+        finally:
+            _event_loop.reset(tokens[1])
+            _resolved.reset(tokens[0])
+
+    async def _aresolve_identity(self, req, trap=None, user: bool = True) -> dict:
+        # identity callbacks are awaited up front and their results reused by the
+        # sync code. like there, identify_user isn't called for ignored networks.
+        resolved = {}
+        if self._ip_callback is not None:
+            resolved[self._ip_callback] = await self._arun_callback("override_source_ip", self._ip_callback, req, lambda r: None)
+
+        if user and self._user_callback is not None:
+            with self._using(resolved):
+                ip = self.identity.get_ip(req)
+            if not self._ignored(ip, trap):
+                resolved[self._user_callback] = await self._arun_callback("identify_user", self._user_callback, req, lambda r: None)
+        return resolved
+
+    async def _aget_ip(self, req):
+        resolved = await self._aresolve_identity(req, user=False)
+        with self._using(resolved):
+            return self.identity.get_ip(req)
+
+    async def _aresolve_body(self, req, response_config, resolved: dict):
+        body = response_config.get("response_body")
+        if is_async(body):
+            resolved[body] = await self._arun_callback("response_body", body, req, lambda r: {})
+
+    async def _aresolve_defaults(self, req, watch) -> dict:
+        resolved = {}
+        for default in watch.get("async_defaults") or ():
+            resolved[default] = await self._arun_callback("watch_default", default, req, lambda r: NO_DEFAULT)
+        return resolved
+
+    async def _aidentified(self, req, trigger, *args):
+        resolved = await self._aresolve_identity(req)
+        with self._using(resolved):
+            return trigger(req, *args)
+
+    async def atrigger(self, req, reason: str, intent: str = None, metadata: dict = None):
+        """
+        like `trigger`, for async code: `identify_user` and `override_source_ip`
+        may be `async def`, and handlers that block, such as an unbatched webhook,
+        run in the default executor instead of on the event loop.
+        """
+        await self._aidentified(req, self.trigger, reason, intent, metadata)
+
+    async def _atrigger_trap_event(self, req, trap):
+        resolved = await self._aresolve_identity(req, trap)
+        with self._using(resolved):
+            ip = self.identity.get_ip(req)
+            authenticated = not self._ignored(ip, trap) and self.identity.get_context(req, ip)["user"]
+            await self._aresolve_body(req, trap["response.authenticated" if authenticated else "response.unauthenticated"], resolved)
+            return self._trigger_trap_event(req, trap)
+
+    async def _atrigger_watch_event(self, req, found_fields):
+        await self._aidentified(req, self._trigger_watch_event, found_fields)
+
+    async def _atrigger_canary_event(self, req, canaries, location):
+        await self._aidentified(req, self._trigger_canary_event, canaries, location)
+
+    async def _acheck_quarantine(self, req):
+        resolved = await self._aresolve_identity(req, user=self._quarantine.key != "ip")
+        await self._aresolve_body(req, self._quarantine_trap["response.unauthenticated"], resolved)
+        with self._using(resolved):
+            return self._check_quarantine(req)
+
+    def _callback(self, name, fn, fallback):
+        return lambda arg: self._run_callback(name, fn, arg, fallback)
+
+    def beacon(self, secret: str, path: str = "/_trappsec/beacon", ttl: float = 86400, window: float = 5.0, intents: dict = None,
+               bind_ip: bool = False, max_queue: int = 10000, max_body: int = 65536, max_events: int = 50):
+        """
+        mounts an endpoint at `path` for client-side lures to report tampering with
+        `navigator.sendBeacon`. requests are answered with a 204 right away; batches
+        are verified against the page token from `beacon_token`, coalesced per actor
+        over `window` seconds and emitted as `trappsec.client_hit` events. `intents`
+        maps client event kinds to intents.
+        """
+        from .beacon import BeaconIngest
+
+        self._beacon = BeaconIngest(self, secret, path, ttl, window, intents, bind_ip, max_queue, max_body, max_events)
+        return self
+
+    def beacon_token(self, req) -> str:
+        """a signed token to render into pages that send beacons, naming the user (and with `bind_ip`, the ip) it was issued to."""
+        if self._beacon is None:
+            raise ValueError("beacon: call `beacon()` before issuing tokens.")
+        ip = self.identity.get_ip(req)
+        return self._beacon.tokens.issue(ip, self.identity.get_context(req, ip)["user"])
+
+    async def abeacon_token(self, req) -> str:
+        """like `beacon_token`, awaiting async identity callbacks."""
+        return await self._aidentified(req, self.beacon_token)
+
+    def shape_events(self, max_length: int = 1024, max_depth: int = 4, max_items: int = 32, max_bytes: int = 16384, lengths: dict = None):
+        """
+        bounds attacker controlled values (honey field values, metadata, path, user
+        agent, ...) before events reach any handler: long strings are truncated
+        and hashed, nested values capped in depth and items, and each event kept
+        under `max_bytes` serialized. off unless called; None disables a limit.
+        """
+        from .shaping import EventShaper
+        self._shaper = EventShaper(max_length, max_depth, max_items, max_bytes, lengths)
+        return self
+
+    def ignore_networks(self, networks: list):
+        """
+        drops every event from addresses in `networks` (cidrs or single addresses),
+        e.g. internal scanners and uptime probes, before identity resolution or any
+        handler runs. traps still answer them with their unauthenticated response.
+        """
+        self._ignored_networks = NetworkSet(networks) or None
+        return self
+
+    def _ignored(self, ip, trap=None) -> bool:
+        if ip is None:
+            return False
+        if self._ignored_networks is not None and ip in self._ignored_networks:
+            return True
+        return trap is not None and trap.get("ignore") is not None and ip in trap["ignore"]
+
+    def quarantine(self, ttl: float = 600, key: str = "ip", status: int = None, body: typing.Union[dict, typing.Callable] = None, mime_type: str = None, template: str = None,
+                   tarpit: float = None, max_actors: int = 100000):
+        """
+        once an actor (ip, user or both) trips a trap or watch, every request it
+        sends for the next `ttl` seconds is answered by trappsec before the
+        application routes, authenticates or parses it. the response defaults to
+        the unauthenticated trap response and can be dripped out over `tarpit` seconds.
+        """
+        builder = TrapBuilder(self, None).if_unauthenticated(status, body, mime_type, template)
+        if tarpit:
+            builder.tarpit(tarpit)
+
+        self._quarantine = Quarantine(ttl, key, max_actors)
+        self._quarantine_trap = builder.build()
+        return self
+
+    def release(self, ip: str = None, user: str = None):
+        """lifts the quarantine of an ip and/or user."""
+        if self._quarantine is not None:
+            self._quarantine.remove(ip, user)
+        return self
+
+    def _check_quarantine(self, req):
+        # returns the quarantine response for quarantined actors, None for everyone else
+        quarantine = self._quarantine
+        ip = self.identity.get_ip(req)
+        user = self.identity.get_context(req, ip)["user"] if quarantine.key != "ip" else None
+
+        for key in quarantine.keys(ip, user):
+            if quarantine.contains(key):
+                response_config = self._quarantine_trap["response.unauthenticated"]
+                return self._render_response(req, response_config), response_config
+        return None
+
+    def geoip(self, *paths: str, cache_size: int = 10000):
+        """
+        adds `geo` (country, asn, org) to every event with an ip, looked up in
+        local `.mmdb` files or sorted range files. later files fill in fields the
+        earlier ones lack, e.g. a country database followed by an asn database.
+        """
+        from .geoip import GeoIP
+        self._geoip = GeoIP(paths, cache_size)
+        return self
+
+    def canary_tokens(self, secret, prefix: str = "ak_", scan_body: bool = True):
+        """
+        replaces `{{canary}}` / `{{canary:<label>}}` in trap responses with signed
+        tokens naming the trap and the ip they were issued to, and alerts when one
+        comes back in the headers, query string or (with `scan_body`) body of any request.
+        """
+        self._canary = CanaryTokens(secret, prefix)
+        self._canary_scan_body = scan_body
+        return self
+
+    def load_rules(self, path: str, reload_interval: float = None):
+        """
+        loads traps, watches and templates from a json or yaml file. with
+        `reload_interval`, the file is polled for changes and the ruleset is
+        rebuilt and swapped in without restarting the application.
+        """
+        def reload():
+            file_rules = parse_rules_file(self, path)
+            # serialized with init_app and other reloads, so an older ruleset never
+            # replaces a newer one and watches are never indexed twice at once
+            with self._init_lock:
+                self._file_rules = file_rules
+                # before startup the integration compiles the ruleset itself
+                if self._ruleset is not None:
+                    self._compile_rules()
+
+        reload()
+        if reload_interval:
+            self._rules_watcher = RulesWatcher(path, reload_interval, reload)
+            self._rules_watcher.start()
+        return self
+
+    def _warn_shadowed_routes(self, ruleset, routes):
+        # traps are matched before routing, so a wordlist entry hides a route of the application
+        for template, methods in routes:
+            trap = ruleset.wordlist_for_route(template, methods)
+            if trap is not None:
+                self.logger.warning(f"`{trap['path']}` shadows the application route {template}, requests to it are answered by the trap")
+
+    def _compile_rules(self):
+        file_traps, file_watches = self._file_rules
+        if self._timeline is not None:
+            self._timeline.rules = [e.build() for e in self._escalations]
+
+        ruleset = Ruleset(self.traps + file_traps, self.watches + file_watches)
+        if self.integration is not None:
+            # watches are attached to the routes they match before requests can see them
+            self.integration.index_watches(ruleset)
+
+        self._ruleset = ruleset
+        return ruleset
+
+    @property
+    def hostname(self):
+        if self._hostname is None:
+            import socket
+            self._hostname = socket.gethostname()
+        return self._hostname
+
+    @hostname.setter
+    def hostname(self, value):
+        self._hostname = value
+
     @property
     def traps(self):
         return [d.build() if hasattr(d, "build") else d for d in self._traps]
@@ -124,7 +541,11 @@ class Sentry:
         return [r.build() if hasattr(r, "build") else r for r in self._watches]
 
     def trigger(self, req, reason: str, intent: str = None, metadata: dict = None):
-        identity_ctx = self.identity.get_context(req)
+        ip = self.identity.get_ip(req)
+        if self._ignored(ip):
+            return
+
+        identity_ctx = self.identity.get_context(req, ip)
         request_ctx = self.request.get_context(req)
 
         trigger_ctx = {
@@ -148,20 +569,73 @@ class Sentry:
         self._trigger(trigger_ctx)
 
     def _trigger(self, trigger_ctx):
+        # shaped first, so the timeline, counters and handlers only see bounded values
+        if self._shaper is not None:
+            self._shaper.shape(trigger_ctx)
+
         trigger_ctx["app"] = {
             "service": self.service,
             "environment": self.environment,
             "hostname": self.hostname
         }
 
+        if self._geoip is not None and trigger_ctx.get("ip"):
+            # a copy of the cached result, handlers and templates may modify it
+            trigger_ctx["geo"] = self._geoip.lookup(trigger_ctx["ip"])
+
+        escalations = self._timeline.record(trigger_ctx) if self._timeline is not None else []
+
+        if self._quarantine is not None and trigger_ctx["event"] in ("trappsec.trap_hit", "trappsec.watch_hit"):
+            self._quarantine.add(trigger_ctx.get("ip"), trigger_ctx.get("user"))
+
+        if (self._forward_signals or trigger_ctx["type"] != "signal") and self._allow(trigger_ctx):
+            self._emit(trigger_ctx)
+
+        for escalation_ctx in escalations:
+            escalation_ctx["app"] = trigger_ctx["app"]
+            if "geo" in trigger_ctx:
+                escalation_ctx["geo"] = trigger_ctx["geo"]
+            self._emit(escalation_ctx)
+
+    def _allow(self, trigger_ctx):
+        now = trigger_ctx["timestamp"]
+
+        if self._dedup_window:
+            key = f"{self.service}|dedup|{trigger_ctx.get('ip')}|{trigger_ctx.get('user')}|{trigger_ctx['event']}|{trigger_ctx.get('path')}"
+            if self._counters.incr(key, self._dedup_window, now) > 1:
+                return False
+
+        if self._rate_limit:
+            max_events, per, actor = self._rate_limit
+            # anonymous actors are limited by ip, never pooled into one budget
+            if trigger_ctx.get(actor) is None:
+                actor = "ip"
+            key = f"{self.service}|rate|{actor}|{trigger_ctx.get(actor)}"
+            if self._counters.incr(key, per, now) > max_events:
+                return False
+
+        return True
+
+    def _emit(self, trigger_ctx):
+        loop = _event_loop.get()
         for h in self._handlers: 
-            try: 
-                h.emit(trigger_ctx)
-            except Exception as e:
-                self.logger.error("error invoking log handler: ", e)
+            if loop is not None and getattr(h, "blocking", False):
+                loop.run_in_executor(None, self._emit_to, h, trigger_ctx)
+            else:
+                self._emit_to(h, trigger_ctx)
+
+    def _emit_to(self, handler, trigger_ctx):
+        try: 
+            handler.emit(trigger_ctx)
+        except Exception as e:
+            self.logger.error("error invoking log handler: ", e)
 
     def _trigger_watch_event(self, req, found_fields):
-        identity_ctx = self.identity.get_context(req)
+        ip = self.identity.get_ip(req)
+        if self._ignored(ip):
+            return
+
+        identity_ctx = self.identity.get_context(req, ip)
         request_ctx = self.request.get_context(req)
 
         trigger_ctx = {
@@ -182,8 +656,42 @@ class Sentry:
         
         self._trigger(trigger_ctx)
 
+    def _trigger_canary_event(self, req, canaries, location):
+        ip = self.identity.get_ip(req)
+        if self._ignored(ip):
+            return
+
+        identity_ctx = self.identity.get_context(req, ip)
+        request_ctx = self.request.get_context(req)
+        trap_ids = self._ruleset.trap_ids if self._ruleset is not None else {}
+
+        for canary in canaries:
+            trigger_ctx = {
+                "timestamp": time.time(),
+                "event": "trappsec.canary_reuse",
+                "type": "alert",
+                "path": request_ctx["path"],
+                "method": request_ctx["method"],
+                "user_agent": request_ctx["user_agent"],
+                "ip": identity_ctx["ip"],
+                "location": location,
+                "canary": dict(canary, trap=trap_ids.get(canary["trap_id"])),
+            }
+
+            if identity_ctx["user"]:
+                trigger_ctx["user"] = identity_ctx["user"]
+                trigger_ctx["role"] = identity_ctx["role"]
+
+            self._trigger(trigger_ctx)
+
     def _trigger_trap_event(self, req, trap):
-        identity_ctx = self.identity.get_context(req)
+        ip = self.identity.get_ip(req)
+        if self._ignored(ip, trap):
+            # no event, no identity lookup: answer as if unauthenticated
+            response_config = trap["response.unauthenticated"]
+            return self._render_response(req, response_config, (trap["path"], ip, None)), response_config
+
+        identity_ctx = self.identity.get_context(req, ip)
         request_ctx = self.request.get_context(req)
         
         trigger_ctx = {
@@ -208,17 +716,114 @@ class Sentry:
         self._trigger(trigger_ctx)
 
         response_config = trap[response_key]
+        response_body = self._cached_response(req, trap, response_key, identity_ctx, request_ctx)
+
+        # tokens are minted after the cache, so a shared entry never pins one actor's tokens
+        if self._canary is not None:
+            if response_config.get("stream") is not None:
+                response_body = (self._canary.render(chunk, trap["path"], identity_ctx["ip"]) for chunk in response_body)
+            else:
+                response_body = self._canary.render(response_body, trap["path"], identity_ctx["ip"])
+
+        return response_body, response_config
+
+    def _cached_response(self, req, trap, response_key, identity_ctx, request_ctx):
+        response_config = trap[response_key]
+        actor = (trap["path"], identity_ctx["ip"], identity_ctx["user"])
+
+        # streams are generated as they are sent and never buffered into the cache
+        cache = trap.get("cache")
+        if cache is None or response_config.get("stream") is not None:
+            return self._render_response(req, response_config, actor)
+
+        cache_key = self._response_cache_key(req, cache["key"], identity_ctx, request_ctx)
+        if cache_key is None:
+            return self._render_response(req, response_config, actor)
+
+        # authenticated and unauthenticated bodies never share an entry
+        cache_key = (response_key, cache_key)
+        response_body = cache["store"].get(cache_key)
+        if response_body is None:
+            response_body = self._render_response(req, response_config)
+            if isinstance(response_body, str):
+                response_body = response_body.encode("utf-8")
+            cache["store"].put(cache_key, response_body)
+
+        return response_body
+
+    def _render_response(self, req, response_config, actor=None):
+        if response_config.get("stream") is not None:
+            return self._render_stream(req, response_config["stream"], actor)
+
         response_body = response_config["response_body"]
 
         if callable(response_body):
-            response_body = response_body(req)
+            response_body = self._run_callback("response_body", response_body, req, lambda r: {})
         
         if response_config["mime_type"] == "application/json":
             response_body = json.dumps(response_body)
         
-        return response_body, response_config
-    
-    def _detect_honey_fields(self, data, rules, request_obj=None):
+        return response_body
+
+    def _render_stream(self, req, stream, actor=None):
+        # seeded from the trap and actor, so an actor gets the same data on every hit
+        if actor is None:
+            actor = (None, self.identity.get_ip(req), None)
+        seed = hashlib.blake2b("|".join(map(str, actor)).encode("utf-8"), digest_size=8).digest()
+        rng = random.Random(int.from_bytes(seed, "big"))
+
+        try:
+            chunks = iter(stream(rng))
+        except Exception as e:
+            self.logger.error(f"error starting response stream: {e}")
+            chunks = iter(())
+
+        # a generator failing midway ends the response instead of the worker
+        try:
+            for chunk in chunks:
+                yield chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+        except Exception as e:
+            self.logger.error(f"error streaming response: {e}")
+
+    def _response_cache_key(self, req, key, identity_ctx, request_ctx):
+        if key is None:
+            return ""
+        if key == "path":
+            return (key, request_ctx["path"])
+        if key in ("ip", "user", "role"):
+            return (key, identity_ctx[key])
+
+        # an uncacheable request is still answered, just not from the cache
+        try:
+            cache_key = self._run_callback("response_cache_key", key, req, lambda r: None)
+        except Exception as e:
+            self.logger.error(f"error computing response cache key: {e}")
+            return None
+
+        try:
+            hash(cache_key)
+        except TypeError:
+            self.logger.error(f"response cache key must be hashable, got {type(cache_key).__name__}")
+            return None
+        return cache_key
+
+    def _tarpit_chunks(self, response_body, tarpit):
+        # splits a trap response into `drip_bytes` sized chunks and the pause
+        # between them so the whole body takes roughly `delay` seconds to send.
+        if hasattr(response_body, "__next__"):
+            # the size of a stream isn't known up front, so every chunk it yields waits `delay`
+            return response_body, tarpit["delay"]
+
+        if isinstance(response_body, str):
+            response_body = response_body.encode("utf-8")
+        elif response_body is None:
+            response_body = b""
+
+        size = tarpit["drip_bytes"]
+        chunks = [response_body[i:i + size] for i in range(0, len(response_body), size)] or [b""]
+        return chunks, tarpit["delay"] / len(chunks)
+
+    def _detect_honey_fields(self, data, rules, request_obj=None, field_type="body"):
         found_fields = []
 
         for key in list(data.keys()):
@@ -228,17 +833,18 @@ class Sentry:
                 
                 try:
                     if callable(expected):
-                        expected = expected(request_obj)
+                        # falling back to NO_DEFAULT alerts on presence rather than missing a hit
+                        expected = self._run_callback("watch_default", expected, request_obj, lambda r: NO_DEFAULT)
                     
                     if expected is NO_DEFAULT or data[key] != expected:
                         found_fields.append({
-                            "type": "body",
+                            "type": field_type,
                             "field": key,
                             "value": data[key],
                             "intent": rule_definition.get("intent", None),
                         })
                 except Exception as e:
-                    self.logger.error(f"failed to evaluate callable expected value for body field `{key}`: ", e)            
+                    self.logger.error(f"failed to evaluate callable expected value for {field_type} field `{key}`: ", e)            
 
                 del data[key]
         return data, found_fields
@@ -254,4 +860,4 @@ class Sentry:
             from .integrations.flask import FlaskIntegration
             self.integration = FlaskIntegration(self, app)
         else:
-            raise Exception("trappsec error: unknown framework.")
\ No newline at end of file
+            raise Exception("trappsec error: unknown framework, use trappsec.asgi or trappsec.wsgi instead.")
\ No newline at end of file
@@ -0,0 +1,143 @@
+import os
+import re
+import mmap
+import stat
+import struct
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+from .utils import after_fork_in_child
+
+def _key_hash(key: str) -> int:
+    # stable across processes, unlike hash(); 0 is reserved for empty slots
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+class LocalCounters:
+    """fixed-window counters kept in this process, bounded to `capacity` keys."""
+    def __init__(self, capacity: int = 65536):
+        self.capacity = capacity
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+        after_fork_in_child(self._after_fork)
+
+    def _after_fork(self):
+        # another thread may have held the lock at fork time
+        self._lock = threading.Lock()
+
+    def incr(self, key: str, window: float, now: float) -> int:
+        window_id = int(now // window)
+        with self._lock:
+            current = self._counts.pop(key, None)
+            count = current[1] + 1 if current and current[0] == window_id else 1
+            self._counts[key] = (window_id, count)
+
+            if len(self._counts) > self.capacity:
+                self._counts.popitem(last=False)
+        return count
+
+class SharedCounters:
+    """
+    fixed-window counters in a memory-mapped file shared by every process on the
+    host that opens the same path, e.g. all workers of a preforking server.
+
+    the file starts with a header (magic, bucket count) followed by a fixed-size
+    hash table of buckets holding `BUCKET_SLOTS` slots of (key hash, window id,
+    count, expiry). a bucket is updated under an exclusive `fcntl.lockf` range
+    lock on its bytes, so concurrent workers never interleave updates to the same
+    bucket. a full bucket evicts the slot expiring first.
+
+    a file is only ever sized when it is created: one with another layout, or
+    owned by another user, is refused with a ValueError rather than resized
+    under the processes that have it mapped.
+    """
+    MAGIC = b"TSCOUNT1"
+    HEADER = struct.Struct("<8sQ")
+    SLOT = struct.Struct("<QQII")
+    BUCKET_SLOTS = 8
+
+    def __init__(self, path: str = None, buckets: int = 8192, name: str = None):
+        import fcntl
+
+        self._fcntl = fcntl
+        if path is None:
+            # one file per service, so services on the same host never share a layout
+            suffix = "-" + re.sub(r"[^A-Za-z0-9_.-]", "_", name) if name else ""
+            directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+            path = os.path.join(directory, f"trappsec-counters{suffix}")
+        self.path = path
+        self.buckets = buckets
+        self.bucket_size = self.SLOT.size * self.BUCKET_SLOTS
+
+        size = self.HEADER.size + self.bucket_size * buckets
+        # the default directory is world writable, never follow a planted symlink
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0), 0o600)
+        try:
+            self._check_owner()
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                self._check_layout(size)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+        self._map = mmap.mmap(self._fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        # record locks are per process, threads of one worker still need a local lock
+        self._lock = threading.Lock()
+        after_fork_in_child(self._after_fork)
+
+    def _after_fork(self):
+        # another thread may have held the lock at fork time. the mapping is
+        # inherited, and record locks are never held across a fork
+        self._lock = threading.Lock()
+
+    def _check_owner(self):
+        st = os.fstat(self._fd)
+        if not stat.S_ISREG(st.st_mode) or st.st_uid != os.getuid():
+            raise ValueError(f"share_state: '{self.path}' is not a regular file owned by this user.")
+
+    def _check_layout(self, size):
+        st_size = os.fstat(self._fd).st_size
+        if st_size == 0:
+            # created just now, nobody has it mapped yet
+            os.ftruncate(self._fd, size)
+            os.pwrite(self._fd, self.HEADER.pack(self.MAGIC, self.buckets), 0)
+            return
+
+        header = os.pread(self._fd, self.HEADER.size, 0)
+        if st_size != size or len(header) != self.HEADER.size or self.HEADER.unpack(header) != (self.MAGIC, self.buckets):
+            raise ValueError(f"share_state: '{self.path}' was created with another layout, use another path or the same `buckets`.")
+
+    def incr(self, key: str, window: float, now: float) -> int:
+        key_hash = _key_hash(key)
+        window_id = int(now // window)
+        expires = int((window_id + 1) * window) + 1
+        offset = self.HEADER.size + (key_hash % self.buckets) * self.bucket_size
+
+        with self._lock:
+            self._fcntl.lockf(self._fd, self._fcntl.LOCK_EX, self.bucket_size, offset)
+            try:
+                return self._incr(key_hash, window_id, expires, offset)
+            finally:
+                self._fcntl.lockf(self._fd, self._fcntl.LOCK_UN, self.bucket_size, offset)
+
+    def _incr(self, key_hash, window_id, expires, offset):
+        victim, victim_expires = None, None
+        for i in range(self.BUCKET_SLOTS):
+            slot = offset + i * self.SLOT.size
+            h, w, count, slot_expires = self.SLOT.unpack_from(self._map, slot)
+
+            if h == key_hash:
+                count = count + 1 if w == window_id else 1
+                self.SLOT.pack_into(self._map, slot, key_hash, window_id, count, expires)
+                return count
+
+            # empty slots expire at 0, so they are always picked first
+            if victim is None or slot_expires < victim_expires:
+                victim, victim_expires = slot, slot_expires
+
+        self.SLOT.pack_into(self._map, victim, key_hash, window_id, 1, expires)
+        return 1
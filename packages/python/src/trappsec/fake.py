@@ -0,0 +1,126 @@
+"""
+deterministic fake datasets for streamed trap responses:
+
+    from trappsec.fake import FakeRecords
+
+    users = FakeRecords({"id": "id", "name": "name", "email": "email", "created_at": "datetime"}, count=50000)
+    ts.trap("/api/v1/users/export").respond(200, stream=users)
+
+records are generated batch by batch as the response is sent, so memory stays
+constant whatever `count` is. every record is drawn from the `random.Random`
+the trap seeds per actor, so the same actor gets the same dataset back.
+"""
+import io
+import csv
+import json
+import string
+import datetime
+
+FIRST_NAMES = ("james", "mary", "robert", "patricia", "john", "jennifer", "michael", "linda", "david", "elizabeth",
+               "william", "barbara", "richard", "susan", "joseph", "jessica", "thomas", "sarah", "priya", "wei",
+               "carlos", "fatima", "hiroshi", "olga", "ahmed", "ana", "lukas", "chloe", "arjun", "mei")
+LAST_NAMES = ("smith", "johnson", "williams", "brown", "jones", "garcia", "miller", "davis", "rodriguez", "martinez",
+              "hernandez", "lopez", "wilson", "anderson", "thomas", "taylor", "moore", "jackson", "patel", "nguyen",
+              "kim", "mueller", "rossi", "silva", "kowalski", "tanaka", "cohen", "okafor", "singh", "novak")
+DOMAINS = ("gmail.com", "outlook.com", "yahoo.com", "icloud.com", "proton.me", "fastmail.com")
+COMPANIES = ("acme", "globex", "initech", "umbrella", "hooli", "vandelay", "stark", "wayne", "tyrell", "cyberdyne")
+COUNTRIES = ("US", "GB", "DE", "FR", "IN", "JP", "BR", "CA", "AU", "NL", "ES", "SG")
+ROLES = ("user", "user", "user", "user", "editor", "billing", "support", "admin")
+
+# records are dated within the five years before this instant, independent of the clock
+_EPOCH = 1704067200
+_SPAN = 5 * 365 * 86400
+
+def _name(rng):
+    return f"{rng.choice(FIRST_NAMES).title()} {rng.choice(LAST_NAMES).title()}"
+
+def _email(rng):
+    return f"{rng.choice(FIRST_NAMES)}.{rng.choice(LAST_NAMES)}{rng.randint(1, 99)}@{rng.choice(DOMAINS)}"
+
+def _uuid(rng):
+    h = "%032x" % rng.getrandbits(128)
+    return f"{h[:8]}-{h[8:12]}-4{h[13:16]}-{'89ab'[int(h[16], 16) % 4]}{h[17:20]}-{h[20:]}"
+
+def _datetime(rng):
+    ts = _EPOCH - rng.randint(0, _SPAN)
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+KINDS = {
+    "id": lambda rng, i: i + 1,
+    "int": lambda rng, i: rng.randint(0, 1000000),
+    "uuid": lambda rng, i: _uuid(rng),
+    "name": lambda rng, i: _name(rng),
+    "first_name": lambda rng, i: rng.choice(FIRST_NAMES).title(),
+    "last_name": lambda rng, i: rng.choice(LAST_NAMES).title(),
+    "email": lambda rng, i: _email(rng),
+    "username": lambda rng, i: f"{rng.choice(FIRST_NAMES)}{rng.choice(LAST_NAMES)[:3]}{rng.randint(1, 999)}",
+    "phone": lambda rng, i: f"+1-{rng.randint(200, 989)}-{rng.randint(200, 999)}-{rng.randint(0, 9999):04d}",
+    "ip": lambda rng, i: f"{rng.randint(11, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+    "date": lambda rng, i: _datetime(rng)[:10],
+    "datetime": lambda rng, i: _datetime(rng),
+    "bool": lambda rng, i: rng.random() < 0.5,
+    "amount": lambda rng, i: round(rng.uniform(1, 5000), 2),
+    "country": lambda rng, i: rng.choice(COUNTRIES),
+    "company": lambda rng, i: f"{rng.choice(COMPANIES).title()} {rng.choice(('Inc', 'LLC', 'Ltd', 'GmbH'))}",
+    "role": lambda rng, i: rng.choice(ROLES),
+    "password_hash": lambda rng, i: "$2b$12$" + "".join(rng.choice(string.ascii_letters + string.digits + "./") for _ in range(53)),
+    "api_key": lambda rng, i: "%040x" % rng.getrandbits(160),
+    # minted into a real canary token when canary tokens are enabled
+    "canary": lambda rng, i: "{{canary}}",
+}
+
+class FakeRecords:
+    """
+    a stream factory yielding `count` fake records as a json array or csv,
+    `batch` records per chunk. `fields` maps column names to one of `KINDS`, a
+    list or tuple to pick from, or a function of `(rng, index)`.
+    """
+    def __init__(self, fields: dict, count: int = 1000, format: str = "json", batch: int = 100):
+        if format not in ("json", "csv"):
+            raise ValueError("fake_records: `format` must be 'json' or 'csv'.")
+        if count < 0 or batch < 1:
+            raise ValueError("fake_records: `count` can't be negative and `batch` must be at least 1.")
+
+        self.fields = []
+        for name, kind in fields.items():
+            if isinstance(kind, (list, tuple)):
+                choices = tuple(kind)
+                kind = lambda rng, i, choices=choices: rng.choice(choices)
+            elif not callable(kind):
+                if kind not in KINDS:
+                    raise ValueError(f"fake_records: unknown kind '{kind}' for field '{name}'.")
+                kind = KINDS[kind]
+            self.fields.append((name, kind))
+
+        self.count = count
+        self.format = format
+        self.batch = batch
+        self.mime_type = "application/json" if format == "json" else "text/csv"
+
+    def record(self, rng, i: int) -> dict:
+        return {name: kind(rng, i) for name, kind in self.fields}
+
+    def __call__(self, rng):
+        return self._csv(rng) if self.format == "csv" else self._json(rng)
+
+    def _json(self, rng):
+        yield "["
+        for start in range(0, self.count, self.batch):
+            records = (json.dumps(self.record(rng, i)) for i in range(start, min(start + self.batch, self.count)))
+            yield ("," if start else "") + ",".join(records)
+        yield "]"
+
+    def _csv(self, rng):
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow([name for name, _ in self.fields])
+
+        for start in range(0, self.count, self.batch):
+            for i in range(start, min(start + self.batch, self.count)):
+                writer.writerow(self.record(rng, i).values())
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+
+        if out.tell():
+            yield out.getvalue()
@@ -0,0 +1,331 @@
+import mmap
+import struct
+import threading
+import ipaddress
+from collections import OrderedDict
+
+from .utils import after_fork_in_child
+
+_METADATA_MARKER = b"\xab\xcd\xefMaxMind.com"
+def _address(ip: str):
+    # ipv4-mapped ipv6 addresses (::ffff:a.b.c.d) are looked up as the ipv4 address
+    address = ipaddress.ip_address(ip)
+    if address.version == 6 and address.ipv4_mapped is not None:
+        return address.ipv4_mapped
+    return address
+
+_FIELDS = ("country", "registered_country", "autonomous_system_number", "autonomous_system_organization", "organization")
+
+class MMDBReader:
+    """
+    minimal reader for maxmind db (`.mmdb`) files. the file is memory-mapped
+    read-only, so every worker of a preforking server shares the same pages
+    through the page cache, and a lookup walks the search tree in place.
+    """
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        start = self._map.rfind(_METADATA_MARKER, max(0, len(self._map) - 128 * 1024))
+        if start < 0:
+            raise ValueError(f"geoip: '{path}' is not a maxmind db file.")
+
+        start += len(_METADATA_MARKER)
+        metadata, _ = self._decode(start, start)
+
+        self.node_count = metadata["node_count"]
+        self.record_size = metadata["record_size"]
+        self.ip_version = metadata["ip_version"]
+        if self.record_size not in (24, 28, 32):
+            raise ValueError(f"geoip: unsupported record size {self.record_size}.")
+
+        self.node_size = self.record_size // 4
+        self.data_start = self.node_count * self.node_size + 16
+
+        # ipv4 addresses live under 96 leading zero bits of an ipv6 tree
+        self.ipv4_start = 0
+        if self.ip_version == 6:
+            node = 0
+            for _ in range(96):
+                if node >= self.node_count:
+                    break
+                node = self._record(node, 0)
+            self.ipv4_start = node
+
+    def _record(self, node: int, bit: int) -> int:
+        m, offset = self._map, node * self.node_size
+        if self.record_size == 24:
+            offset += bit * 3
+            return (m[offset] << 16) | (m[offset + 1] << 8) | m[offset + 2]
+        if self.record_size == 28:
+            middle = m[offset + 3]
+            if bit:
+                return ((middle & 0x0F) << 24) | (m[offset + 4] << 16) | (m[offset + 5] << 8) | m[offset + 6]
+            return ((middle & 0xF0) << 20) | (m[offset] << 16) | (m[offset + 1] << 8) | m[offset + 2]
+        return struct.unpack_from(">I", m, offset + bit * 4)[0]
+
+    def _find(self, ip: str):
+        # offset of the data record for `ip` in the search tree, if any
+        address = _address(ip)
+        if address.version == 6 and self.ip_version == 4:
+            return None
+
+        bits = address.max_prefixlen
+        value = int(address)
+        node = self.ipv4_start if address.version == 4 else 0
+
+        for i in range(bits):
+            if node >= self.node_count:
+                break
+            node = self._record(node, (value >> (bits - 1 - i)) & 1)
+
+        if node <= self.node_count:
+            return None
+        return self.data_start + node - self.node_count - 16
+
+    def get(self, ip: str):
+        offset = self._find(ip)
+        return None if offset is None else self._decode(offset, self.data_start)[0]
+
+    def enrich(self, ip: str) -> dict:
+        """like `get`, but only decodes the fields events are enriched with."""
+        offset = self._find(ip)
+        if offset is None:
+            return {}
+
+        record = self._select(offset, _FIELDS)
+        for key in ("country", "registered_country"):
+            iso_code = self._select(record[key], ("iso_code",)).get("iso_code") if key in record else None
+            record[key] = self._decode(iso_code, self.data_start)[0] if iso_code is not None else None
+        for key in _FIELDS[2:]:
+            if key in record:
+                record[key] = self._decode(record[key], self.data_start)[0]
+        return _enrichment(record)
+
+    def _select(self, offset, wanted) -> dict:
+        # offsets of the wanted keys of the map at `offset`, other values are skipped
+        base = self.data_start
+        ctrl = self._map[offset]
+        if ctrl >> 5 == 1:
+            offset = self._pointer(ctrl, offset + 1, base)[0]
+            ctrl = self._map[offset]
+        if ctrl >> 5 != 7:
+            return {}
+
+        size, offset = self._size(ctrl, offset + 1)
+        found = {}
+        for _ in range(size):
+            key, offset = self._decode(offset, base)
+            if key in wanted:
+                found[key] = offset
+            offset = self._skip(offset)
+        return found
+
+    def _skip(self, offset) -> int:
+        m = self._map
+        ctrl = m[offset]
+        offset += 1
+        kind = ctrl >> 5
+
+        if kind == 1:
+            return offset + ((ctrl >> 3) & 0x3) + 1
+        if kind == 0:
+            kind = 7 + m[offset]
+            offset += 1
+
+        size, offset = self._size(ctrl, offset)
+        if kind == 7:
+            for _ in range(size * 2):
+                offset = self._skip(offset)
+            return offset
+        if kind == 11:
+            for _ in range(size):
+                offset = self._skip(offset)
+            return offset
+        if kind == 3:
+            return offset + 8
+        if kind == 15:
+            return offset + 4
+        if kind == 14:
+            return offset
+        return offset + size
+
+    def _pointer(self, ctrl, offset, base):
+        size = (ctrl >> 3) & 0x3
+        tail = int.from_bytes(self._map[offset:offset + size + 1], "big")
+        if size == 0:
+            target = ((ctrl & 0x7) << 8) | tail
+        elif size == 1:
+            target = (((ctrl & 0x7) << 16) | tail) + 2048
+        elif size == 2:
+            target = (((ctrl & 0x7) << 24) | tail) + 526336
+        else:
+            target = tail
+        return base + target, offset + size + 1
+
+    def _size(self, ctrl, offset):
+        size = ctrl & 0x1F
+        if size < 29:
+            return size, offset
+        if size == 29:
+            return 29 + self._map[offset], offset + 1
+        if size == 30:
+            return 285 + int.from_bytes(self._map[offset:offset + 2], "big"), offset + 2
+        return 65821 + int.from_bytes(self._map[offset:offset + 3], "big"), offset + 3
+
+    def _decode(self, offset, base):
+        m = self._map
+        ctrl = m[offset]
+        offset += 1
+        kind = ctrl >> 5
+
+        if kind == 1:
+            # pointer into the data section, the value after it is unaffected
+            target, offset = self._pointer(ctrl, offset, base)
+            return self._decode(target, base)[0], offset
+
+        if kind == 0:
+            kind = 7 + m[offset]
+            offset += 1
+
+        size, offset = self._size(ctrl, offset)
+
+        if kind == 2:
+            return m[offset:offset + size].decode("utf-8"), offset + size
+        if kind == 3:
+            return struct.unpack_from(">d", m, offset)[0], offset + 8
+        if kind == 4:
+            return m[offset:offset + size], offset + size
+        if kind in (5, 6, 9, 10):
+            return int.from_bytes(m[offset:offset + size], "big"), offset + size
+        if kind == 7:
+            result = {}
+            for _ in range(size):
+                key, offset = self._decode(offset, base)
+                result[key], offset = self._decode(offset, base)
+            return result, offset
+        if kind == 8:
+            return int.from_bytes(m[offset:offset + size], "big", signed=size == 4), offset + size
+        if kind == 11:
+            result = []
+            for _ in range(size):
+                value, offset = self._decode(offset, base)
+                result.append(value)
+            return result, offset
+        if kind == 14:
+            return bool(size), offset
+        if kind == 15:
+            return struct.unpack_from(">f", m, offset)[0], offset + 4
+
+        raise ValueError(f"geoip: unexpected data type {kind}.")
+
+class RangeReader:
+    """
+    reader for a plain text range file sorted by start address, one range per
+    line: `start,end,country,asn,org` (the last three may be empty). the file is
+    memory-mapped and binary searched by byte offset, so it is never loaded.
+    """
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _line_at(self, offset: int):
+        # the line starting at or after `offset`
+        if offset > 0:
+            offset = self._map.find(b"\n", offset - 1) + 1
+            if offset == 0:
+                return None, len(self._map)
+
+        end = self._map.find(b"\n", offset)
+        if end < 0:
+            end = len(self._map)
+        return self._map[offset:end], end + 1
+
+    def _range_at(self, offset: int):
+        # the first range line at or after `offset`, skipping headers and blank lines
+        while True:
+            line, offset = self._line_at(offset)
+            if line is None:
+                return None, None, offset
+
+            fields = line.decode("utf-8").rstrip("\r").split(",", 4)
+            try:
+                return fields, self._key(ipaddress.ip_address(fields[0])), offset
+            except ValueError:
+                if offset > len(self._map):
+                    return None, None, offset
+
+    @staticmethod
+    def _key(address):
+        return (address.version, int(address))
+
+    def enrich(self, ip: str) -> dict:
+        key = self._key(_address(ip))
+
+        # find the last line whose start address is <= ip
+        lo, hi, best = 0, len(self._map), None
+        while lo < hi:
+            mid = (lo + hi) // 2
+            fields, start, next_offset = self._range_at(mid)
+            if fields is not None and start <= key:
+                best, lo = fields, next_offset
+            else:
+                hi = mid
+
+        if best is None or len(best) < 2 or self._key(ipaddress.ip_address(best[1])) < key:
+            return {}
+
+        best += [""] * (5 - len(best))
+        return {
+            "country": best[2] or None,
+            "asn": int(best[3]) if best[3] else None,
+            "org": best[4] or None,
+        }
+
+def _enrichment(record) -> dict:
+    # country, city and asn databases keep these under different names
+    return {
+        "country": record.get("country") or record.get("registered_country"),
+        "asn": record.get("autonomous_system_number"),
+        "org": record.get("autonomous_system_organization") or record.get("organization"),
+    }
+
+class GeoIP:
+    """
+    looks addresses up in one or more `.mmdb` / range files, later files filling
+    fields the earlier ones didn't have. results go into a per-process lru
+    bounded to `cache_size` addresses. every caller gets its own copy of the
+    cached result, so an event that is modified can't change the next one.
+    """
+    def __init__(self, paths, cache_size: int = 10000):
+        self.readers = [RangeReader(p) if not p.endswith(".mmdb") else MMDBReader(p) for p in paths]
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        after_fork_in_child(self._after_fork)
+
+    def _after_fork(self):
+        # another thread may have held the lock at fork time
+        self._lock = threading.Lock()
+
+    def lookup(self, ip: str) -> dict:
+        with self._lock:
+            result = self._cache.get(ip)
+            if result is not None:
+                self._cache.move_to_end(ip)
+                return dict(result)
+
+        result = {}
+        try:
+            for reader in self.readers:
+                for key, value in reader.enrich(ip).items():
+                    if value is not None and key not in result:
+                        result[key] = value
+        except ValueError:
+            pass
+
+        with self._lock:
+            self._cache[ip] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return dict(result)
@@ -3,17 +3,21 @@ import json
 import hmac
 import hashlib
 import threading
+import atexit
 import time
+from collections import deque
 
-try:
-    import requests
-    from requests.adapters import HTTPAdapter
-    from urllib3.util.retry import Retry
-except ImportError:
-    requests = None
+from .utils import after_fork_in_child
+from .wire import EventCodec
+
+# optional dependencies are imported by the handlers using them, so services
+# that only log don't pay for loading them
 
 
 class BaseHandler:
+    # handlers doing blocking i/o in `emit` are run off the event loop by the async api
+    blocking = False
+
     def emit(self, event: dict): raise NotImplementedError
 
 class LogHandler(BaseHandler):
@@ -23,9 +27,20 @@ class LogHandler(BaseHandler):
         self.logger.warning(json.dumps(event))
 
 class WebhookHandler(BaseHandler):
-    def __init__(self, url: str, secret: str = None, headers: dict = None, service: str = None, environment: str = None, heartbeat_interval: int = None, template: callable = None):
-        if requests is None: 
+    """
+    posts events to a url. with the default `json` codec and `batch_size=1`,
+    every event is posted as its own json document. otherwise events are sent
+    as `wire` envelopes encoded with `codec`, up to `batch_size` per request,
+    flushed from a background thread at least every `flush_interval` seconds.
+    """
+    def __init__(self, url: str, secret: str = None, headers: dict = None, service: str = None, environment: str = None, heartbeat_interval: int = None, template: callable = None,
+                 codec: str = "json", batch_size: int = 1, flush_interval: float = 1.0, max_pending: int = 10000):
+        try:
+            import requests
+        except ImportError:
             raise ImportError("requests library required for WebhookHandler")
+        if batch_size < 1:
+            raise ValueError("webhook: `batch_size` must be at least 1.")
         
         self.url = url
         self.secret = secret
@@ -33,15 +48,42 @@ class WebhookHandler(BaseHandler):
         self.environment = environment
         self.template = template
         self.logger = logging.getLogger("trappsec")
+
+        self.codec = EventCodec(codec)
+        self.enveloped = codec != "json" or batch_size > 1
+        # batched events are posted from a background thread
+        self.blocking = batch_size == 1
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
         
-        self.headers = {"Content-Type": "application/json"}
+        self.headers = {"Content-Type": self.codec.content_type}
         self.headers.update(headers or {})
-        
+        self.heartbeat_interval = heartbeat_interval
+
+        self._start()
+        # sessions and threads don't survive a fork, rebuild them in each worker
+        after_fork_in_child(self._start)
+        if batch_size > 1:
+            atexit.register(self.flush)
+
+    def _start(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
         self.session = requests.Session()
         self.session.mount("https://", HTTPAdapter(max_retries=Retry(total=3, backoff_factor=1)))
 
-        if heartbeat_interval:
-            threading.Thread(target=self._heartbeat_loop, args=(heartbeat_interval,), daemon=True).start()
+        if self.heartbeat_interval:
+            threading.Thread(target=self._heartbeat_loop, args=(self.heartbeat_interval,), daemon=True).start()
+
+        if self.batch_size > 1:
+            # the oldest events are dropped once `max_pending` are queued
+            self._pending = deque(maxlen=self.max_pending)
+            self._lock = threading.Lock()
+            self._wakeup = threading.Event()
+            threading.Thread(target=self._flush_loop, daemon=True).start()
     
     def emit(self, event: dict):
         if self.template:
@@ -49,44 +91,76 @@ class WebhookHandler(BaseHandler):
                 event = self.template(event)
             except Exception as e:
                 self.logger.error(f"Failed to apply webhook template: {e}")
-        
-        payload = json.dumps(event)
-        self._send(payload)
+
+        if self.batch_size > 1:
+            self._enqueue(event)
+        elif self.enveloped:
+            self._send(self.codec.encode([event]))
+        else:
+            self._send(json.dumps(event))
+
+    def _enqueue(self, event: dict):
+        with self._lock:
+            if len(self._pending) == self.max_pending:
+                self.logger.error("webhook queue is full, dropping the oldest event")
+            self._pending.append(event)
+            full = len(self._pending) >= self.batch_size
+
+        if full:
+            self._wakeup.set()
+
+    def _flush_loop(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """sends every queued event right away."""
+        while True:
+            with self._lock:
+                pending = self._pending
+                batch = [pending.popleft() for _ in range(min(self.batch_size, len(pending)))]
+            if not batch:
+                return
+            self._send(self.codec.encode(batch))
 
     def _heartbeat_loop(self, interval: int):
         while True:
             time.sleep(interval)
-            payload = json.dumps({
+            heartbeat = {
                 "timestamp": time.time(),
                 "event": "trappsec.heartbeat",
                 "service": self.service,
                 "environment": self.environment,
-            })
-            self._send(payload)
+            }
+            self._send(self.codec.encode([heartbeat]) if self.enveloped else json.dumps(heartbeat))
+
+    def _send(self, payload):
+        if isinstance(payload, str):
+            payload = payload.encode()
 
-    def _send(self, payload: str):
         headers = self.headers.copy()
         if self.secret:
+            # the signature covers the exact bytes sent, whatever the codec
             headers["x-trappsec-signature"] = hmac.new(
-                self.secret.encode(), payload.encode(), hashlib.sha256).hexdigest()
+                self.secret.encode(), payload, hashlib.sha256).hexdigest()
         
         try:
             self.session.post(self.url, data=payload, headers=headers, timeout=5)
         except Exception as e: 
             self.logger.error(f"Failed to send webhook: {e}")
 
-try:
-    from opentelemetry import trace
-except ImportError:
-    trace = None
-
 class OTELHandler(BaseHandler):
     def __init__(self):
-        if trace is None: 
+        try:
+            from opentelemetry import trace
+        except ImportError:
             raise ImportError("opentelemetry-api library required for OTELHandler")
+        self.trace = trace
 
     def emit(self, event: dict):
-        current_span = trace.get_current_span()
+        current_span = self.trace.get_current_span()
         if current_span.is_recording():
             current_span.set_attribute("trappsec.detected", True)
             current_span.set_attribute("trappsec.event", event["event"])
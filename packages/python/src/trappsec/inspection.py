@@ -0,0 +1,41 @@
+import json
+
+from .query import parse_query, strip_query
+
+# bodies above this size are passed through uninspected by the raw middlewares
+MAX_BODY_SIZE = 1024 * 1024
+
+def inspect_query(ts, req, raw: bytes, watch):
+    """returns the watched fields found in a raw query string and the query string without them."""
+    prefilter = watch["query_prefilter"]
+    if prefilter is None or not prefilter.search(raw):
+        return [], None
+
+    # only parse the query when a watched name may be present
+    query_fields = watch["query_fields"]
+    _, found = ts._detect_honey_fields(parse_query(raw), query_fields, req, "query")
+    return found, strip_query(raw, query_fields) if found else None
+
+def inspect_body(ts, req, body: bytes, content_type: str, watch):
+    """returns the watched fields found in a json or urlencoded body and the body without them."""
+    body_fields = watch["body_fields"]
+
+    if "application/json" in content_type:
+        try:
+            data = json.loads(body)
+        except ValueError as e:
+            ts.logger.error("error reading json body: %s", e)
+            return [], None
+
+        if not isinstance(data, dict):
+            return [], None
+
+        data, found = ts._detect_honey_fields(data, body_fields, req)
+        return found, json.dumps(data).encode("utf-8") if found else None
+
+    if "application/x-www-form-urlencoded" in content_type:
+        form = {k: v[0] for k, v in parse_query(body).items()}
+        _, found = ts._detect_honey_fields(form, body_fields, req)
+        return found, strip_query(body, body_fields) if found else None
+
+    return [], None
@@ -1,10 +1,9 @@
-from functools import partial
+from ..canary import scan_scope
 
 class FastAPIIntegration:
     def __init__(self, ts, app):
         self.ts = ts
         self.app = app
-        self.watch_map = None
 
         if not self.ts.identity.ip: 
             self.ts.identity.ip = lambda r: r.client.host if r.client else "0.0.0.0"
@@ -13,102 +12,205 @@ class FastAPIIntegration:
         self.ts.request.user_agent = lambda r: r.headers.get("user-agent", "unknown")
         self.ts.request.method = lambda r: r.method
         
-        self.setup_middleware()
         self._patch_startup()
 
+    def setup(self):
+        self.setup_canaries()
+        self.inject_traps()
+        self.setup_beacon()
+        self.setup_quarantine()
+
+    def setup_canaries(self):
+        from fastapi import Request
+
+        canary = self.ts._canary
+        if canary is None:
+            return
+
+        # wraps the router itself, so requests that match no route are checked too
+        router = self.app.router
+        downstream = router.middleware_stack
+
+        async def app(scope, receive, send):
+            if scope["type"] != "http":
+                return await downstream(scope, receive, send)
+
+            request = Request(scope)
+
+            async def on_found(found, location):
+                await self.ts._atrigger_canary_event(request, found, location)
+
+            receive = await scan_scope(canary, scope, receive, on_found, self.ts._canary_scan_body)
+            await downstream(scope, receive, send)
+
+        router.middleware_stack = app
+
+    def setup_beacon(self):
+        from fastapi import Request
+        from ..asgi import read_body
+
+        beacon = self.ts._beacon
+        if beacon is None:
+            return
+
+        # wraps the router, so beacons never reach routing, dependencies or middlewares below it
+        router = self.app.router
+        downstream = router.middleware_stack
+
+        async def app(scope, receive, send):
+            if scope["type"] != "http" or scope["path"] != beacon.path or scope["method"] != "POST":
+                return await downstream(scope, receive, send)
+
+            body = await read_body(receive, beacon.max_body)
+            request = Request(scope)
+            beacon.submit(body, await self.ts._aget_ip(request), self.ts.request.user_agent(request))
+
+            await send({"type": "http.response.start", "status": 204, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        router.middleware_stack = app
+
+    def setup_quarantine(self):
+        from fastapi import Request
+
+        if self.ts._quarantine is None:
+            return
+
+        # wraps the router after every other wrapper, so quarantined actors are
+        # answered before canaries, traps, routing or any dependency runs
+        router = self.app.router
+        downstream = router.middleware_stack
+
+        async def app(scope, receive, send):
+            if scope["type"] == "http":
+                quarantined = await self.ts._acheck_quarantine(Request(scope))
+                if quarantined is not None:
+                    response_body, response_config = quarantined
+                    response = self._respond(response_body, response_config, self.ts._quarantine_trap.get("tarpit"))
+                    return await response(scope, receive, send)
+
+            await downstream(scope, receive, send)
+
+        router.middleware_stack = app
+
+    def _respond(self, response_body, response_config, tarpit=None):
+        import asyncio
+        from fastapi import Response
+        from fastapi.responses import StreamingResponse
+
+        if tarpit:
+            chunks, interval = self.ts._tarpit_chunks(response_body, tarpit)
+
+            async def drip():
+                for chunk in chunks:
+                    await asyncio.sleep(interval)
+                    yield chunk
+
+            return StreamingResponse(drip(),
+                status_code=response_config["status_code"],
+                media_type=response_config["mime_type"])
+
+        if hasattr(response_body, "__next__"):
+            return StreamingResponse(response_body,
+                status_code=response_config["status_code"],
+                media_type=response_config["mime_type"])
+
+        return Response(response_body, 
+            status_code=response_config["status_code"], 
+            media_type=response_config["mime_type"])
+
     def inject_traps(self):
-        from fastapi import Request, Response
-        from fastapi.routing import APIRoute
+        from fastapi import Request
+        from starlette.routing import BaseRoute, Match, NoMatchFound
 
         async def endpoint(req: Request, trap):
-            response_body, response_config = self.ts._trigger_trap_event(req, trap)
+            response_body, response_config = await self.ts._atrigger_trap_event(req, trap)
+            return self._respond(response_body, response_config, trap.get("tarpit"))
 
-            return Response(response_body, 
-                status_code=response_config["status_code"], 
-                media_type=response_config["mime_type"])
+        ts = self.ts
 
-        new_routes = []
-        for idx, trap in enumerate(self.ts.traps):
-            new_routes.append(APIRoute(trap["path"], partial(endpoint, trap=trap), 
-                methods=trap["methods"], name=f"trappsec_{idx}", include_in_schema=False))
-    
-        self.app.router.routes = new_routes + self.app.router.routes
+        class TrapRoute(BaseRoute):
+            # a single route resolving every trap through the compiled ruleset,
+            # so traps added by a rules reload are served without re-routing.
+            def matches(self, scope):
+                if scope["type"] != "http":
+                    return Match.NONE, {}
+
+                path = scope["path"]
+                root_path = scope.get("root_path", "")
+                if root_path and path.startswith(root_path):
+                    path = path[len(root_path):] or "/"
+
+                trap = ts._ruleset.match_trap(path, scope["method"])
+                if trap is None:
+                    return Match.NONE, {}
+                return Match.FULL, {"endpoint": endpoint, "trappsec.trap": trap}
+
+            def url_path_for(self, name, **path_params):
+                raise NoMatchFound(name, path_params)
+
+            async def handle(self, scope, receive, send):
+                response = await endpoint(Request(scope, receive), scope["trappsec.trap"])
+                await response(scope, receive, send)
+
+        self.app.router.routes.insert(0, TrapRoute())
+
+    def index_watches(self, ruleset):
+        from fastapi import Request
+        from ..asgi import WatchInspector
+
+        # each watch is attached to the routes it matches, so other routes run
+        # untouched. a reloaded ruleset re-attaches them all.
+        routes = list(self._routes(self.app.router.routes, ""))
+        self.ts._warn_shadowed_routes(ruleset, ((template, route.methods) for route, template in routes))
+
+        watched = {}
+        for route, template in routes:
+            watch = ruleset.watch_for_route(template)
+            if watch is not None:
+                # a router included twice shares its routes, the first watch wins
+                watched.setdefault(id(route), (route, WatchInspector(self.ts, watch, Request)))
+
+        for route, _ in routes:
+            handle = getattr(route.handle, "trappsec_handle", route.handle)
+            if id(route) in watched:
+                route.handle = self._watched(route, handle, watched[id(route)][1])
+            elif handle is not route.handle:
+                route.handle = handle
+
+    def _routes(self, routes, prefix):
+        # http routes with their full template, through included routers, mounts and hosts
+        from starlette.routing import Route
+
+        for route in routes:
+            if isinstance(route, Route):
+                yield route, prefix + route.path
+            elif hasattr(route, "effective_route_contexts"):
+                # fastapi versions that keep included routers nested
+                for context in route.effective_route_contexts():
+                    if isinstance(context.original_route, Route):
+                        yield context.original_route, prefix + context.path
+            elif getattr(route, "routes", None):
+                yield from self._routes(route.routes, prefix + getattr(route, "path", ""))
+
+    def _watched(self, route, handle, inspector):
+        # routers call `handle` on the matched route whether it is flattened or
+        # reached through an included router, so that is where the watch goes
+        async def trappsec_handle(scope, receive, send):
+            if route.methods and scope["method"] not in route.methods:
+                return await handle(scope, receive, send)
+            await inspector(handle, scope, receive, send)
+
+        trappsec_handle.trappsec_handle = handle
+        return trappsec_handle
 
-    def setup_watches(self):
-        watch_map = dict()
-        for watch in self.ts.watches:
-            watch_map[watch["path"]] = watch
-        self.watch_map = watch_map
-    
-    def setup_middleware(self):        
-        from fastapi import Request, Depends
-        from starlette.datastructures import FormData
-        from starlette.middleware.base import BaseHTTPMiddleware
-        from urllib.parse import parse_qs, urlencode
-
-        async def trappsec_watcher(request: Request):
-            route = request.scope.get("route")
-            if route is None:
-                return
-
-            if route.path not in self.watch_map:
-                return
-            
-            matched_rule = self.watch_map[route.path]
-            query_fields = matched_rule["query_fields"]
-            body_fields = matched_rule["body_fields"]
-            found_fields = []
-            
-            if query_fields:
-                qs = request.scope.get("query_string", b"").decode("utf-8")
-                if qs:
-                    q_dict = parse_qs(qs).to_dict(flat=False)                    
-                    q_dict, mod = self.ts._detect_honey_fields(q_dict, query_fields, request)
-                    
-                    if mod:
-                        found_fields.extend(mod)
-                        request.scope["query_string"] = urlencode(q_dict, doseq=True).encode("utf-8")
-                        if hasattr(request, "_query_params"):
-                            del request._query_params
-                
-            if body_fields:
-                ctype = request.headers.get("content-type", "")
-                if "application/json" in ctype:
-                    try:
-                        body = await request.json()
-                        b, mod = self.ts._detect_honey_fields(body, body_fields, request)
-                        if mod:
-                            found_fields.extend(mod)
-                            request._json = b
-                    except Exception as e: 
-                        self.ts.logger.error("error reading json body: %s", e)
-                elif "application/x-www-form-urlencoded" in ctype or "multipart/form-data" in ctype:
-                    try:
-                        form_data = await request.form()
-                        data = dict(form_data)
-                        b, mod = self.ts._detect_honey_fields(data, body_fields, request)
-                        if mod:
-                            found_fields.extend(mod)
-                            request._form = FormData(b)
-                    except Exception as e: 
-                        self.ts.logger.error("error reading form body: %s", e)
-            
-            if found_fields:
-                self.ts._trigger_watch_event(request, found_fields)
-
-        if self.app.router.dependencies is None:
-            self.app.router.dependencies = []
-
-        self.app.router.dependencies.append(Depends(trappsec_watcher))
-    
     def _patch_startup(self):
         from contextlib import asynccontextmanager
         original_lifespan = self.app.router.lifespan_context
 
         @asynccontextmanager
         async def wrapped_lifespan(app_instance):
-            self.inject_traps()
-            self.setup_watches()
+            self.ts.init_app()
 
             async with original_lifespan(app_instance) as state:
                 yield state
@@ -1,3 +1,10 @@
+import functools
+
+from ..utils import strip_cookies
+from ..multipart import MultipartFilter, FilteredInput, get_boundary
+from ..query import parse_query, strip_query
+from ..canary import scan_environ
+from ..wsgi import TarpitSlots
 
 class FlaskIntegration:
     def __init__(self, ts, app):
@@ -11,86 +18,293 @@ class FlaskIntegration:
         self.ts.request.user_agent = lambda r: str(r.user_agent)
         self.ts.request.method = lambda r: r.method
 
+        self.tarpit_slots = None
+        self._indexed_routes = None
+
         self._patch_startup()
 
-    def inject_traps(self):
+    def setup(self):
+        self.setup_canaries()
+        self.inject_traps()
+        self.setup_beacon()
+        self.setup_quarantine()
+
+    def setup_canaries(self):
+        from flask import request
+
+        canary = self.ts._canary
+        if canary is None:
+            return
+
+        @self.app.before_request
+        def trappsec_canaries():
+            # a body werkzeug already wrapped in a stream can't be scanned as it is read
+            scan_body = self.ts._canary_scan_body and "stream" not in request.__dict__
+            scan_environ(canary, request.environ, request.content_length,
+                lambda found, location: self.ts._trigger_canary_event(request, found, location), scan_body)
+
+    def setup_beacon(self):
         from flask import request, Response
 
-        for idx, decoy in enumerate(self.ts.traps):
-            def endpoint(d=decoy):
-                response_body, response_config = self.ts._trigger_trap_event(request, d)
-                
-                return Response(
-                    response_body,
-                    status=response_config["status_code"], 
-                    mimetype=response_config["mime_type"])
-            
-            endpoint.__name__ = f"trappsec_{idx}"
-            self.app.add_url_rule(decoy["path"], endpoint.__name__, endpoint, methods=decoy["methods"])
-    
-    def setup_watches(self):
-        if not self.ts.watches:
+        beacon = self.ts._beacon
+        if beacon is None:
             return
-        
+
+        # ahead of the application's own hooks, so beacons skip its authentication
+        def trappsec_beacon():
+            if request.path == beacon.path and request.method == "POST":
+                body = self._read_body(request.stream, beacon.max_body)
+                if body is not None:
+                    beacon.submit(body, self.ts.identity.get_ip(request), self.ts.request.user_agent(request))
+                return Response(status=204)
+
+        self.app.before_request_funcs.setdefault(None, []).insert(0, trappsec_beacon)
+
+    def _read_body(self, stream, limit):
+        # chunked bodies have no content-length, so never read more than `limit` + 1 bytes
+        chunks, size = [], 0
+        while size <= limit:
+            chunk = stream.read(limit + 1 - size)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+            size += len(chunk)
+        return None
+
+    def setup_quarantine(self):
         from flask import request
-        from werkzeug.datastructures import ImmutableMultiDict
 
-        watch_map = dict()
-        for watch in self.ts.watches:
-            watch_map[watch["path"]] = watch
+        if self.ts._quarantine is None:
+            return
+
+        # runs before every other hook, so quarantined actors never reach the application
+        def trappsec_quarantine():
+            quarantined = self.ts._check_quarantine(request)
+            if quarantined is not None:
+                response_body, response_config = quarantined
+                return self._respond(response_body, response_config, self.ts._quarantine_trap.get("tarpit"))
+
+        self.app.before_request_funcs.setdefault(None, []).insert(0, trappsec_quarantine)
+
+    def _respond(self, response_body, response_config, tarpit=None):
+        from flask import Response
+
+        dripping = self.tarpit_slots.drip(response_body, tarpit) if tarpit else None
+        if dripping is not None:
+            chunks, release = dripping
+            response = Response(
+                chunks,
+                status=response_config["status_code"],
+                mimetype=response_config["mime_type"])
+            response.call_on_close(release)
+            return response
+
+        return Response(
+            response_body,
+            status=response_config["status_code"],
+            mimetype=response_config["mime_type"])
+
+    def inject_traps(self):
+        from flask import request
+
+        # created at setup, once `tarpit_limit` is configured
+        self.tarpit_slots = TarpitSlots(self.ts)
+
+        def endpoint(d):
+            response_body, response_config = self.ts._trigger_trap_event(request, d)
+            return self._respond(response_body, response_config, d.get("tarpit"))
 
+        # traps are resolved through the compiled ruleset instead of url rules,
+        # so traps added by a rules reload are served without re-routing.
         @self.app.before_request
-        def trappsec_watcher():
-            if request.url_rule is None:
-                return
-            
-            matched_rule = request.url_rule.rule
-            if matched_rule not in watch_map:
-                return
-
-            query_fields = watch_map[matched_rule]["query_fields"]
-            body_fields = watch_map[matched_rule]["body_fields"]
-                
+        def trappsec_traps():
+            decoy = self.ts._ruleset.match_trap(request.path, request.method)
+            if decoy is not None:
+                return endpoint(decoy)
+    
+    def index_watches(self, ruleset):
+        # each watch is attached to the views of the rules it matches, so other
+        # views run untouched. a reloaded ruleset re-attaches them all.
+        rules = list(self.app.url_map.iter_rules())
+        self._indexed_routes = len(rules)
+        self.ts._warn_shadowed_routes(ruleset, ((rule.rule, rule.methods) for rule in rules))
+
+        watched = {}
+        for rule in rules:
+            watch = ruleset.watch_for_route(rule.rule)
+            if watch is not None:
+                watched.setdefault(rule.endpoint, []).append((rule, self._inspector(watch)))
+
+        view_functions = self.app.view_functions
+        for endpoint, view in list(view_functions.items()):
+            view = getattr(view, "trappsec_view", view)
+            view_functions[endpoint] = self._watched(view, watched[endpoint]) if endpoint in watched else view
+
+    def _reindex_routes(self):
+        # routes registered after an eager init_app() had no view to attach to yet
+        with self.ts._init_lock:
+            ruleset = self.ts._ruleset
+            if ruleset is not None and self._indexed_routes != len(list(self.app.url_map.iter_rules())):
+                self.index_watches(ruleset)
+
+    def _watched(self, view, inspectors):
+        from flask import request
+
+        run_view = self.app.ensure_sync(view)
+
+        def trappsec_watched(**kwargs):
+            # an endpoint may have several rules, only some of them watched
+            url_rule = request.url_rule
+            for rule, inspector in inspectors:
+                if rule is url_rule:
+                    inspector(request)
+                    break
+            return run_view(**kwargs)
+
+        # extensions introspecting views, such as `view_class`, still see the original
+        functools.update_wrapper(trappsec_watched, view)
+        trappsec_watched.trappsec_view = view
+        return trappsec_watched
+
+    def _inspector(self, watch):
+        # only the checks this watch needs, decided once
+        checks = []
+        if watch["header_fields"]:
+            checks.append(self._inspect_headers)
+        if watch["cookie_fields"]:
+            checks.append(self._inspect_cookies)
+        if watch["query_prefilter"] is not None:
+            checks.append(self._inspect_query)
+        if watch["body_fields"]:
+            checks.append(self._inspect_body)
+
+        def inspect(request):
             found_fields = []
-            if request.args and query_fields:
-                q_dict = request.args.to_dict(flat=False)
-                q_dict, mod = self.ts._detect_honey_fields(q_dict, query_fields, request)
-                if mod: 
-                    found_fields.extend(mod)
-                    request.args = ImmutableMultiDict(q_dict)
-
-            if request.is_json and body_fields:
-                data = request.get_json(silent=True)
-                if data:
-                    data, mod = self.ts._detect_honey_fields(data, body_fields, request)
-                    if mod:
-                        found_fields.extend(mod)
-                        current = getattr(request, '_cached_json', None)
-                        if isinstance(current, tuple): 
-                            request._cached_json = (data, current[1])
-                        else: 
-                            request._cached_json = data
-
-            if request.form and body_fields:
-                form_copy = request.form.to_dict(flat=True)
-                form, mod = self.ts._detect_honey_fields(form_copy, body_fields, request)
-                if mod: 
+            for check in checks:
+                check(request, watch, found_fields)
+            if found_fields:
+                self.ts._trigger_watch_event(request, found_fields)
+
+        return inspect
+
+    def _inspect_headers(self, request, watch, found_fields):
+        header_fields = watch["header_fields"]
+
+        # only the watched names are looked up, the other headers are never copied
+        h_dict = {}
+        for name in header_fields:
+            value = request.headers.get(name)
+            if value is not None:
+                h_dict[name] = value
+
+        if h_dict:
+            _, mod = self.ts._detect_honey_fields(h_dict, header_fields, request, "header")
+            if mod:
+                found_fields.extend(mod)
+                for name in header_fields:
+                    request.environ.pop("HTTP_" + name.upper().replace("-", "_"), None)
+
+    def _inspect_cookies(self, request, watch, found_fields):
+        cookie_fields = watch["cookie_fields"]
+        if "HTTP_COOKIE" not in request.environ:
+            return
+
+        c_dict = {k: v for k, v in request.cookies.items() if k in cookie_fields}
+        if c_dict:
+            _, mod = self.ts._detect_honey_fields(c_dict, cookie_fields, request, "cookie")
+            if mod:
+                found_fields.extend(mod)
+                request.environ["HTTP_COOKIE"] = strip_cookies(request.environ["HTTP_COOKIE"], cookie_fields)
+                request.__dict__.pop("cookies", None)
+
+    def _inspect_query(self, request, watch, found_fields):
+        query_fields = watch["query_fields"]
+        if not watch["query_prefilter"].search(request.query_string):
+            return
+
+        # only parse the query when a watched name may be present
+        _, mod = self.ts._detect_honey_fields(parse_query(request.query_string), query_fields, request, "query")
+        if mod:
+            found_fields.extend(mod)
+            query_string = strip_query(request.query_string, query_fields)
+            request.environ["QUERY_STRING"] = query_string.decode("latin-1")
+            request.query_string = query_string
+            request.__dict__.pop("args", None)
+
+    def _inspect_body(self, request, watch, found_fields):
+        from werkzeug.datastructures import ImmutableMultiDict
+
+        body_fields = watch["body_fields"]
+        if request.is_json:
+            data = request.get_json(silent=True)
+            if data:
+                data, mod = self.ts._detect_honey_fields(data, body_fields, request)
+                if mod:
                     found_fields.extend(mod)
-                    request.form = ImmutableMultiDict(form)
-            
+                    current = getattr(request, '_cached_json', None)
+                    if isinstance(current, tuple):
+                        request._cached_json = (data, current[1])
+                    else:
+                        request._cached_json = data
+
+        if request.mimetype == "multipart/form-data" and self._stream_multipart(request, body_fields):
+            # file uploads are inspected as the application reads them
+            pass
+        elif request.form:
+            form_copy = request.form.to_dict(flat=True)
+            form, mod = self.ts._detect_honey_fields(form_copy, body_fields, request)
+            if mod:
+                found_fields.extend(mod)
+                request.form = ImmutableMultiDict(form)
+
+    def _stream_multipart(self, request, body_fields):
+        from flask import after_this_request
+
+        boundary = get_boundary(request.content_type)
+        content_length = request.content_length
+        if boundary is None or content_length is None or "stream" in request.__dict__:
+            return False
+
+        found_fields = []
+
+        def inspect(name, value):
+            try:
+                _, mod = self.ts._detect_honey_fields({name: value}, body_fields, request)
+            except Exception as e:
+                self.ts.logger.error("error inspecting multipart field: %s", e)
+                return False
+            found_fields.extend(mod)
+            return bool(mod)
+
+        def complete():
             if found_fields:
                 self.ts._trigger_watch_event(request, found_fields)
 
+        stream = FilteredInput(request.environ["wsgi.input"], content_length,
+            MultipartFilter(boundary, body_fields, inspect), complete)
+
+        # the filtered body is shorter than content-length, so let werkzeug read to eof
+        request.environ["wsgi.input"] = stream
+        request.environ["wsgi.input_terminated"] = True
+
+        @after_this_request
+        def finish_inspection(response):
+            stream.drain()
+            return response
+
+        return True
     
     def _patch_startup(self):
         original_wsgi_app = self.app.wsgi_app
 
         def trappsec_wrapper(environ, start_response):
-            self.inject_traps()
-            self.setup_watches()
+            self.ts.init_app()
+            # flask refuses new routes once it serves requests, so the first one sees them all
+            self._reindex_routes()
 
-            # un-patch after first request
-            self.app.wsgi_app = original_wsgi_app
+            # un-patch after first request, unless something else has wrapped us since
+            if self.app.wsgi_app is trappsec_wrapper:
+                self.app.wsgi_app = original_wsgi_app
 
             return original_wsgi_app(environ, start_response)
 
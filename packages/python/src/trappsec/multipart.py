@@ -0,0 +1,259 @@
+import re
+
+# small text parts are held in memory while inspected, anything larger is dropped
+# without being buffered further and reported truncated.
+MAX_FIELD_SIZE = 64 * 1024
+MAX_HEADER_SIZE = 16 * 1024
+
+_NAME = re.compile(rb';\s*name="?([^";]*)"?', re.IGNORECASE)
+_FILENAME = re.compile(rb';\s*filename\*?=', re.IGNORECASE)
+_BOUNDARY = re.compile(r'boundary="?([^";]+)"?', re.IGNORECASE)
+
+def get_boundary(content_type: str):
+    m = _BOUNDARY.search(content_type or "")
+    return m.group(1).encode("latin-1") if m else None
+
+class MultipartFilter:
+    """
+    incremental multipart/form-data filter.
+
+    bytes are fed in as they arrive and come back out unchanged, except for text
+    parts whose name is in `fields`: those are held, handed to `inspect(name, value)`
+    and dropped from the output if it returns True. file parts are never held.
+    once every watched name has been seen the rest of the body is passed through
+    without being parsed.
+    """
+    PREAMBLE, HEADERS, BODY, PASSTHROUGH = range(4)
+
+    def __init__(self, boundary: bytes, fields, inspect):
+        # a virtual CRLF is prepended so every delimiter, including the first,
+        # looks like `\r\n--boundary`. it is stripped again on the way out.
+        self.delimiter = b"\r\n--" + boundary
+        self.fields = fields
+        self.inspect = inspect
+
+        self.pending = set(fields)
+        self.state = self.PREAMBLE
+        self.buf = b"\r\n"
+        self.emitted = -2
+
+        self.part_name = None
+        self.held = None
+        self.held_size = 0
+        self.dropping = False
+
+    @property
+    def done(self):
+        return self.state == self.PASSTHROUGH
+
+    def _out(self, out, data):
+        if self.emitted < 0:
+            skip = min(-self.emitted, len(data))
+            self.emitted += skip
+            data = data[skip:]
+        if data:
+            self.emitted += len(data)
+            out.append(data)
+
+    def feed(self, chunk: bytes) -> bytes:
+        if self.state == self.PASSTHROUGH:
+            return chunk
+
+        self.buf += chunk
+        out = []
+        while self._step(out):
+            pass
+        return b"".join(out)
+
+    def finish(self) -> bytes:
+        # whatever is left can't contain a complete delimiter anymore
+        out = []
+        if self.state == self.BODY and self.part_name is not None:
+            if not self.dropping:
+                self._out(out, self.held + self.buf)
+        else:
+            self._out(out, self.buf)
+
+        self.buf = b""
+        self.state = self.PASSTHROUGH
+        return b"".join(out)
+
+    def _step(self, out) -> bool:
+        if self.state == self.PREAMBLE:
+            idx = self.buf.find(self.delimiter)
+            if idx < 0:
+                keep = len(self.delimiter) - 1
+                if len(self.buf) > keep:
+                    self._out(out, self.buf[:-keep])
+                    self.buf = self.buf[-keep:]
+                return False
+
+            self._out(out, self.buf[:idx])
+            self.buf = self.buf[idx:]
+            self.state = self.HEADERS
+            return True
+
+        if self.state == self.HEADERS:
+            # buf starts with the delimiter, followed by `--` (end) or CRLF + headers
+            start = len(self.delimiter)
+            if len(self.buf) < start + 2:
+                return False
+
+            if self.buf[start:start + 2] == b"--":
+                self._pass_through(out)
+                return False
+
+            end = self.buf.find(b"\r\n\r\n", start)
+            if end < 0:
+                if len(self.buf) > MAX_HEADER_SIZE:
+                    self._pass_through(out)
+                return False
+
+            end += 4
+            headers = self.buf[start:end]
+            name = _NAME.search(headers)
+            name = name.group(1).decode("utf-8", "replace") if name else None
+
+            if name in self.fields and not _FILENAME.search(headers):
+                self.part_name = name
+                self.held = self.buf[:end]
+                self.held_size = 0
+            else:
+                self.part_name = None
+                self._out(out, self.buf[:end])
+
+            self.buf = self.buf[end:]
+            self.state = self.BODY
+            return True
+
+        if self.state == self.BODY:
+            idx = self.buf.find(self.delimiter)
+            if idx < 0:
+                keep = len(self.delimiter) - 1
+                if len(self.buf) > keep:
+                    self._body(out, self.buf[:-keep])
+                    self.buf = self.buf[-keep:]
+                return False
+
+            self._body(out, self.buf[:idx])
+            self.buf = self.buf[idx:]
+            self._end_part(out)
+
+            if not self.pending:
+                self._pass_through(out)
+                return False
+
+            self.state = self.HEADERS
+            return True
+
+        return False
+
+    def _body(self, out, data):
+        if self.part_name is None:
+            self._out(out, data)
+            return
+
+        if self.dropping:
+            return
+
+        self.held += data
+        self.held_size += len(data)
+        if self.held_size > MAX_FIELD_SIZE:
+            # too big to be a honey field value, stop holding it and drop the part
+            self.pending.discard(self.part_name)
+            self.inspect(self.part_name, self._value())
+            self.held = None
+            self.dropping = True
+
+    def _value(self):
+        value = self.held[len(self.held) - self.held_size:]
+        return value[:MAX_FIELD_SIZE].decode("utf-8", "replace")
+
+    def _end_part(self, out):
+        if self.part_name is not None:
+            if not self.dropping:
+                self.pending.discard(self.part_name)
+                if not self.inspect(self.part_name, self._value()):
+                    self._out(out, self.held)
+
+            self.part_name = None
+            self.held = None
+            self.dropping = False
+
+    def _pass_through(self, out):
+        self._out(out, self.buf)
+        self.buf = b""
+        self.state = self.PASSTHROUGH
+
+class FilteredInput:
+    """
+    file-like wrapper running a wsgi input stream through a MultipartFilter.
+    `on_complete` is called once, when inspection is over.
+    """
+    def __init__(self, stream, content_length: int, multipart_filter: MultipartFilter, on_complete, chunk_size: int = 64 * 1024):
+        self.stream = stream
+        self.remaining = content_length
+        self.filter = multipart_filter
+        self.on_complete = on_complete
+        self.chunk_size = chunk_size
+        self.out = b""
+        self.completed = False
+
+    def _complete(self):
+        if not self.completed:
+            self.completed = True
+            self.on_complete()
+
+    def _fill(self, size: int) -> bool:
+        if self.remaining <= 0:
+            return False
+
+        chunk = self.stream.read(min(max(size, self.chunk_size), self.remaining))
+        if not chunk:
+            self.remaining = 0
+        else:
+            self.remaining -= len(chunk)
+
+        data = self.filter.feed(chunk)
+        if self.remaining <= 0:
+            data += self.filter.finish()
+        self.out += data
+
+        if self.filter.done:
+            self._complete()
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            while self._fill(self.chunk_size):
+                pass
+            data, self.out = self.out, b""
+            return data
+
+        while len(self.out) < size and self._fill(size):
+            pass
+        data, self.out = self.out[:size], self.out[size:]
+        return data
+
+    def readline(self, size: int = -1) -> bytes:
+        while b"\n" not in self.out and self._fill(self.chunk_size):
+            pass
+        idx = self.out.find(b"\n")
+        end = len(self.out) if idx < 0 else idx + 1
+        if size is not None and size >= 0:
+            end = min(end, size)
+        data, self.out = self.out[:end], self.out[end:]
+        return data
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def drain(self):
+        """finishes inspection when the application never read the body."""
+        while not self.filter.done and self._fill(self.chunk_size):
+            self.out = b""
+        self._complete()
@@ -0,0 +1,48 @@
+import ipaddress
+
+class NetworkSet:
+    """
+    set of ipv4/ipv6 networks answering "is this address in any of them".
+
+    networks are collapsed and grouped by prefix length into hash sets of masked
+    addresses, so a lookup costs one mask and set probe per distinct prefix
+    length (at most 33 for ipv4, 129 for ipv6 and usually a handful), however
+    many networks there are.
+    """
+    def __init__(self, networks):
+        parsed = {4: [], 6: []}
+        for network in networks:
+            network = ipaddress.ip_network(network, strict=False)
+            parsed[network.version].append(network)
+
+        self._tables = {}
+        for version, items in parsed.items():
+            by_length = {}
+            for network in ipaddress.collapse_addresses(items):
+                by_length.setdefault(network.prefixlen, set()).add(int(network.network_address))
+
+            bits = 32 if version == 4 else 128
+            full = (1 << bits) - 1
+            # shortest prefixes first, they cover the most addresses
+            self._tables[version] = [
+                (full ^ ((1 << (bits - length)) - 1), by_length[length])
+                for length in sorted(by_length)
+            ]
+
+    def __contains__(self, ip) -> bool:
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+
+        value = int(address)
+        for mask, masked in self._tables[address.version]:
+            if value & mask in masked:
+                return True
+        return False
+
+    def __bool__(self):
+        return any(self._tables.values())
@@ -0,0 +1,120 @@
+import time
+import bisect
+import inspect
+import logging
+import threading
+
+# upper bounds (ms) of the histogram buckets, the last bucket is open ended
+BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)
+
+class CallbackStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.slow = 0
+        self.overruns = 0
+        self.fallbacks = 0
+        self.tripped_until = 0.0
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+            "slow": self.slow,
+            "fallbacks": self.fallbacks,
+            "histogram": {
+                (f"<={b}ms" if i < len(BUCKETS_MS) else f">{BUCKETS_MS[-1]}ms"): n
+                for i, (b, n) in enumerate(zip(BUCKETS_MS + (None,), self.buckets))
+            },
+        }
+
+class CallbackProfiler:
+    """
+    times user supplied callbacks, aggregates the timings into per-callback
+    histograms and warns about calls slower than `budget_ms`.
+
+    a running callback can't be interrupted, so with `trip_after` a callback that
+    overruns its budget that many times in a row is skipped for `cooldown`
+    seconds and its fallback value is used instead.
+    """
+    def __init__(self, budget_ms: float = None, trip_after: int = None, cooldown: float = 30, on_sample=None):
+        self.budget = budget_ms / 1000 if budget_ms else None
+        self.trip_after = trip_after
+        self.cooldown = cooldown
+        self.hooks = [on_sample] if on_sample else []
+        self.logger = logging.getLogger("trappsec")
+
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _stats_for(self, name: str):
+        stats = self._stats.get(name)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(name, CallbackStats())
+        return stats
+
+    def call(self, name: str, fn, arg, fallback):
+        stats = self._stats_for(name)
+        if stats.tripped_until and time.monotonic() < stats.tripped_until:
+            stats.fallbacks += 1
+            return fallback(arg)
+
+        start = time.perf_counter()
+        try:
+            return fn(arg)
+        finally:
+            self._record(name, stats, time.perf_counter() - start)
+
+    async def acall(self, name: str, fn, arg, fallback):
+        # like `call`, timing the callback until its result is awaited
+        stats = self._stats_for(name)
+        if stats.tripped_until and time.monotonic() < stats.tripped_until:
+            stats.fallbacks += 1
+            return fallback(arg)
+
+        start = time.perf_counter()
+        try:
+            result = fn(arg)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        finally:
+            self._record(name, stats, time.perf_counter() - start)
+
+    def _record(self, name, stats, elapsed):
+        with self._lock:
+            stats.count += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            stats.buckets[bisect.bisect_left(BUCKETS_MS, elapsed * 1000)] += 1
+
+            over = self.budget is not None and elapsed > self.budget
+            if over:
+                stats.slow += 1
+                stats.overruns += 1
+            else:
+                stats.overruns = 0
+
+            tripped = bool(over and self.trip_after and stats.overruns >= self.trip_after)
+            if tripped:
+                stats.overruns = 0
+                stats.tripped_until = time.monotonic() + self.cooldown
+
+        if over:
+            self.logger.warning(f"trappsec: callback `{name}` took {elapsed * 1000:.1f}ms, budget is {self.budget * 1000:.1f}ms")
+        if tripped:
+            self.logger.warning(f"trappsec: callback `{name}` keeps exceeding its budget, using its fallback for {self.cooldown}s")
+
+        for hook in self.hooks:
+            try:
+                hook(name, elapsed)
+            except Exception as e:
+                self.logger.error(f"error invoking callback timing hook: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {name: s.snapshot() for name, s in self._stats.items()}
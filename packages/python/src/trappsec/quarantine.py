@@ -0,0 +1,60 @@
+import time
+import threading
+from collections import OrderedDict
+
+from .utils import after_fork_in_child
+
+class Quarantine:
+    """
+    actors (ip and/or user) that tripped a trap or watch, each held for `ttl`
+    seconds. at most `max_actors` are kept, the oldest dropped first. lookups
+    are a single dict probe and take no lock.
+    """
+    def __init__(self, ttl: float, key: str = "ip", max_actors: int = 100000):
+        if key not in ("ip", "user", "both"):
+            raise ValueError("quarantine: `key` must be one of 'ip', 'user' or 'both'.")
+
+        self.ttl = ttl
+        self.key = key
+        self.max_actors = max_actors
+        self._until = OrderedDict()
+        self._lock = threading.Lock()
+        after_fork_in_child(self._after_fork)
+
+    def _after_fork(self):
+        # another thread may have held the lock at fork time
+        self._lock = threading.Lock()
+
+    def keys(self, ip=None, user=None):
+        keys = []
+        if self.key in ("ip", "both") and ip:
+            keys.append("ip:" + ip)
+        if self.key in ("user", "both") and user:
+            keys.append("user:" + str(user))
+        return keys
+
+    def add(self, ip=None, user=None, now: float = None):
+        until = (now or time.monotonic()) + self.ttl
+        with self._lock:
+            for key in self.keys(ip, user):
+                self._until.pop(key, None)
+                self._until[key] = until
+            while len(self._until) > self.max_actors:
+                self._until.popitem(last=False)
+
+    def remove(self, ip=None, user=None):
+        with self._lock:
+            for key in self.keys(ip, user):
+                self._until.pop(key, None)
+
+    def contains(self, key: str, now: float = None) -> bool:
+        until = self._until.get(key)
+        if until is None:
+            return False
+        if until > (now or time.monotonic()):
+            return True
+
+        with self._lock:
+            if self._until.get(key) == until:
+                del self._until[key]
+        return False
@@ -0,0 +1,26 @@
+import re
+from urllib.parse import parse_qs, unquote_plus
+
+def compile_prefilter(names):
+    """
+    compiles a single regex finding watched field names in a raw query string.
+    keys containing `%` or `+` also match, since they may be an encoded watched
+    name, so the prefilter never misses a field the full parse would find.
+    """
+    if not names:
+        return None
+
+    alternatives = b"|".join(re.escape(n.encode("utf-8")) for n in sorted(names, key=len, reverse=True))
+    return re.compile(rb"(?:^|&)(?:" + alternatives + rb"|[^=&]*[%+][^=&]*)(?:=|&|$)")
+
+def parse_query(raw: bytes) -> dict:
+    return parse_qs(raw.decode("utf-8", "replace"), keep_blank_values=True)
+
+def strip_query(raw: bytes, names) -> bytes:
+    """drops `names` from a raw query string, keeping every other byte as sent."""
+    kept = []
+    for segment in raw.split(b"&"):
+        key = segment.split(b"=", 1)[0]
+        if unquote_plus(key.decode("utf-8", "replace")) not in names:
+            kept.append(segment)
+    return b"&".join(kept)
@@ -0,0 +1,229 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+
+from .builders import TrapBuilder, WatchBuilder, NO_DEFAULT
+from .query import compile_prefilter
+from .canary import trap_id
+from .utils import after_fork_in_child, is_async
+
+# matches flask style `<name>` / `<converter:name>` and starlette style
+# `{name}` / `{name:converter}` path parameters.
+_PATH_PARAM = re.compile(r"<(?:(\w+):)?\w+>|\{\w+(?::(\w+))?\}")
+
+def compile_path(path: str):
+    """returns a compiled regex for templated paths, or None for static ones."""
+    if not _PATH_PARAM.search(path):
+        return None
+
+    pattern, pos = "", 0
+    for m in _PATH_PARAM.finditer(path):
+        converter = m.group(1) or m.group(2)
+        pattern += re.escape(path[pos:m.start()])
+        pattern += ".+" if converter == "path" else "[^/]+"
+        pos = m.end()
+
+    return re.compile(pattern + re.escape(path[pos:]))
+
+def route_key(path: str) -> str:
+    """
+    a route template with its parameter names and converters left out, so
+    `/users/<int:id>` and `/users/{user_id}` are the same route.
+    """
+    return _PATH_PARAM.sub(lambda m: "{path}" if (m.group(1) or m.group(2)) == "path" else "{}", path)
+
+class Ruleset:
+    """
+    immutable, pre-compiled view of traps and watches.
+
+    a new instance is built whenever rules change and swapped in with a single
+    reference assignment, so the request path never needs a lock.
+    """
+    def __init__(self, traps: list, watches: list):
+        self.static_traps = {}
+        self.dynamic_traps = []
+        self.wordlists = []
+        self.watches = {}
+        self.trap_ids = {}
+
+        patterns = {}
+        for trap in traps:
+            path = trap["path"]
+            self.trap_ids[trap_id(path).hex()] = path
+
+            # a wordlist is one entry however many paths it has
+            if "paths" in trap:
+                methods = frozenset(m.upper() for m in trap["methods"])
+                self.wordlists.append((trap["paths"], trap["prefixes"], methods, trap))
+                continue
+
+            regex = compile_path(path)
+
+            if regex is None:
+                by_method = self.static_traps.setdefault(path, {})
+            elif path in patterns:
+                by_method = patterns[path]
+            else:
+                by_method = patterns[path] = {}
+                self.dynamic_traps.append((regex, by_method))
+
+            for method in trap["methods"]:
+                by_method.setdefault(method.upper(), trap)
+
+        # framework integrations attach watches to the routes they match by
+        # template, the raw middlewares match them against the request path instead
+        self.route_watches = {}
+        self.dynamic_watches = []
+        for watch in watches:
+            compiled = dict(watch, query_prefilter=compile_prefilter(watch["query_fields"]))
+            # awaited by async integrations before the fields are inspected
+            compiled["async_defaults"] = [
+                rule["default"] for kind in ("query_fields", "body_fields", "header_fields", "cookie_fields")
+                for rule in watch[kind].values() if is_async(rule.get("default"))
+            ]
+            self.watches[watch["path"]] = compiled
+            self.route_watches.setdefault(route_key(watch["path"]), compiled)
+
+            regex = compile_path(watch["path"])
+            if regex is not None:
+                self.dynamic_watches.append((regex, compiled))
+
+    def match_trap(self, path: str, method: str):
+        by_method = self.static_traps.get(path)
+        if by_method is not None:
+            trap = by_method.get(method)
+            if trap is not None:
+                return trap
+
+        for paths, _, methods, trap in self.wordlists:
+            if path in paths and method in methods:
+                return trap
+
+        for regex, by_method in self.dynamic_traps:
+            if method in by_method and regex.fullmatch(path):
+                return by_method[method]
+
+        for _, prefixes, methods, trap in self.wordlists:
+            if prefixes and method in methods and path.startswith(prefixes):
+                return trap
+
+        return None
+
+    def wordlist_for_route(self, template: str, methods=None):
+        """the wordlist trap that would answer requests meant for a framework route, if any."""
+        for paths, prefixes, trap_methods, trap in self.wordlists:
+            if template in paths or template.startswith(prefixes):
+                if not methods or not trap_methods.isdisjoint(methods):
+                    return trap
+        return None
+
+    def watch_for_route(self, template: str):
+        """the watch declared for a framework route template, however its parameters are written."""
+        return self.route_watches.get(route_key(template))
+
+    def match_watch(self, path: str):
+        watch = self.watches.get(path)
+        if watch is not None:
+            return watch
+
+        for regex, watch in self.dynamic_watches:
+            if regex.fullmatch(path):
+                return watch
+
+        return None
+
+def _read_rules(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("pyyaml library required for yaml rule files")
+            return yaml.safe_load(f) or {}
+        return json.load(f)
+
+def _response_args(spec: dict):
+    return {
+        "status": spec.get("status"),
+        "body": spec.get("body"),
+        "mime_type": spec.get("mime_type"),
+        "template": spec.get("template"),
+    }
+
+def parse_rules_file(ts, path: str):
+    """parses a json/yaml rules file into built trap and watch configs."""
+    doc = _read_rules(path)
+
+    templates = dict(ts._templates)
+    for name, tmpl in (doc.get("templates") or {}).items():
+        templates[name] = {
+            "status_code": tmpl["status_code"],
+            "response_body": tmpl.get("response_body", {}),
+            "mime_type": tmpl.get("mime_type", "application/json")
+        }
+
+    traps = []
+    for spec in doc.get("traps") or []:
+        builder = TrapBuilder(ts, spec["path"], templates=templates)
+        if spec.get("methods"):
+            builder.methods(*spec["methods"])
+        if spec.get("intent"):
+            builder.intent(spec["intent"])
+        if spec.get("respond"):
+            builder.respond(**_response_args(spec["respond"]))
+        if spec.get("if_unauthenticated"):
+            builder.if_unauthenticated(**_response_args(spec["if_unauthenticated"]))
+        if spec.get("tarpit"):
+            builder.tarpit(**spec["tarpit"])
+        if spec.get("ignore_networks"):
+            builder.ignore_networks(spec["ignore_networks"])
+        traps.append(builder.build())
+
+    watches = []
+    for spec in doc.get("watches") or []:
+        builder = WatchBuilder(spec["path"])
+        for kind in ("query", "body", "header", "cookie"):
+            for field in spec.get(kind) or []:
+                getattr(builder, kind)(field["name"], field.get("default", NO_DEFAULT), field.get("intent"))
+        watches.append(builder.build())
+
+    return traps, watches
+
+class RulesWatcher:
+    """polls a rules file and calls `on_change` whenever its mtime or size changes."""
+    def __init__(self, path: str, interval: float, on_change):
+        self.path = path
+        self.interval = interval
+        self.on_change = on_change
+        self.logger = logging.getLogger("trappsec")
+        self._stamp = self._current_stamp()
+
+    def _current_stamp(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def start(self):
+        threading.Thread(target=self._loop, daemon=True).start()
+        after_fork_in_child(self._restart)
+
+    def _restart(self):
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            stamp = self._current_stamp()
+            if stamp is None or stamp == self._stamp:
+                continue
+
+            self._stamp = stamp
+            try:
+                self.on_change()
+            except Exception as e:
+                self.logger.error(f"failed to reload rules from {self.path}, keeping previous ruleset: {e}")
@@ -0,0 +1,119 @@
+import json
+import hashlib
+
+def _digest(data) -> str:
+    if not isinstance(data, bytes):
+        data = data.encode("utf-8", "surrogatepass")
+    return hashlib.sha256(data).hexdigest()
+
+def _dumps(value) -> str:
+    return json.dumps(value, default=str)
+
+class EventShaper:
+    """
+    bounds the attacker controlled parts of an event before any handler sees it.
+    strings longer than `max_length` (or their entry in `lengths`, by top level
+    key) are truncated, containers are cut to `max_items` entries and `max_depth`
+    levels, values that aren't json types are stringified, and the serialized
+    event is kept under `max_bytes`. every change is noted under `shaped`, keyed
+    by the dotted path of the value, with the original length and a sha256 of
+    truncated strings so they can still be correlated. a limit of None disables it.
+    """
+    def __init__(self, max_length: int = 1024, max_depth: int = 4, max_items: int = 32, max_bytes: int = 16384, lengths: dict = None):
+        self.max_length = max_length
+        self.max_depth = max_depth
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.lengths = lengths or {}
+
+    def shape(self, event: dict) -> dict:
+        notes = {}
+        for key, value in event.items():
+            if key == "found_fields" and isinstance(value, list):
+                event[key] = self._found_fields(value, notes)
+            else:
+                event[key] = self._value(value, key, self.lengths.get(key, self.max_length), 0, notes)
+
+        if notes:
+            # the notes are bounded like any other container
+            if self.max_items is not None and len(notes) > self.max_items:
+                dropped = len(notes) - self.max_items
+                notes = dict(list(notes.items())[:self.max_items])
+                notes["..."] = {"more": dropped}
+            event["shaped"] = notes
+
+        if self.max_bytes is not None:
+            self._fit(event, notes)
+        return event
+
+    def _found_fields(self, found_fields, notes):
+        # our own structure; the depth limit applies to each value inside it
+        if self.max_items is not None and len(found_fields) > self.max_items:
+            notes["found_fields"] = {"length": len(found_fields)}
+            found_fields = found_fields[:self.max_items]
+
+        shaped = []
+        for i, found in enumerate(found_fields):
+            found = dict(found)
+            found["value"] = self._value(found.get("value"), f"found_fields.{i}.value", self.max_length, 0, notes)
+            shaped.append(found)
+        return shaped
+
+    def _value(self, value, path, limit, depth, notes):
+        if value is None or isinstance(value, (bool, int, float)):
+            return value
+
+        if isinstance(value, bytes):
+            value = value.decode("utf-8", "replace")
+
+        if isinstance(value, str):
+            if limit is not None and len(value) > limit:
+                notes[path] = {"length": len(value), "sha256": _digest(value)}
+                return value[:limit]
+            return value
+
+        if isinstance(value, (dict, list, tuple)):
+            if self.max_depth is not None and depth >= self.max_depth:
+                notes[path] = {"dropped": "depth"}
+                return None
+
+            items = list(value.items()) if isinstance(value, dict) else list(enumerate(value))
+            if self.max_items is not None and len(items) > self.max_items:
+                notes[path] = {"length": len(items)}
+                items = items[:self.max_items]
+
+            if isinstance(value, dict):
+                return {
+                    str(k)[:self.max_length]: self._value(v, f"{path}.{k}", self.max_length, depth + 1, notes)
+                    for k, v in items
+                }
+            return [self._value(v, f"{path}.{i}", self.max_length, depth + 1, notes) for i, v in items]
+
+        return self._value(str(value), path, limit, depth, notes)
+
+    def _fit(self, event, notes):
+        # payloads go first: metadata, then found field values, largest first,
+        # then every remaining string is cut short
+        if len(_dumps(event)) <= self.max_bytes:
+            return
+
+        candidates = []
+        if event.get("metadata") is not None:
+            candidates.append((event, "metadata", "metadata"))
+        found_fields = event.get("found_fields") or []
+        candidates.extend(sorted(
+            ((found, "value", f"found_fields.{i}.value") for i, found in enumerate(found_fields)),
+            key=lambda c: -len(_dumps(c[0]["value"]))))
+
+        event["shaped"] = notes
+        for container, key, path in candidates:
+            serialized = _dumps(container[key])
+            notes[path] = dict(notes.get(path, {}), dropped="size", sha256=_digest(serialized))
+            container[key] = None
+            if len(_dumps(event)) <= self.max_bytes:
+                return
+
+        for key, value in list(event.items()):
+            if isinstance(value, str) and len(value) > 64:
+                notes.setdefault(key, {"length": len(value), "sha256": _digest(value)})
+                event[key] = value[:64]
@@ -0,0 +1,130 @@
+import time
+import threading
+from collections import OrderedDict, deque
+
+class ActorTimeline:
+    """
+    bounded in-process history of recent events per actor (ip and/or user).
+
+    each actor keeps at most `max_events` compact entries, at most `max_actors`
+    actors are tracked (least recently active evicted first) and entries older
+    than `ttl` seconds are dropped.
+    """
+    def __init__(self, rules: list, key: str = "ip", max_actors: int = 10000, max_events: int = 32, ttl: float = 3600):
+        if key not in ("ip", "user", "both"):
+            raise ValueError("timeline: `key` must be one of 'ip', 'user' or 'both'.")
+
+        self.rules = rules
+        self.key = key
+        self.max_actors = max_actors
+        self.max_events = max_events
+        self.ttl = ttl
+
+        self._actors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _actor_keys(self, event):
+        keys = []
+        if self.key in ("ip", "both") and event.get("ip"):
+            keys.append("ip:" + event["ip"])
+        if self.key in ("user", "both") and event.get("user"):
+            keys.append("user:" + str(event["user"]))
+        return keys
+
+    def record(self, event: dict) -> list:
+        """stores the event and returns escalation events for rules it completes."""
+        now = event.get("timestamp") or time.time()
+        entry = (now, event["event"], event.get("type"), event.get("path"), event.get("intent"))
+        escalations = []
+
+        with self._lock:
+            for key in self._actor_keys(event):
+                actor = self._actors.pop(key, None)
+                if actor is None:
+                    actor = {"events": deque(maxlen=self.max_events), "fired": {}}
+
+                events = actor["events"]
+                while events and now - events[0][0] > self.ttl:
+                    events.popleft()
+                events.append(entry)
+
+                # re-inserting marks the actor as most recently active
+                self._actors[key] = actor
+                for rule in self.rules:
+                    matched = rule.evaluate(events, now)
+                    if matched and now - actor["fired"].get(rule.name, 0) > rule.within:
+                        actor["fired"][rule.name] = now
+                        escalations.append(self._escalation(rule, key, event, matched, now))
+
+            while len(self._actors) > self.max_actors:
+                self._actors.popitem(last=False)
+
+        return escalations
+
+    def _escalation(self, rule, key, event, matched, now):
+        return {
+            "timestamp": now,
+            "event": "trappsec.escalation",
+            "type": "alert",
+            "rule": rule.name,
+            "intent": rule.intent,
+            "actor": key,
+            "ip": event.get("ip"),
+            "user": event.get("user"),
+            "events": [
+                {"timestamp": e[0], "event": e[1], "type": e[2], "path": e[3], "intent": e[4]}
+                for e in matched
+            ],
+        }
+
+    def history(self, ip: str = None, user: str = None) -> list:
+        key = "ip:" + ip if ip else "user:" + str(user)
+        with self._lock:
+            actor = self._actors.get(key)
+            return list(actor["events"]) if actor else []
+
+class DistinctTrapsRule:
+    """fires when an actor hits `count` distinct traps within `within` seconds."""
+    def __init__(self, name: str, count: int, within: float, intent: str = None):
+        self.name = name
+        self.count = count
+        self.within = within
+        self.intent = intent
+
+    def evaluate(self, events, now):
+        seen, matched = set(), []
+        for e in reversed(events):
+            if now - e[0] > self.within:
+                break
+            if e[1] == "trappsec.trap_hit" and e[3] not in seen:
+                seen.add(e[3])
+                matched.append(e)
+        return matched[::-1] if len(seen) >= self.count else None
+
+class SequenceRule:
+    """fires when an event matching `first` is followed by one matching `then` within `within` seconds."""
+    _FIELDS = {"event": 1, "type": 2, "path": 3, "intent": 4}
+
+    def __init__(self, name: str, first: dict, then: dict, within: float, intent: str = None):
+        for spec in (first, then):
+            unknown = set(spec) - set(self._FIELDS)
+            if unknown:
+                raise ValueError(f"timeline: cannot match on {sorted(unknown)}, use {sorted(self._FIELDS)}.")
+
+        self.name = name
+        self.first = [(self._FIELDS[k], v) for k, v in first.items()]
+        self.then = [(self._FIELDS[k], v) for k, v in then.items()]
+        self.within = within
+        self.intent = intent
+
+    def evaluate(self, events, now):
+        last = events[-1]
+        if not all(last[i] == v for i, v in self.then):
+            return None
+
+        for e in list(events)[-2::-1]:
+            if last[0] - e[0] > self.within:
+                break
+            if all(e[i] == v for i, v in self.first):
+                return [e, last]
+        return None
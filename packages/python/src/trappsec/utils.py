@@ -0,0 +1,49 @@
+import os
+import inspect
+import weakref
+
+def after_fork_in_child(method):
+    """
+    runs a bound method in every child process forked from this one (e.g. gunicorn
+    `--preload` workers). only a weak reference is kept, so the owner can still be
+    garbage collected.
+    """
+    if not hasattr(os, "register_at_fork"):
+        return
+
+    ref = weakref.WeakMethod(method)
+
+    def callback():
+        bound = ref()
+        if bound is not None:
+            bound()
+
+    os.register_at_fork(after_in_child=callback)
+
+def is_async(fn) -> bool:
+    """true for `async def` functions and callables with an `async def __call__`."""
+    if fn is None:
+        return False
+    return inspect.iscoroutinefunction(fn) or inspect.iscoroutinefunction(getattr(fn, "__call__", None))
+
+def strip_cookies(cookie_header: str, names) -> str:
+    """removes the named cookies from a raw `Cookie` header, leaving the rest untouched."""
+    kept = []
+    for pair in cookie_header.split(";"):
+        name = pair.split("=", 1)[0].strip()
+        if name and name not in names:
+            kept.append(pair.strip())
+    return "; ".join(kept)
+
+def parse_cookies(cookie_header: str, names) -> dict:
+    """returns the named cookies from a raw `Cookie` header, first occurrence wins."""
+    found = {}
+    for pair in cookie_header.split(";"):
+        name, sep, value = pair.partition("=")
+        name = name.strip()
+        if sep and name in names and name not in found:
+            value = value.strip()
+            if len(value) > 1 and value[0] == value[-1] == '"':
+                value = value[1:-1]
+            found[name] = value
+    return found
@@ -0,0 +1,94 @@
+"""
+wire format for batched events.
+
+a batch is sent as an envelope:
+
+    {"v": 1, "app": {...}, "keys": ["timestamp", "event", ...], "events": [[0, 1706500123.4, 1, "trappsec.trap_hit", ...], ...]}
+
+the `app` block shared by every event is sent once per batch, and every event
+is a flat list of (key index, value) pairs into `keys`, so repeated keys are
+only sent once as well. consumers can use `decode` to get plain events back.
+"""
+import hmac
+import json
+import hashlib
+
+SCHEMA_VERSION = 1
+
+CONTENT_TYPES = {
+    "json": "application/json",
+    "msgpack": "application/msgpack",
+    "cbor": "application/cbor",
+}
+
+def _codec(name: str):
+    if name == "json":
+        return (lambda obj: json.dumps(obj, separators=(",", ":")).encode("utf-8")), json.loads
+
+    if name == "msgpack":
+        try:
+            import msgpack
+        except ImportError:
+            raise ImportError("msgpack library required for the msgpack codec")
+        return (lambda obj: msgpack.packb(obj, use_bin_type=True)), (lambda data: msgpack.unpackb(data, raw=False))
+
+    if name == "cbor":
+        try:
+            import cbor2
+        except ImportError:
+            raise ImportError("cbor2 library required for the cbor codec")
+        return cbor2.dumps, cbor2.loads
+
+    raise ValueError(f"codec must be one of {sorted(CONTENT_TYPES)}, got '{name}'.")
+
+class EventCodec:
+    def __init__(self, name: str = "json"):
+        self.name = name
+        self.content_type = CONTENT_TYPES.get(name)
+        self.dumps, self.loads = _codec(name)
+
+    def encode(self, events: list) -> bytes:
+        app = next((e["app"] for e in events if "app" in e), None)
+        keys, index, rows = [], {}, []
+
+        for event in events:
+            row = []
+            for key, value in event.items():
+                # an event from another app keeps its own block
+                if key == "app" and value == app:
+                    continue
+
+                i = index.get(key)
+                if i is None:
+                    i = index[key] = len(keys)
+                    keys.append(key)
+                row += (i, value)
+            rows.append(row)
+
+        return self.dumps({"v": SCHEMA_VERSION, "app": app, "keys": keys, "events": rows})
+
+    def decode(self, payload: bytes) -> list:
+        envelope = self.loads(payload)
+        if envelope.get("v") != SCHEMA_VERSION:
+            raise ValueError(f"unsupported trappsec schema version: {envelope.get('v')}")
+
+        keys, app = envelope["keys"], envelope.get("app")
+        events = []
+        for row in envelope["events"]:
+            event = {keys[row[i]]: row[i + 1] for i in range(0, len(row), 2)}
+            if app is not None:
+                event.setdefault("app", app)
+            events.append(event)
+        return events
+
+def decode(payload: bytes, content_type: str = "application/json") -> list:
+    """decodes a batch sent by `WebhookHandler` back into a list of events."""
+    for name, ctype in CONTENT_TYPES.items():
+        if content_type.split(";")[0].strip() == ctype:
+            return EventCodec(name).decode(payload)
+    raise ValueError(f"unsupported content type: {content_type}")
+
+def verify(payload: bytes, signature: str, secret: str) -> bool:
+    """checks the `x-trappsec-signature` header sent with a payload."""
+    expected = hmac.new(secret.encode(), payload, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature or "")
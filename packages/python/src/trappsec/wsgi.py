@@ -0,0 +1,276 @@
+"""
+framework agnostic wsgi middleware, for bottle, pyramid, falcon, django or any
+other wsgi application:
+
+    ts = trappsec.Sentry(None, service="billing-api", environment="production")
+    app = TrappsecMiddleware(app, ts)
+
+callbacks such as `identify_user` receive the wsgi `environ`.
+"""
+import io
+import time
+import threading
+from http import HTTPStatus
+
+from .utils import after_fork_in_child, strip_cookies, parse_cookies
+from .multipart import MultipartFilter, FilteredInput, get_boundary
+from .canary import scan_environ
+from .inspection import inspect_query, inspect_body, MAX_BODY_SIZE
+
+def environ_ip(environ):
+    return environ.get("REMOTE_ADDR") or "0.0.0.0"
+
+def environ_path(environ):
+    return environ.get("PATH_INFO") or "/"
+
+def environ_method(environ):
+    return environ["REQUEST_METHOD"]
+
+def environ_user_agent(environ):
+    return environ.get("HTTP_USER_AGENT", "unknown")
+
+def _content_length(environ):
+    try:
+        return int(environ.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        return 0
+
+class _ClosingIterator:
+    # runs `callback` once the server is done with the response, even if it never iterated it
+    def __init__(self, iterable, callback):
+        self.iterable = iterable
+        self.callback = callback
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, "close"):
+                self.iterable.close()
+        finally:
+            self.callback()
+
+class TarpitSlots:
+    """
+    every tarpitted response pins a worker thread, so at most `ts.tarpit_limit`
+    of them run at once server-wide. past that, trap responses are sent right
+    away. shared by the wsgi middleware and the flask integration.
+    """
+    def __init__(self, ts):
+        self.ts = ts
+        self._slots = threading.BoundedSemaphore(ts.tarpit_limit)
+        after_fork_in_child(self._after_fork)
+
+    def _after_fork(self):
+        # slots held by threads of the parent are never released in the child
+        self._slots = threading.BoundedSemaphore(self.ts.tarpit_limit)
+
+    def drip(self, response_body, tarpit):
+        """
+        returns the chunks of a tarpitted response and the callback releasing its
+        slot, or None when every slot is taken. the callback is meant for the
+        response's `close()`, which the server calls even if the client disconnects.
+        """
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            return None
+
+        chunks, interval = self.ts._tarpit_chunks(response_body, tarpit)
+
+        def drip():
+            for chunk in chunks:
+                time.sleep(interval)
+                yield chunk
+
+        return drip(), slots.release
+
+class TrappsecMiddleware:
+    """
+    serves traps and inspects watched fields directly on the wsgi environ, using
+    the compiled ruleset. `ip`, `path`, `method` and `user_agent` are extractors
+    called with the environ and replace the defaults below.
+    """
+    def __init__(self, app, ts, ip=None, path=None, method=None, user_agent=None):
+        if ts.integration is not None:
+            raise Exception("trappsec error: sentry is already attached to an application.")
+
+        self.app = app
+        self.ts = ts
+        ts.integration = self
+
+        self.path = path or environ_path
+        if ip or not ts.identity.ip:
+            ts.identity.ip = ip or environ_ip
+        ts.request.path = self.path
+        ts.request.method = method or environ_method
+        ts.request.user_agent = user_agent or environ_user_agent
+
+        self.tarpit_slots = TarpitSlots(ts)
+
+    def setup(self):
+        pass
+
+    def index_watches(self, ruleset):
+        # watches are matched against the request path, there are no routes to attach them to
+        pass
+
+    def __call__(self, environ, start_response):
+        ruleset = self.ts._ruleset or self.ts.init_app()._ruleset
+        if self.ts._quarantine is not None:
+            quarantined = self.ts._check_quarantine(environ)
+            if quarantined is not None:
+                return self._respond(start_response, *quarantined, self.ts._quarantine_trap.get("tarpit"))
+
+        beacon = self.ts._beacon
+        if beacon is not None and environ["REQUEST_METHOD"] == "POST" and self.path(environ) == beacon.path:
+            content_length = _content_length(environ)
+            if 0 < content_length <= beacon.max_body:
+                beacon.submit(environ["wsgi.input"].read(content_length), self.ts.identity.get_ip(environ), self.ts.request.user_agent(environ))
+            start_response("204 No Content", [])
+            return []
+
+        canary = self.ts._canary
+        if canary is not None:
+            self._scan_canaries(canary, environ)
+
+        path = self.path(environ)
+        trap = ruleset.match_trap(path, environ["REQUEST_METHOD"])
+        if trap is not None:
+            return self._serve_trap(environ, start_response, trap)
+
+        watch = ruleset.match_watch(path)
+        if watch is None:
+            return self.app(environ, start_response)
+
+        found_fields = self._inspect_headers(environ, watch)
+
+        query_string = environ.get("QUERY_STRING")
+        if query_string:
+            mod, stripped = inspect_query(self.ts, environ, query_string.encode("latin-1"), watch)
+            if mod:
+                found_fields.extend(mod)
+                environ["QUERY_STRING"] = stripped.decode("latin-1")
+
+        if watch["body_fields"]:
+            ctype = environ.get("CONTENT_TYPE", "")
+            boundary = get_boundary(ctype) if ctype.startswith("multipart/form-data") else None
+            if boundary is not None:
+                return self._stream_multipart(environ, start_response, watch, boundary, found_fields)
+            if "application/json" in ctype or "application/x-www-form-urlencoded" in ctype:
+                self._inspect_body(environ, ctype, watch, found_fields)
+
+        if found_fields:
+            self.ts._trigger_watch_event(environ, found_fields)
+
+        return self.app(environ, start_response)
+
+    def _scan_canaries(self, canary, environ):
+        scan_environ(canary, environ, _content_length(environ),
+            lambda found, location: self.ts._trigger_canary_event(environ, found, location), self.ts._canary_scan_body)
+
+    def _serve_trap(self, environ, start_response, trap):
+        response_body, response_config = self.ts._trigger_trap_event(environ, trap)
+        return self._respond(start_response, response_body, response_config, trap.get("tarpit"))
+
+    def _respond(self, start_response, response_body, response_config, tarpit=None):
+        # streamed bodies are iterators of bytes chunks
+        streamed = hasattr(response_body, "__next__")
+        if isinstance(response_body, str):
+            response_body = response_body.encode("utf-8")
+        elif not streamed and not isinstance(response_body, bytes):
+            response_body = str(response_body).encode("utf-8")
+
+        code = response_config["status_code"]
+        try:
+            status = f"{code} {HTTPStatus(code).phrase}"
+        except ValueError:
+            status = f"{code} Unknown"
+        headers = [("Content-Type", response_config["mime_type"])]
+
+        dripping = self.tarpit_slots.drip(response_body, tarpit) if tarpit else None
+        if dripping is not None:
+            start_response(status, headers)
+            return _ClosingIterator(*dripping)
+
+        if streamed:
+            start_response(status, headers)
+            return response_body
+
+        headers.append(("Content-Length", str(len(response_body))))
+        start_response(status, headers)
+        return [response_body]
+
+    def _inspect_headers(self, environ, watch):
+        header_fields = watch["header_fields"]
+        cookie_fields = watch["cookie_fields"]
+        found_fields = []
+
+        if header_fields:
+            # the environ is already a dict, so look watched headers up directly
+            keys = {name: "HTTP_" + name.upper().replace("-", "_") for name in header_fields}
+            h_dict = {name: environ[key] for name, key in keys.items() if key in environ}
+            if h_dict:
+                _, mod = self.ts._detect_honey_fields(h_dict, header_fields, environ, "header")
+                if mod:
+                    found_fields.extend(mod)
+                    for key in keys.values():
+                        environ.pop(key, None)
+
+        raw_cookie = environ.get("HTTP_COOKIE")
+        if cookie_fields and raw_cookie:
+            c_dict = parse_cookies(raw_cookie, cookie_fields)
+            if c_dict:
+                _, mod = self.ts._detect_honey_fields(c_dict, cookie_fields, environ, "cookie")
+                if mod:
+                    found_fields.extend(mod)
+                    environ["HTTP_COOKIE"] = strip_cookies(raw_cookie, cookie_fields)
+
+        return found_fields
+
+    def _inspect_body(self, environ, ctype, watch, found_fields):
+        content_length = _content_length(environ)
+        if not content_length or content_length > MAX_BODY_SIZE:
+            return
+
+        body = environ["wsgi.input"].read(content_length)
+        mod, stripped = inspect_body(self.ts, environ, body, ctype, watch)
+        if mod:
+            found_fields.extend(mod)
+            body = stripped
+
+        # the body was consumed, hand the application a fresh stream
+        environ["wsgi.input"] = io.BytesIO(body)
+        environ["CONTENT_LENGTH"] = str(len(body))
+
+    def _stream_multipart(self, environ, start_response, watch, boundary, found_fields):
+        # file uploads are inspected as the application reads them
+        content_length = _content_length(environ)
+        if not content_length:
+            if found_fields:
+                self.ts._trigger_watch_event(environ, found_fields)
+            return self.app(environ, start_response)
+
+        body_fields = watch["body_fields"]
+
+        def inspect(name, value):
+            try:
+                _, mod = self.ts._detect_honey_fields({name: value}, body_fields, environ)
+            except Exception as e:
+                self.ts.logger.error("error inspecting multipart field: %s", e)
+                return False
+            found_fields.extend(mod)
+            return bool(mod)
+
+        def complete():
+            if found_fields:
+                self.ts._trigger_watch_event(environ, found_fields)
+
+        stream = FilteredInput(environ["wsgi.input"], content_length,
+            MultipartFilter(boundary, body_fields, inspect), complete)
+
+        # the filtered body is shorter than content-length, so let the application read to eof
+        environ["wsgi.input"] = stream
+        environ["wsgi.input_terminated"] = True
+
+        return _ClosingIterator(self.app(environ, start_response), stream.drain)
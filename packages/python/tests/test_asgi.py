@@ -0,0 +1,137 @@
+import json
+import asyncio
+
+import pytest
+
+from trappsec import Sentry
+from trappsec.asgi import TrappsecMiddleware
+from trappsec.inspection import MAX_BODY_SIZE
+
+async def echo(scope, receive, send):
+    # reads the whole body like a framework would, then reports what it saw
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            break
+    seen = {
+        "headers": {k.decode(): v.decode() for k, v in scope["headers"]},
+        "query": scope.get("query_string", b"").decode(),
+        "body": body.decode("latin-1"),
+    }
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": json.dumps(seen).encode()})
+
+def sentry():
+    ts = Sentry(None, "s", "e")
+    events = []
+    ts._trigger = events.append
+    ts.trap("/trap").methods("GET", "POST").if_unauthenticated(404, {"error": "not found"})
+    ts.watch("/profile").header("x-role").query("is_admin").body("is_admin").body("avatar")
+    ts.watch("/account").body("is_admin")
+    return ts, events
+
+def call(middleware, path="/profile", method="POST", headers=(), query=b"", messages=((b"", False),)):
+    scope = {
+        "type": "http", "method": method, "path": path, "query_string": query,
+        "headers": [(k.encode(), v.encode()) for k, v in headers], "client": ("203.0.113.7", 1234),
+    }
+    pending = [{"type": "http.request", "body": body, "more_body": more} for body, more in messages]
+    sent = []
+
+    async def receive():
+        if pending:
+            return pending.pop(0)
+        # a server only answers with a disconnect once the client goes away
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    async def run():
+        await asyncio.wait_for(middleware(scope, receive, send), 2)
+
+    asyncio.run(run())
+    status = sent[0]["status"]
+    body = b"".join(m.get("body", b"") for m in sent[1:])
+    return status, body
+
+def fields(events):
+    return [(f["type"], f["field"]) for e in events for f in e.get("found_fields", [])]
+
+def test_serves_traps():
+    ts, events = sentry()
+    status, body = call(TrappsecMiddleware(echo, ts), "/trap", "GET")
+    assert (status, json.loads(body)) == (404, {"error": "not found"})
+    assert events[0]["event"] == "trappsec.trap_hit"
+
+def test_passes_other_paths_through():
+    ts, events = sentry()
+    status, body = call(TrappsecMiddleware(echo, ts), "/other", "GET", query=b"is_admin=1")
+    assert json.loads(body)["query"] == "is_admin=1"
+    assert events == []
+
+def test_strips_headers_cookies_and_query():
+    ts, events = sentry()
+    ts.watch("/cookies").cookie("debug")
+    middleware = TrappsecMiddleware(echo, ts)
+
+    _, body = call(middleware, headers=[("x-role", "admin"), ("accept", "*/*")], query=b"a=1&is_admin=true")
+    seen = json.loads(body)
+    assert "x-role" not in seen["headers"] and seen["headers"]["accept"] == "*/*"
+    assert seen["query"] == "a=1"
+    assert fields(events) == [("header", "x-role"), ("query", "is_admin")]
+
+    _, body = call(middleware, "/cookies", headers=[("cookie", "session=abc; debug=1")])
+    assert json.loads(body)["headers"]["cookie"] == "session=abc"
+    assert fields(events)[-1] == ("cookie", "debug")
+
+def test_strips_json_body():
+    ts, events = sentry()
+    data = json.dumps({"name": "n", "is_admin": True}).encode()
+    _, body = call(TrappsecMiddleware(echo, ts), headers=[("content-type", "application/json"), ("content-length", str(len(data)))],
+                   messages=[(data[:5], True), (data[5:], False)])
+    seen = json.loads(body)
+    assert json.loads(seen["body"]) == {"name": "n"}
+    assert seen["headers"]["content-length"] == str(len(seen["body"]))
+    assert fields(events) == [("body", "is_admin")]
+
+def test_strips_form_body():
+    ts, events = sentry()
+    _, body = call(TrappsecMiddleware(echo, ts), headers=[("content-type", "application/x-www-form-urlencoded")],
+                   messages=[(b"name=n&is_admin=1", False)])
+    assert json.loads(body)["body"] == "name=n"
+    assert fields(events) == [("body", "is_admin")]
+
+def multipart(*parts, boundary="XyZ"):
+    body = b""
+    for name, value in parts:
+        body += b"--%s\r\nContent-Disposition: form-data; name=\"%s\"\r\n\r\n%s\r\n" % (boundary.encode(), name.encode(), value)
+    return body + b"--%s--\r\n" % boundary.encode()
+
+@pytest.mark.parametrize("size", [7, 64, 100000])
+def test_streams_multipart(size):
+    ts, events = sentry()
+    data = multipart(("name", b"n"), ("avatar", b"x" * 5000), ("is_admin", b"1"))
+    messages = [(data[i:i + size], i + size < len(data)) for i in range(0, len(data), size)]
+    _, body = call(TrappsecMiddleware(echo, ts), headers=[("content-type", "multipart/form-data; boundary=XyZ")], messages=messages)
+    seen = json.loads(body)["body"]
+    assert 'name="name"' in seen and "avatar" not in seen and "is_admin" not in seen
+    assert sorted(fields(events)) == [("body", "avatar"), ("body", "is_admin")]
+
+@pytest.mark.parametrize("split", [False, True])
+def test_body_over_limit_is_passed_through(split):
+    ts, events = sentry()
+    data = json.dumps({"is_admin": True, "pad": "x" * (MAX_BODY_SIZE + 100)}).encode()
+    messages = [(data[:1000], True), (data[1000:], False)] if split else [(data, False)]
+    _, body = call(TrappsecMiddleware(echo, ts), headers=[("content-type", "application/json")], messages=messages)
+    assert json.loads(body)["body"].encode() == data
+    assert events == []
+
+def test_body_over_limit_with_more_to_come():
+    ts, events = sentry()
+    chunk = b"x" * (MAX_BODY_SIZE // 2)
+    messages = [(b'{"pad": "', True), (chunk, True), (chunk, True), (chunk, True), (b'"}', False)]
+    _, body = call(TrappsecMiddleware(echo, ts), headers=[("content-type", "application/json")], messages=messages)
+    assert len(json.loads(body)["body"]) == 3 * len(chunk) + 11
@@ -0,0 +1,152 @@
+import os
+import json
+import atexit
+import threading
+
+import pytest
+
+from trappsec import Sentry
+from trappsec.beacon import BeaconTokens
+
+SECRET = "beacon-secret"
+NOW = 1700000000
+
+@pytest.fixture(autouse=True)
+def no_atexit(monkeypatch):
+    monkeypatch.setattr(atexit, "register", lambda fn: None)
+
+def test_token_roundtrip():
+    tokens = BeaconTokens(SECRET)
+    assert tokens.verify(tokens.issue("203.0.113.7", "alice", now=NOW), now=NOW + 10) == {"issued_at": NOW, "user": "alice"}
+    assert tokens.verify(tokens.issue(now=NOW), now=NOW)["user"] is None
+
+def test_token_expiry():
+    tokens = BeaconTokens(SECRET, ttl=3600)
+    token = tokens.issue(now=NOW)
+    assert tokens.verify(token, now=NOW + 3600) is not None
+    assert tokens.verify(token, now=NOW + 3601) is None
+    # a little clock skew is tolerated, a token from the future is not
+    assert tokens.verify(token, now=NOW - 60) is not None
+    assert tokens.verify(token, now=NOW - 61) is None
+
+@pytest.mark.parametrize("tamper", [
+    lambda t: t[:-1] + ("A" if t[-1] != "A" else "B"),
+    lambda t: ("A" if t[0] != "A" else "B") + t[1:],
+    lambda t: t[:10],
+    lambda t: "!" + t,
+    lambda t: t * 10,
+])
+def test_tampered_tokens_are_rejected(tamper):
+    tokens = BeaconTokens(SECRET)
+    assert tokens.verify(tamper(tokens.issue(user="alice", now=NOW)), now=NOW) is None
+
+def test_other_secret_and_non_strings():
+    tokens = BeaconTokens(SECRET)
+    assert tokens.verify(BeaconTokens("other").issue(now=NOW), now=NOW) is None
+    assert tokens.verify(None) is None and tokens.verify(123) is None
+
+def test_bind_ip():
+    tokens = BeaconTokens(SECRET, bind_ip=True)
+    token = tokens.issue("203.0.113.7", now=NOW)
+    assert tokens.verify(token, "203.0.113.7", now=NOW) is not None
+    assert tokens.verify(token, "203.0.113.8", now=NOW) is None
+    assert tokens.verify(token, None, now=NOW) is None
+
+def sentry(**kwargs):
+    ts = Sentry(None, "s", "e").beacon(SECRET, window=3600, **kwargs)
+    events = []
+    ts._trigger = events.append
+    return ts, events
+
+def batch(ts, events, page="/settings", user=None, ip="203.0.113.7"):
+    token = ts._beacon.tokens.issue(ip, user)
+    return json.dumps({"t": token, "p": page, "e": events}).encode()
+
+def test_ingest_coalesces_and_verifies():
+    ts, events = sentry(intents={"ghost_method": "recon"})
+    beacon = ts._beacon
+    body = batch(ts, [{"k": "ghost_method", "n": "getConfig"}] * 3 + [{"k": "storage_tamper", "n": "role", "v": "admin"}])
+    beacon.submit(body, "203.0.113.7", "ua")
+    beacon.submit(body, "203.0.113.7", "ua")
+    beacon.submit(json.dumps({"t": "forged", "e": [{"k": "x", "n": "y"}]}).encode(), "203.0.113.7", "ua")
+    beacon.submit(b"not json", "203.0.113.7", "ua")
+    assert events == []
+
+    beacon.flush()
+    assert [(e["kind"], e["name"], e["count"], e["intent"]) for e in events] == [
+        ("ghost_method", "getConfig", 6, "recon"), ("storage_tamper", "role", 2, None)]
+    assert events[0]["path"] == "/settings" and events[0]["type"] == "signal"
+    assert events[1]["value"] == "admin"
+
+def test_ingest_user_tokens_are_alerts():
+    ts, events = sentry()
+    ts._beacon.submit(batch(ts, [{"k": "k", "n": "n"}], user="alice"), "203.0.113.7", "ua")
+    ts._beacon.flush()
+    assert events[0]["type"] == "alert" and events[0]["user"] == "alice"
+
+def test_max_body_and_max_events():
+    ts, events = sentry(max_body=512, max_events=2)
+    beacon = ts._beacon
+    beacon.submit(batch(ts, [{"k": "k", "n": "n%d" % i} for i in range(10)]), "203.0.113.7", "ua")
+    beacon.submit(batch(ts, [{"k": "k", "n": "x" * 600}]), "203.0.113.7", "ua")
+    beacon.flush()
+    assert [e["name"] for e in events] == ["n0", "n1"]
+
+def test_queue_drops_oldest():
+    ts, events = sentry(max_queue=2)
+    beacon = ts._beacon
+    for i in range(3):
+        beacon.submit(batch(ts, [{"k": "k", "n": "n%d" % i}]), "203.0.113.7", "ua")
+    beacon.flush()
+    assert [e["name"] for e in events] == ["n1", "n2"]
+
+def test_ignored_networks():
+    ts, events = sentry()
+    ts.ignore_networks(["203.0.113.0/24"])
+    ts._beacon.submit(batch(ts, [{"k": "k", "n": "n"}]), "203.0.113.7", "ua")
+    ts._beacon.flush()
+    assert events == []
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_worker_restarts_after_fork():
+    ts, events = sentry()
+    ts._beacon.submit(batch(ts, [{"k": "k", "n": "n"}]), "203.0.113.7", "ua")
+    pid = os.fork()
+    if pid == 0:
+        # only the forking thread survives: a new worker runs, with an empty queue
+        workers = [t for t in threading.enumerate() if getattr(t, "_target", None) == ts._beacon._loop]
+        os._exit(0 if len(workers) == 1 and workers[0].is_alive() and not ts._beacon._queue else 1)
+    assert os.waitpid(pid, 0)[1] == 0
+    assert len(ts._beacon._queue) == 1
+
+def test_flask_answers_before_app_hooks():
+    flask = pytest.importorskip("flask")
+    app = flask.Flask(__name__)
+    ts = Sentry(app, "s", "e").beacon(SECRET, window=3600)
+    app.before_request(lambda: ("unauthorized", 401))
+    app.add_url_rule("/", "index", lambda: "index")
+    client = app.test_client()
+
+    response = client.post("/_trappsec/beacon", data=batch(ts, [{"k": "k", "n": "n"}]))
+    assert response.status_code == 204
+    assert client.get("/").status_code == 401
+    assert len(ts._beacon._queue) == 1
+
+def test_fastapi_answers_before_routing():
+    pytest.importorskip("fastapi")
+    pytest.importorskip("httpx")
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    app = FastAPI()
+    ts = Sentry(app, "s", "e").beacon(SECRET, window=3600)
+
+    @app.api_route("/{path:path}", methods=["GET", "POST"])
+    async def everything(path: str):
+        return {"path": path}
+
+    with TestClient(app) as client:
+        response = client.post("/_trappsec/beacon", content=batch(ts, [{"k": "k", "n": "n"}]))
+        assert response.status_code == 204
+        assert client.get("/anything").json() == {"path": "anything"}
+    assert len(ts._beacon._queue) == 1
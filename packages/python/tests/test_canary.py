@@ -0,0 +1,174 @@
+import io
+import time
+import asyncio
+
+import pytest
+
+from trappsec import Sentry
+from trappsec.canary import CanaryTokens, BodyScanner, ScanningInput, trap_id, scan_environ, scan_scope
+from trappsec.wsgi import TrappsecMiddleware
+
+SECRET = "canary-secret"
+
+def test_issue_and_verify():
+    tokens = CanaryTokens(SECRET)
+    token = tokens.issue("/api/keys", "203.0.113.7", "aws", now=1700000000)
+    assert token.startswith("ak_")
+    assert tokens.verify(token) == {
+        "token": token,
+        "trap_id": trap_id("/api/keys").hex(),
+        "label": "aws",
+        "issued_at": 1700000000,
+        "issued_to": "203.0.113.7",
+    }
+    assert tokens.verify(token.encode("ascii"))["label"] == "aws"
+
+def test_ipv6_and_missing_ip():
+    tokens = CanaryTokens(SECRET)
+    assert tokens.verify(tokens.issue("/t", "2001:db8::1"))["issued_to"] == "2001:db8::1"
+    canary = tokens.verify(tokens.issue("/t", "not an ip"))
+    assert canary["issued_to"] is None and canary["label"] is None
+
+@pytest.mark.parametrize("tamper", [
+    lambda t: t[:-1] + ("a" if t[-1] != "a" else "b"),
+    lambda t: t[:5] + ("a" if t[5] != "a" else "b") + t[6:],
+    lambda t: t[:-2],
+    lambda t: t + "a",
+    lambda t: "xx_" + t[3:],
+])
+def test_tampered_tokens_are_rejected(tamper):
+    tokens = CanaryTokens(SECRET)
+    assert tokens.verify(tamper(tokens.issue("/t", "203.0.113.7", "label"))) is None
+
+def test_other_secret_is_rejected():
+    token = CanaryTokens("other").issue("/t")
+    assert CanaryTokens(SECRET).verify(token) is None
+
+def test_old_tokens_still_verify():
+    # tokens don't expire: reusing an old one is still reported, with when it was issued
+    tokens = CanaryTokens(SECRET)
+    issued = int(time.time()) - 365 * 86400
+    assert tokens.verify(tokens.issue("/t", now=issued))["issued_at"] == issued
+
+def test_render():
+    tokens = CanaryTokens(SECRET)
+    body = tokens.render('{"key": "{{canary}}", "db": "{{canary:db}}"}', "/t", "203.0.113.7")
+    found = tokens.scan(body.encode("utf-8"))
+    assert [c["label"] for c in found] == [None, "db"]
+    assert tokens.render(b"{{canary:x}}", "/t").startswith(b"ak_")
+    assert tokens.render({"a": 1}, "/t") == {"a": 1}
+
+def test_scan_dedupes_and_bounds_candidates():
+    tokens = CanaryTokens(SECRET, max_candidates=3)
+    token = tokens.issue("/t").encode("ascii")
+    seen = set()
+    assert len(tokens.scan(token + b" " + token, seen)) == 1
+    assert tokens.scan(token, seen) == []
+    others = b" ".join(tokens.issue("/t", label=str(i)).encode("ascii") for i in range(5))
+    assert len(tokens.scan(others)) == 3
+
+def scanner(tokens, limit=1024 * 1024):
+    found = []
+    return BodyScanner(tokens, found.extend, limit), found
+
+@pytest.mark.parametrize("size", [1, 3, 7, 16, 64])
+def test_token_split_across_chunks(size):
+    tokens = CanaryTokens(SECRET)
+    token = tokens.issue("/t", "203.0.113.7").encode("ascii")
+    body = b"a=" + b"x" * 37 + b"&key=" + token + b"&b=" + token + b"&end"
+    s, found = scanner(tokens)
+    for i in range(0, len(body), size):
+        s.feed(body[i:i + size])
+    s.finish()
+    assert [c["token"] for c in found] == [token.decode("ascii")]
+
+def test_token_at_end_of_body():
+    tokens = CanaryTokens(SECRET)
+    token = tokens.issue("/t").encode("ascii")
+    s, found = scanner(tokens)
+    s.feed(b"key=" + token[:10])
+    s.feed(token[10:])
+    assert found == []
+    s.finish()
+    assert len(found) == 1
+
+def test_body_limit():
+    tokens = CanaryTokens(SECRET)
+    token = tokens.issue("/t").encode("ascii")
+    s, found = scanner(tokens, limit=100)
+    s.feed(b"x" * 100)
+    s.feed(token)
+    s.finish()
+    assert found == []
+
+def test_scanning_input():
+    tokens = CanaryTokens(SECRET)
+    token = tokens.issue("/t").encode("ascii")
+    body = b"line one\nkey=" + token + b"\nline three\n"
+    s, found = scanner(tokens)
+    stream = ScanningInput(io.BytesIO(body), len(body), s)
+    assert stream.readline() == b"line one\n"
+    assert stream.read(20) == body[9:29]
+    assert found == []
+    assert b"".join(stream) == body[29:]
+    assert len(found) == 1
+
+def app(environ, start_response):
+    environ["wsgi.input"].read()
+    start_response("200 OK", [])
+    return [b"ok"]
+
+def test_reuse_across_headers_query_and_body():
+    ts = Sentry(None, "s", "e")
+    ts.canary_tokens(SECRET)
+    events = []
+    ts._trigger_canary_event = lambda req, canaries, location: events.append((location, [c["token"] for c in canaries]))
+    middleware = TrappsecMiddleware(app, ts)
+
+    token = ts._canary.issue("/t", "203.0.113.7")
+    body = ("k=" + token + "&again=" + token).encode("ascii")
+    environ = {
+        "REQUEST_METHOD": "POST", "PATH_INFO": "/api", "REMOTE_ADDR": "203.0.113.7",
+        "QUERY_STRING": "key=" + token, "HTTP_AUTHORIZATION": "Bearer " + token,
+        "CONTENT_LENGTH": str(len(body)), "wsgi.input": io.BytesIO(body),
+    }
+    assert b"".join(middleware(environ, lambda *args: None)) == b"ok"
+    assert events == [("header", [token]), ("query", [token]), ("body", [token])]
+
+def test_scan_environ():
+    tokens = CanaryTokens(SECRET)
+    token = tokens.issue("/t")
+    body = ("k=" + token).encode("ascii")
+    environ = {"HTTP_X_API_KEY": token, "QUERY_STRING": "", "wsgi.input": io.BytesIO(body)}
+    found = []
+    scan_environ(tokens, environ, len(body), lambda canaries, location: found.append(location))
+    assert found == ["header"]
+    assert environ["wsgi.input"].read() == body
+    assert found == ["header", "body"]
+
+    environ = {"QUERY_STRING": "k=" + token, "wsgi.input": io.BytesIO(body)}
+    scan_environ(tokens, environ, len(body), lambda canaries, location: found.append(location), scan_body=False)
+    assert isinstance(environ["wsgi.input"], io.BytesIO)
+    assert found[2:] == ["query"]
+
+def test_scan_scope():
+    tokens = CanaryTokens(SECRET)
+    token = tokens.issue("/t").encode("ascii")
+    messages = [{"type": "http.request", "body": b"k=" + token[:9], "more_body": True},
+                {"type": "http.request", "body": token[9:], "more_body": False}]
+    found = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def on_found(canaries, location):
+        found.append((location, len(canaries)))
+
+    async def run():
+        scope = {"headers": [(b"authorization", b"Bearer " + token)], "query_string": b"k=" + token}
+        scanning = await scan_scope(tokens, scope, receive, on_found)
+        while (await scanning())["more_body"]:
+            pass
+
+    asyncio.run(run())
+    assert found == [("header", 1), ("query", 1), ("body", 1)]
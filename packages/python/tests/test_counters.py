@@ -0,0 +1,134 @@
+import os
+import time
+import threading
+
+import pytest
+
+from trappsec import Sentry
+from trappsec.counters import LocalCounters, SharedCounters
+
+posix = pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork and fcntl")
+
+def test_local_window_rollover():
+    counters = LocalCounters()
+    assert [counters.incr("k", 10, t) for t in (100, 105, 109.9)] == [1, 2, 3]
+    assert counters.incr("k", 10, 110) == 1
+    assert counters.incr("other", 10, 110) == 1
+
+def test_local_capacity():
+    counters = LocalCounters(capacity=2)
+    counters.incr("a", 10, 0)
+    counters.incr("b", 10, 0)
+    counters.incr("a", 10, 0)
+    counters.incr("c", 10, 0)
+    # "b" was the least recently counted
+    assert counters.incr("a", 10, 0) == 3
+    assert counters.incr("b", 10, 0) == 1
+
+@posix
+def test_shared_window_rollover(tmp_path):
+    counters = SharedCounters(str(tmp_path / "c"), buckets=16)
+    assert [counters.incr("k", 10, t) for t in (100, 105, 109.9)] == [1, 2, 3]
+    assert counters.incr("k", 10, 110) == 1
+
+@posix
+def test_shared_full_bucket_evicts_earliest_expiry(tmp_path):
+    counters = SharedCounters(str(tmp_path / "c"), buckets=1)
+    counters.incr("old", 10, 0)
+    for i in range(SharedCounters.BUCKET_SLOTS - 1):
+        counters.incr(f"k{i}", 100, 0)
+    counters.incr("new", 100, 0)
+    assert counters.incr("k0", 100, 0) == 2
+    assert counters.incr("old", 10, 5) == 1
+
+@posix
+def test_shared_between_instances(tmp_path):
+    path = str(tmp_path / "c")
+    a, b = SharedCounters(path, buckets=16), SharedCounters(path, buckets=16)
+    assert a.incr("k", 10, 0) == 1
+    assert b.incr("k", 10, 0) == 2
+
+@posix
+def test_shared_layout_mismatch_is_refused(tmp_path):
+    path = str(tmp_path / "c")
+    SharedCounters(path, buckets=16).incr("k", 10, 0)
+    with pytest.raises(ValueError, match="another layout"):
+        SharedCounters(path, buckets=32)
+    with open(path, "r+b") as f:
+        f.write(b"NOTOURS!")
+    with pytest.raises(ValueError, match="another layout"):
+        SharedCounters(path, buckets=16)
+
+@posix
+def test_shared_symlink_is_refused(tmp_path):
+    target = tmp_path / "target"
+    target.write_bytes(b"")
+    os.symlink(str(target), str(tmp_path / "link"))
+    with pytest.raises(OSError):
+        SharedCounters(str(tmp_path / "link"))
+    assert target.read_bytes() == b""
+
+@posix
+def test_shared_across_processes(tmp_path):
+    counters = SharedCounters(str(tmp_path / "c"), buckets=16)
+    children = []
+    for _ in range(4):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                for _ in range(250):
+                    counters.incr("k", 60, 30)
+            finally:
+                os._exit(0)
+        children.append(pid)
+    for pid in children:
+        assert os.waitpid(pid, 0)[1] == 0
+    assert counters.incr("k", 60, 30) == 1001
+
+@posix
+@pytest.mark.parametrize("make", [LocalCounters, lambda: SharedCounters(None, 16, "test-fork-%d" % os.getpid())])
+def test_lock_is_reset_in_forked_child(make):
+    counters = make()
+    try:
+        # a fork while another thread holds the lock leaves it held in the child
+        held, release = threading.Event(), threading.Event()
+        def hold():
+            with counters._lock:
+                held.set()
+                release.wait()
+        holder = threading.Thread(target=hold)
+        holder.start()
+        held.wait()
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if counters._lock.acquire(timeout=2) else 1)
+        release.set()
+        holder.join()
+        assert os.waitpid(pid, 0)[1] == 0
+    finally:
+        if isinstance(counters, SharedCounters):
+            os.unlink(counters.path)
+
+def emitted(configure, events):
+    ts = Sentry(None, "s", "e")
+    configure(ts)
+    sent = []
+    ts._emit = sent.append
+    for ip, user in events:
+        ts._trigger({"timestamp": 1000.0, "event": "trappsec.trap_hit", "type": "alert", "path": "/t", "ip": ip, "user": user})
+    return [(e["ip"], e["user"]) for e in sent]
+
+def test_dedup():
+    events = [("1.1.1.1", None), ("1.1.1.1", None), ("2.2.2.2", None)]
+    assert emitted(lambda ts: ts.dedup(30), events) == [("1.1.1.1", None), ("2.2.2.2", None)]
+
+def test_rate_limit_by_ip():
+    events = [("1.1.1.1", None)] * 3 + [("2.2.2.2", None)]
+    assert emitted(lambda ts: ts.rate_limit(2, 60), events) == events[:2] + events[3:]
+
+def test_rate_limit_by_user_falls_back_to_ip():
+    anonymous = [("10.0.0.%d" % i, None) for i in range(5)]
+    assert emitted(lambda ts: ts.rate_limit(2, 60, key="user"), anonymous) == anonymous
+
+    users = [("1.1.1.1", "alice"), ("2.2.2.2", "alice"), ("3.3.3.3", "alice"), ("1.1.1.1", None)]
+    assert emitted(lambda ts: ts.rate_limit(2, 60, key="user"), users) == users[:2] + users[3:]
@@ -0,0 +1,97 @@
+import json
+import threading
+
+import pytest
+
+fastapi = pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+
+from fastapi import FastAPI, APIRouter, Request
+from fastapi.testclient import TestClient
+
+from trappsec import Sentry
+from trappsec.inspection import MAX_BODY_SIZE
+
+async def echo(request: Request):
+    body = await request.body()
+    return {"body": body.decode(), "query": request.url.query}
+
+def make_app(rules=None):
+    app = FastAPI()
+    ts = Sentry(app, "s", "e")
+    events = []
+    ts._trigger_watch_event = lambda req, found_fields: events.append([f["field"] for f in found_fields])
+    if rules is not None:
+        ts.load_rules(str(rules), reload_interval=3600)
+    return app, ts, events
+
+def client(app, ts):
+    # no lifespan: a hung request would keep its portal, and the test, from exiting
+    ts.init_app()
+    return TestClient(app)
+
+def post(client, path, **kwargs):
+    # a request that never returns fails the test instead of hanging it
+    result = []
+    worker = threading.Thread(target=lambda: result.append(client.post(path, **kwargs)), daemon=True)
+    worker.start()
+    worker.join(10)
+    assert not worker.is_alive(), "request hung"
+    return result[0]
+
+def test_strips_watched_body_fields():
+    app, ts, events = make_app()
+    ts.watch("/profile").body("is_admin")
+    app.add_api_route("/profile", echo, methods=["POST"])
+    response = post(client(app, ts), "/profile", json={"name": "n", "is_admin": True})
+    assert json.loads(response.json()["body"]) == {"name": "n"}
+    assert events == [["is_admin"]]
+
+def test_body_over_limit_is_passed_through():
+    app, ts, events = make_app()
+    ts.watch("/profile").body("is_admin")
+    app.add_api_route("/profile", echo, methods=["POST"])
+    data = json.dumps({"is_admin": True, "pad": "x" * (MAX_BODY_SIZE + 100)})
+    response = post(client(app, ts), "/profile", content=data, headers={"content-type": "application/json"})
+    assert response.json()["body"] == data
+    assert events == []
+
+def test_included_routers():
+    app, ts, events = make_app()
+    ts.watch("/v1/users/{user_id}").query("is_admin")
+    router = APIRouter()
+    router.add_api_route("/users/{id}", echo, methods=["POST"])
+    router.add_api_route("/teams/{id}", echo, methods=["POST"])
+    app.include_router(router, prefix="/v1")
+    c = client(app, ts)
+    assert post(c, "/v1/users/7?is_admin=1&a=b").json()["query"] == "a=b"
+    assert post(c, "/v1/teams/7?is_admin=1").json()["query"] == "is_admin=1"
+    assert events == [["is_admin"]]
+
+def test_reindexed_after_reload(tmp_path):
+    rules = tmp_path / "rules.json"
+    rules.write_text(json.dumps({"watches": [{"path": "/a", "query": [{"name": "debug"}]}]}))
+    app, ts, events = make_app(rules)
+    app.add_api_route("/a", echo, methods=["POST"])
+    app.add_api_route("/b", echo, methods=["POST"])
+    c = client(app, ts)
+    assert post(c, "/a?debug=1").json()["query"] == ""
+
+    rules.write_text(json.dumps({"watches": [{"path": "/b", "query": [{"name": "debug"}]}]}))
+    ts._rules_watcher.on_change()
+    assert post(c, "/a?debug=1").json()["query"] == "debug=1"
+    assert post(c, "/b?debug=1").json()["query"] == ""
+    assert events == [["debug"], ["debug"]]
+
+def test_canaries_in_headers_query_and_body():
+    app, ts, events = make_app()
+    ts.canary_tokens("canary-secret")
+    found = []
+    async def on_canary(req, canaries, location):
+        found.append(location)
+    ts._atrigger_canary_event = on_canary
+    app.add_api_route("/echo", echo, methods=["POST"])
+    token = ts._canary.issue("/t")
+    response = post(client(app, ts), "/echo?k=" + token, headers={"x-api-key": token}, content="k=" + token)
+    assert response.json()["body"] == "k=" + token
+    assert found == ["header", "query", "body"]
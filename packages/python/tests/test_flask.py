@@ -0,0 +1,68 @@
+import pytest
+
+flask = pytest.importorskip("flask")
+
+from trappsec import Sentry
+
+def make_app():
+    app = flask.Flask(__name__)
+    ts = Sentry(app, "s", "e")
+    events = []
+    ts._trigger_watch_event = lambda req, found_fields: events.append([f["field"] for f in found_fields])
+    ts.watch("/profile").query("is_admin")
+    return app, ts, events
+
+def profile():
+    return flask.request.query_string
+
+def test_routes_before_init_app_are_watched():
+    app, ts, events = make_app()
+    app.add_url_rule("/profile", view_func=profile)
+    ts.init_app()
+    assert app.test_client().get("/profile?is_admin=1&a=b").data == b"a=b"
+    assert events == [["is_admin"]]
+
+def test_routes_after_init_app_are_watched():
+    app, ts, events = make_app()
+    ts.init_app()
+    app.add_url_rule("/profile", view_func=profile)
+    client = app.test_client()
+    assert client.get("/profile?is_admin=1").data == b""
+    assert client.get("/profile?is_admin=1").data == b""
+    assert events == [["is_admin"], ["is_admin"]]
+    # wrapped once, not once per re-index
+    assert app.view_functions["profile"].trappsec_view is profile
+
+def test_unwatched_routes_keep_their_view():
+    app, ts, events = make_app()
+    ts.init_app()
+    app.add_url_rule("/other", "other", profile)
+    assert app.test_client().get("/other?is_admin=1").data == b"is_admin=1"
+    assert app.view_functions["other"] is profile
+    assert events == []
+
+def test_wordlist_shadowing_a_route_is_logged(caplog):
+    app, ts, events = make_app()
+    app.add_url_rule("/profile", view_func=profile)
+    app.add_url_rule("/admin/users/<int:id>", "user", profile, methods=["DELETE"])
+    app.add_url_rule("/backup/<name>", "backup", profile)
+    ts.traps_from_wordlist(["/profile", "/admin/*", "/backup.zip", "/backup/*"]).methods("GET")
+    with caplog.at_level("WARNING", logger="trappsec"):
+        ts.init_app()
+    shadowed = [r.getMessage() for r in caplog.records if "shadows" in r.getMessage()]
+    assert shadowed == [
+        "`wordlist:0` shadows the application route /profile, requests to it are answered by the trap",
+        "`wordlist:0` shadows the application route /backup/<name>, requests to it are answered by the trap",
+    ]
+
+def test_canaries_in_headers_query_and_body():
+    app, ts, events = make_app()
+    ts.canary_tokens("canary-secret")
+    found = []
+    ts._trigger_canary_event = lambda req, canaries, location: found.append(location)
+    app.add_url_rule("/echo", "echo", lambda: flask.request.get_data(), methods=["POST"])
+    token = ts._canary.issue("/t")
+    body = app.test_client().post("/echo?k=" + token, headers={"x-api-key": token}, data="k=" + token,
+                                  content_type="text/plain").data
+    assert body == ("k=" + token).encode()
+    assert found == ["header", "query", "body"]
@@ -0,0 +1,187 @@
+import struct
+import ipaddress
+
+import pytest
+
+from trappsec.geoip import GeoIP, MMDBReader, RangeReader
+
+class Data:
+    """encodes the maxmind db data section, with explicit pointers to shared values."""
+    def __init__(self):
+        self.buf = b""
+
+    def add(self, value) -> int:
+        offset = len(self.buf)
+        self.buf += encode(value)
+        return offset
+
+class Pointer:
+    def __init__(self, offset):
+        self.offset = offset
+
+def _ctrl(kind, size):
+    if size < 29:
+        head, ext = size, b""
+    elif size < 285:
+        head, ext = 29, bytes([size - 29])
+    else:
+        head, ext = 30, (size - 285).to_bytes(2, "big")
+    if kind < 8:
+        return bytes([(kind << 5) | head]) + ext
+    return bytes([head, kind - 7]) + ext
+
+def encode(value) -> bytes:
+    if isinstance(value, Pointer):
+        assert value.offset < 2048
+        return bytes([(1 << 5) | (value.offset >> 8)]) + bytes([value.offset & 0xFF])
+    if isinstance(value, bool):
+        return _ctrl(14, int(value))
+    if isinstance(value, str):
+        raw = value.encode("utf-8")
+        return _ctrl(2, len(raw)) + raw
+    if isinstance(value, float):
+        return _ctrl(3, 8) + struct.pack(">d", value)
+    if isinstance(value, int):
+        raw = value.to_bytes((value.bit_length() + 7) // 8, "big")
+        return _ctrl(6 if value < 2 ** 32 else 9, len(raw)) + raw
+    if isinstance(value, dict):
+        return _ctrl(7, len(value)) + b"".join(encode(k) + encode(v) for k, v in value.items())
+    if isinstance(value, list):
+        return _ctrl(11, len(value)) + b"".join(encode(v) for v in value)
+    raise TypeError(value)
+
+def write_mmdb(path, networks, data, ip_version=6):
+    """`networks` maps cidrs to data section offsets; ipv4 cidrs go under ::/96 in an ipv6 tree."""
+    nodes = [[None, None]]
+    bits = 128 if ip_version == 6 else 32
+    for cidr, offset in networks.items():
+        network = ipaddress.ip_network(cidr)
+        value, prefix = int(network.network_address), network.prefixlen
+        if ip_version == 6 and network.version == 4:
+            prefix += 96
+        path_bits = [(value >> (network.max_prefixlen - 1 - i)) & 1 for i in range(network.prefixlen)]
+        path_bits = [0] * (prefix - network.prefixlen) + path_bits
+
+        node = 0
+        for bit in path_bits[:-1]:
+            if nodes[node][bit] is None:
+                nodes.append([None, None])
+                nodes[node][bit] = ("node", len(nodes) - 1)
+            node = nodes[node][bit][1]
+        nodes[node][path_bits[-1]] = ("data", offset)
+
+    count = len(nodes)
+
+    def record(r):
+        if r is None:
+            return count
+        return r[1] if r[0] == "node" else count + 16 + r[1]
+
+    tree = b"".join(record(l).to_bytes(3, "big") + record(r).to_bytes(3, "big") for l, r in nodes)
+    metadata = encode({"node_count": count, "record_size": 24, "ip_version": ip_version, "database_type": "test"})
+    with open(path, "wb") as f:
+        f.write(tree + b"\x00" * 16 + data.buf + b"\xab\xcd\xefMaxMind.com" + metadata)
+
+@pytest.fixture
+def mmdb(tmp_path):
+    data = Data()
+    us = data.add({"iso_code": "US", "names": {"en": "United States"}})
+    google = data.add({
+        "country": Pointer(us),
+        "autonomous_system_number": 15169,
+        "autonomous_system_organization": "GOOGLE",
+        "location": {"latitude": 37.4, "accuracy": [1, 2.5, True]},
+    })
+    de = data.add({"registered_country": {"iso_code": "DE"}, "organization": "Example GmbH", "big": 2 ** 40})
+    # a pointer in place of the whole record
+    alias = data.add(Pointer(de))
+
+    path = str(tmp_path / "test.mmdb")
+    write_mmdb(path, {
+        "8.8.8.0/24": google,
+        "203.0.113.0/25": alias,
+        "2001:db8::/32": de,
+    }, data)
+    return path
+
+def test_mmdb_ipv4(mmdb):
+    reader = MMDBReader(mmdb)
+    assert reader.enrich("8.8.8.8") == {"country": "US", "asn": 15169, "org": "GOOGLE"}
+    assert reader.enrich("203.0.113.127") == {"country": "DE", "asn": None, "org": "Example GmbH"}
+
+def test_mmdb_full_record_with_pointers(mmdb):
+    record = MMDBReader(mmdb).get("8.8.8.1")
+    assert record["country"] == {"iso_code": "US", "names": {"en": "United States"}}
+    assert record["location"] == {"latitude": 37.4, "accuracy": [1, 2.5, True]}
+    assert MMDBReader(mmdb).get("203.0.113.1")["big"] == 2 ** 40
+
+def test_mmdb_ipv6(mmdb):
+    assert MMDBReader(mmdb).enrich("2001:db8::1") == {"country": "DE", "asn": None, "org": "Example GmbH"}
+
+def test_mmdb_ipv4_mapped(mmdb):
+    assert MMDBReader(mmdb).enrich("::ffff:8.8.8.8") == {"country": "US", "asn": 15169, "org": "GOOGLE"}
+
+@pytest.mark.parametrize("ip", ["8.8.4.4", "203.0.113.128", "2001:db9::1", "::1", "0.0.0.0"])
+def test_mmdb_missing(mmdb, ip):
+    reader = MMDBReader(mmdb)
+    assert reader.enrich(ip) == {}
+    assert reader.get(ip) is None
+
+def test_mmdb_ipv4_only_database(tmp_path):
+    data = Data()
+    offset = data.add({"country": {"iso_code": "FR"}})
+    path = str(tmp_path / "v4.mmdb")
+    write_mmdb(path, {"192.0.2.0/24": offset}, data, ip_version=4)
+
+    reader = MMDBReader(path)
+    assert reader.enrich("192.0.2.9")["country"] == "FR"
+    assert reader.enrich("::ffff:192.0.2.9")["country"] == "FR"
+    assert reader.enrich("2001:db8::1") == {}
+
+def test_mmdb_rejects_other_files(tmp_path):
+    path = tmp_path / "not.mmdb"
+    path.write_bytes(b"\x00" * 64)
+    with pytest.raises(ValueError):
+        MMDBReader(str(path))
+
+@pytest.fixture
+def ranges(tmp_path):
+    path = tmp_path / "ranges.csv"
+    path.write_text("\n".join([
+        "start,end,country,asn,org",
+        "1.0.0.0,1.0.0.255,AU,13335,Cloudflare",
+        "",
+        "8.8.8.0,8.8.8.255,US,15169,Google",
+        "10.0.0.0,10.255.255.255,,,",
+        "203.0.113.0,203.0.113.127,DE,,Example GmbH",
+        "2001:db8::,2001:db8:ffff:ffff:ffff:ffff:ffff:ffff,NL,64500,Example BV",
+    ]) + "\n")
+    return str(path)
+
+@pytest.mark.parametrize("ip, expected", [
+    ("1.0.0.0", {"country": "AU", "asn": 13335, "org": "Cloudflare"}),
+    ("1.0.0.255", {"country": "AU", "asn": 13335, "org": "Cloudflare"}),
+    ("8.8.8.8", {"country": "US", "asn": 15169, "org": "Google"}),
+    ("10.1.2.3", {"country": None, "asn": None, "org": None}),
+    ("203.0.113.5", {"country": "DE", "asn": None, "org": "Example GmbH"}),
+    ("::ffff:8.8.8.8", {"country": "US", "asn": 15169, "org": "Google"}),
+    ("2001:db8::1", {"country": "NL", "asn": 64500, "org": "Example BV"}),
+])
+def test_range_lookup(ranges, ip, expected):
+    assert RangeReader(ranges).enrich(ip) == expected
+
+@pytest.mark.parametrize("ip", ["0.0.0.1", "1.0.1.0", "8.8.9.0", "203.0.113.128", "255.255.255.255", "::1", "2001:db9::"])
+def test_range_missing(ranges, ip):
+    assert RangeReader(ranges).enrich(ip) == {}
+
+def test_geoip_merges_files_and_returns_copies(mmdb, ranges):
+    geoip = GeoIP([mmdb, ranges], cache_size=2)
+    first = geoip.lookup("203.0.113.5")
+    # the mmdb has no asn for this address, the range file has none either
+    assert first == {"country": "DE", "org": "Example GmbH"}
+
+    first["country"] = "XX"
+    assert geoip.lookup("203.0.113.5")["country"] == "DE"
+    assert geoip.lookup("1.0.0.1") == {"country": "AU", "asn": 13335, "org": "Cloudflare"}
+    assert geoip.lookup("not an ip") == {}
+    assert len(geoip._cache) == 2
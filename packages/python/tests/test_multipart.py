@@ -0,0 +1,130 @@
+import io
+
+import pytest
+
+from trappsec.multipart import MultipartFilter, FilteredInput, get_boundary, MAX_FIELD_SIZE
+
+BOUNDARY = b"----trappsec1234"
+
+def part(name, value, filename=None):
+    disposition = f'form-data; name="{name}"'
+    if filename:
+        disposition += f'; filename="{filename}"'
+    return b"--" + BOUNDARY + b"\r\nContent-Disposition: " + disposition.encode() + b"\r\n\r\n" + value + b"\r\n"
+
+def body(*parts, preamble=b"", epilogue=b"", close=True):
+    data = preamble + b"".join(parts)
+    if close:
+        data += b"--" + BOUNDARY + b"--\r\n"
+    return data + epilogue
+
+def run(data, fields=("is_admin",), chunk_size=None, drop=True):
+    seen = []
+
+    def inspect(name, value):
+        seen.append((name, value))
+        return drop
+
+    f = MultipartFilter(BOUNDARY, set(fields), inspect)
+    chunk_size = chunk_size or len(data) or 1
+    out = b"".join(f.feed(data[i:i + chunk_size]) for i in range(0, len(data), chunk_size))
+    return out + f.finish(), seen
+
+def test_get_boundary():
+    assert get_boundary('multipart/form-data; boundary="abc"') == b"abc"
+    assert get_boundary("multipart/form-data; charset=utf-8; boundary=abc") == b"abc"
+    assert get_boundary("multipart/form-data") is None
+    assert get_boundary(None) is None
+
+def test_drops_watched_field():
+    data = body(part("name", b"alice"), part("is_admin", b"true"), part("email", b"a@example.com"))
+    out, seen = run(data)
+    assert seen == [("is_admin", "true")]
+    assert out == body(part("name", b"alice"), part("email", b"a@example.com"))
+
+def test_keeps_field_when_inspect_returns_false():
+    data = body(part("name", b"alice"), part("is_admin", b"false"))
+    out, seen = run(data, drop=False)
+    assert seen == [("is_admin", "false")]
+    assert out == data
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, len(BOUNDARY) - 1, len(BOUNDARY) + 1, 64])
+def test_boundary_split_across_reads(chunk_size):
+    data = body(part("name", b"alice"), part("is_admin", b"true"), part("email", b"a@example.com"))
+    out, seen = run(data, chunk_size=chunk_size)
+    assert seen == [("is_admin", "true")]
+    assert out == body(part("name", b"alice"), part("email", b"a@example.com"))
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1000])
+def test_preamble_and_epilogue_are_kept(chunk_size):
+    preamble = b"this is the preamble\r\n"
+    epilogue = b"and this the epilogue\r\n"
+    data = body(part("is_admin", b"1"), part("name", b"bob"), preamble=preamble, epilogue=epilogue)
+    out, seen = run(data, chunk_size=chunk_size)
+    assert seen == [("is_admin", "1")]
+    assert out == body(part("name", b"bob"), preamble=preamble, epilogue=epilogue)
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 1000])
+def test_missing_final_boundary(chunk_size):
+    # a truncated body is passed on as it came, the held field is released on finish
+    data = body(part("name", b"alice"), part("is_admin", b"true"), close=False)
+    out, seen = run(data, chunk_size=chunk_size, drop=False)
+    assert out == data
+
+    data = body(part("name", b"alice"), close=False) + b"--" + BOUNDARY + b'\r\nContent-Disposition: form-data; name="is_admin"\r\n\r\ntru'
+    out, seen = run(data, chunk_size=chunk_size)
+    assert out == data
+    assert seen == []
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1000])
+def test_lookalike_boundary_in_value(chunk_size):
+    # the boundary only counts after a CRLF and in full
+    tricky = b"--" + BOUNDARY[:-1] + b"X\r\n--" + BOUNDARY[:5] + b" --" + BOUNDARY + b" inline"
+    data = body(part("bio", tricky), part("is_admin", tricky))
+    out, seen = run(data, chunk_size=chunk_size)
+    assert seen == [("is_admin", tricky.decode())]
+    assert out == body(part("bio", tricky))
+
+def test_file_parts_are_never_held():
+    data = body(part("is_admin", b"file contents", filename="is_admin.txt"), part("name", b"x"))
+    out, seen = run(data)
+    assert seen == []
+    assert out == data
+
+def test_passthrough_once_every_field_was_seen():
+    f = MultipartFilter(BOUNDARY, {"is_admin"}, lambda name, value: True)
+    f.feed(body(part("is_admin", b"true"), part("name", b"x"), close=False))
+    assert f.done
+    assert f.feed(b"anything at all") == b"anything at all"
+
+def test_oversized_field_is_dropped_and_reported_truncated():
+    value = b"a" * (MAX_FIELD_SIZE + 10)
+    out, seen = run(body(part("is_admin", value), part("name", b"x")), chunk_size=4096)
+    assert seen == [("is_admin", "a" * MAX_FIELD_SIZE)]
+    assert out == body(part("name", b"x"))
+
+@pytest.mark.parametrize("read", ["all", "sized", "lines"])
+def test_filtered_input(read):
+    data = body(part("name", b"alice"), part("is_admin", b"true"), part("email", b"a@example.com"))
+    completed = []
+    stream = FilteredInput(io.BytesIO(data), len(data), MultipartFilter(BOUNDARY, {"is_admin"}, lambda n, v: True),
+        lambda: completed.append(True), chunk_size=5)
+
+    if read == "all":
+        out = stream.read()
+    elif read == "sized":
+        out = b"".join(iter(lambda: stream.read(3), b""))
+    else:
+        out = b"".join(stream)
+
+    assert out == body(part("name", b"alice"), part("email", b"a@example.com"))
+    assert completed == [True]
+
+def test_filtered_input_drain_completes_once():
+    data = body(part("is_admin", b"true"))
+    completed = []
+    stream = FilteredInput(io.BytesIO(data), len(data), MultipartFilter(BOUNDARY, {"is_admin"}, lambda n, v: True),
+        lambda: completed.append(True))
+    stream.drain()
+    stream.drain()
+    assert completed == [True]
@@ -0,0 +1,55 @@
+import ipaddress
+
+import pytest
+
+from trappsec.networks import NetworkSet
+
+NETWORKS = ["10.0.0.0/8", "192.168.1.0/24", "203.0.113.7", "2001:db8::/32", "fd00::/8", "2001:db8:ffff::1/128"]
+
+@pytest.mark.parametrize("ip, expected", [
+    ("10.1.2.3", True),
+    ("11.0.0.0", False),
+    ("192.168.1.255", True),
+    ("192.168.2.0", False),
+    ("203.0.113.7", True),
+    ("203.0.113.8", False),
+    ("2001:db8:1::5", True),
+    ("2001:db9::", False),
+    ("fdff::1", True),
+    ("fe00::1", False),
+    ("::ffff:10.0.0.1", True),
+    ("::ffff:11.0.0.1", False),
+    ("not an ip", False),
+    ("", False),
+])
+def test_contains(ip, expected):
+    assert (ip in NetworkSet(NETWORKS)) is expected
+
+def test_versions_dont_mix():
+    # 10.0.0.0/8 and ::a00:0/104 are the same integers, the tables are kept per version
+    networks = NetworkSet(["10.0.0.0/8"])
+    assert "a00::1" not in networks
+    assert "::a00:1" not in networks
+    assert "10.0.0.1" not in NetworkSet(["::/8"])
+
+def test_overlapping_and_host_bits():
+    networks = NetworkSet(["10.0.0.0/8", "10.1.0.0/16", "10.1.2.3/24"])
+    assert "10.1.2.200" in networks
+    assert len(networks._tables[4]) == 1
+
+def test_matches_ipaddress():
+    networks = [ipaddress.ip_network(n) for n in ("172.16.0.0/12", "100.64.0.0/10", "2001:db8:8000::/33")]
+    table = NetworkSet(str(n) for n in networks)
+    for ip in ("172.15.255.255", "172.16.0.0", "172.31.255.255", "172.32.0.0", "100.63.255.255", "100.64.0.1",
+               "100.127.255.255", "100.128.0.0", "2001:db8:7fff::", "2001:db8:8000::", "2001:db8:ffff::1", "2001:db9::"):
+        address = ipaddress.ip_address(ip)
+        assert (ip in table) == any(address in n for n in networks if n.version == address.version)
+
+def test_empty():
+    assert not NetworkSet([])
+    assert NetworkSet(["::1"])
+    assert "127.0.0.1" not in NetworkSet([])
+
+def test_invalid_network():
+    with pytest.raises(ValueError):
+        NetworkSet(["10.0.0.0/33"])
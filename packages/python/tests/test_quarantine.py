@@ -0,0 +1,132 @@
+import io
+import json
+
+import pytest
+
+from trappsec import Sentry
+from trappsec.quarantine import Quarantine
+from trappsec.wsgi import TrappsecMiddleware
+
+IP = "203.0.113.7"
+
+def test_ttl_expiry():
+    quarantine = Quarantine(ttl=60)
+    quarantine.add(IP, now=1000)
+    assert quarantine.contains("ip:" + IP, now=1059)
+    assert not quarantine.contains("ip:" + IP, now=1060)
+    # expired entries are dropped on lookup
+    assert quarantine._until == {}
+
+def test_readding_extends():
+    quarantine = Quarantine(ttl=60)
+    quarantine.add(IP, now=1000)
+    quarantine.add(IP, now=1050)
+    assert quarantine.contains("ip:" + IP, now=1100)
+
+def test_capacity_evicts_oldest():
+    quarantine = Quarantine(ttl=60, max_actors=2)
+    for i, ip in enumerate(["10.0.0.1", "10.0.0.2", "10.0.0.1", "10.0.0.3"]):
+        quarantine.add(ip, now=1000 + i)
+    assert not quarantine.contains("ip:10.0.0.2", now=1010)
+    assert quarantine.contains("ip:10.0.0.1", now=1010)
+    assert quarantine.contains("ip:10.0.0.3", now=1010)
+
+def test_keys_and_release():
+    quarantine = Quarantine(ttl=60, key="both")
+    quarantine.add(IP, "alice", now=1000)
+    assert quarantine.keys(IP, "alice") == ["ip:" + IP, "user:alice"]
+    quarantine.remove(user="alice")
+    assert not quarantine.contains("user:alice", now=1001)
+    assert quarantine.contains("ip:" + IP, now=1001)
+
+    assert Quarantine(60, key="user").keys(IP, None) == []
+    with pytest.raises(ValueError):
+        Quarantine(60, key="session")
+
+class Recorder:
+    blocking = False
+
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event):
+        self.events.append(event)
+
+def sentry(app=None, **kwargs):
+    ts = Sentry(app, "s", "e")
+    recorder = Recorder()
+    ts._handlers = [recorder]
+    ts.trap("/trap").methods("GET", "POST")
+    ts.quarantine(ttl=600, status=403, body={"error": "blocked"}, **kwargs)
+    ts.canary_tokens("canary-secret")
+    return ts, recorder.events
+
+def app(environ, start_response):
+    start_response("200 OK", [])
+    return [b"app"]
+
+def wsgi_call(middleware, path, headers=None):
+    status, response_headers = [], []
+    environ = {"REQUEST_METHOD": "GET", "PATH_INFO": path, "REMOTE_ADDR": IP, "wsgi.input": io.BytesIO()}
+    environ.update(headers or {})
+    response = middleware(environ, lambda s, h, exc_info=None: (status.append(s), response_headers.extend(h)))
+    body = b"".join(response)
+    if hasattr(response, "close"):
+        response.close()
+    return status[0], dict(response_headers), body
+
+def test_wsgi_quarantines_and_releases():
+    ts, events = sentry()
+    middleware = TrappsecMiddleware(app, ts)
+    assert wsgi_call(middleware, "/")[0] == "200 OK"
+    wsgi_call(middleware, "/trap")
+
+    status, _, body = wsgi_call(middleware, "/", {"HTTP_X_KEY": ts._canary.issue("/t")})
+    assert (status, json.loads(body)) == ("403 Forbidden", {"error": "blocked"})
+    # answered before canary scanning and traps: no more events
+    assert wsgi_call(middleware, "/trap")[0] == "403 Forbidden"
+    assert [e["event"] for e in events] == ["trappsec.trap_hit"]
+
+    ts.release(ip=IP)
+    assert wsgi_call(middleware, "/")[0] == "200 OK"
+
+def test_wsgi_tarpitted_quarantine_response():
+    ts, events = sentry(tarpit=0.01)
+    middleware = TrappsecMiddleware(app, ts)
+    wsgi_call(middleware, "/trap")
+    status, headers, body = wsgi_call(middleware, "/")
+    assert status == "403 Forbidden" and json.loads(body) == {"error": "blocked"}
+    assert "Content-Length" not in headers
+
+def test_flask_answers_before_canaries_and_traps():
+    flask = pytest.importorskip("flask")
+    flask_app = flask.Flask(__name__)
+    ts, events = sentry(flask_app)
+    flask_app.add_url_rule("/", "index", lambda: "index")
+    client = flask_app.test_client()
+
+    assert client.get("/").status_code == 200
+    client.get("/trap")
+    response = client.get("/", headers={"x-key": ts._canary.issue("/t")})
+    assert (response.status_code, response.json) == (403, {"error": "blocked"})
+    assert client.get("/trap").status_code == 403
+    assert [e["event"] for e in events] == ["trappsec.trap_hit"]
+
+def test_fastapi_answers_before_canaries_and_traps():
+    pytest.importorskip("fastapi")
+    pytest.importorskip("httpx")
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    fastapi_app = FastAPI()
+    ts, events = sentry(fastapi_app)
+    ts.identity.ip = lambda r: IP
+    fastapi_app.add_api_route("/", lambda: {"ok": True})
+
+    with TestClient(fastapi_app) as client:
+        assert client.get("/").status_code == 200
+        client.get("/trap")
+        response = client.get("/", headers={"x-key": ts._canary.issue("/t")})
+        assert (response.status_code, response.json()) == (403, {"error": "blocked"})
+        assert client.get("/trap").status_code == 403
+    assert [e["event"] for e in events] == ["trappsec.trap_hit"]
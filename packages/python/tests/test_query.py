@@ -0,0 +1,73 @@
+import io
+
+import pytest
+
+from trappsec import Sentry
+from trappsec.query import compile_prefilter, parse_query, strip_query
+from trappsec.inspection import inspect_query
+from trappsec.wsgi import TrappsecMiddleware
+
+NAMES = {"is_admin": {}, "debug": {}}
+
+@pytest.mark.parametrize("raw, hit", [
+    (b"is_admin=1", True),
+    (b"a=1&is_admin=1", True),
+    (b"a=1&debug", True),
+    (b"debug&a=1", True),
+    (b"is_admin=", True),
+    (b"not_is_admin=1", False),
+    (b"is_admin_x=1", False),
+    (b"a=is_admin", False),
+    (b"a=1;is_admin=1", False),
+    # possibly encoded names always go to the full parse
+    (b"is%5Fadmin=1", True),
+    (b"a+b=1", True),
+])
+def test_prefilter(raw, hit):
+    assert bool(compile_prefilter(NAMES).search(raw)) is hit
+
+def test_no_prefilter_without_names():
+    assert compile_prefilter({}) is None
+
+def test_parse_query():
+    assert parse_query(b"a=1&a=2&b=&c&d=x%20y+z") == {"a": ["1", "2"], "b": [""], "c": [""], "d": ["x y z"]}
+
+@pytest.mark.parametrize("raw, stripped", [
+    (b"a=1&is_admin=1&b=2", b"a=1&b=2"),
+    (b"is%5Fadmin=1&b=2", b"b=2"),
+    (b"is_admin=1&a=1&is_admin=2", b"a=1"),
+    (b"is_admin=&debug&a=", b"a="),
+    (b"a=1;is_admin=1", b"a=1;is_admin=1"),
+    (b"q=a%20b+c&x=%ZZ&is_admin=1&&z", b"q=a%20b+c&x=%ZZ&&z"),
+])
+def test_strip_query(raw, stripped):
+    assert strip_query(raw, NAMES) == stripped
+
+def watch(ts):
+    ts.watch("/p").query("is_admin").query("debug")
+    return ts.init_app()._ruleset.match_watch("/p")
+
+def test_prefilter_hit_without_a_field():
+    ts = Sentry(None, "s", "e")
+    assert inspect_query(ts, None, b"a+b=1&c%20d=2", watch(ts)) == ([], None)
+
+def test_encoded_name_is_found():
+    ts = Sentry(None, "s", "e")
+    found, stripped = inspect_query(ts, None, b"x=1&is%5Fadmin=true", watch(ts))
+    assert [(f["field"], f["value"]) for f in found] == [("is_admin", ["true"])]
+    assert stripped == b"x=1"
+
+@pytest.mark.parametrize("query", ["a+b=1&c%20d=%ZZ;e", "x=is_admin&y=debug", "a=1;is_admin=1"])
+def test_query_without_fields_is_byte_identical(query):
+    ts = Sentry(None, "s", "e")
+    ts.watch("/p").query("is_admin").query("debug")
+    seen = []
+
+    def app(environ, start_response):
+        seen.append(environ["QUERY_STRING"])
+        start_response("200 OK", [])
+        return [b""]
+
+    environ = {"REQUEST_METHOD": "GET", "PATH_INFO": "/p", "QUERY_STRING": query, "REMOTE_ADDR": "203.0.113.7", "wsgi.input": io.BytesIO()}
+    b"".join(TrappsecMiddleware(app, ts)(environ, lambda *args: None))
+    assert seen == [query]
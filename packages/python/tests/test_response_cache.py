@@ -0,0 +1,49 @@
+import io
+import json
+import logging
+
+from trappsec import Sentry
+from trappsec.wsgi import TrappsecMiddleware
+
+def app(environ, start_response):
+    start_response("200 OK", [])
+    return [b"app"]
+
+def call(middleware, path="/trap", ip="203.0.113.7"):
+    status = []
+    environ = {"REQUEST_METHOD": "GET", "PATH_INFO": path, "REMOTE_ADDR": ip, "wsgi.input": io.BytesIO()}
+    body = b"".join(middleware(environ, lambda s, headers, exc_info=None: status.append(s)))
+    return status[0], body
+
+def serve(key):
+    ts = Sentry(None, "s", "e")
+    hits = []
+    def body(environ):
+        hits.append(1)
+        return {"n": len(hits)}
+    ts.trap("/trap").methods("GET").cache(60, key=key).if_unauthenticated(200, body=body)
+    return TrappsecMiddleware(app, ts), hits
+
+def test_cached_by_key():
+    middleware, hits = serve(lambda environ: environ["REMOTE_ADDR"])
+    assert call(middleware)[1] == call(middleware)[1]
+    assert json.loads(call(middleware, ip="203.0.113.8")[1]) == {"n": 2}
+    assert len(hits) == 2
+
+def test_none_key_is_not_cached():
+    middleware, hits = serve(lambda environ: None)
+    call(middleware)
+    call(middleware)
+    assert len(hits) == 2
+
+def test_unhashable_key_is_served_uncached(caplog):
+    middleware, hits = serve(lambda environ: {"ip": environ["REMOTE_ADDR"]})
+    with caplog.at_level(logging.ERROR):
+        assert call(middleware) == ("200 OK", b'{"n": 1}')
+        assert call(middleware) == ("200 OK", b'{"n": 2}')
+    assert "must be hashable, got dict" in caplog.text
+
+def test_failing_key_is_served_uncached():
+    middleware, hits = serve(lambda environ: 1 / 0)
+    assert call(middleware)[0] == "200 OK"
+    assert len(hits) == 1
@@ -0,0 +1,42 @@
+import json
+import threading
+
+from trappsec import Sentry
+
+def write(path, *traps):
+    path.write_text(json.dumps({"traps": [{"path": p} for p in traps]}))
+
+def test_load_rules_before_init_app(tmp_path):
+    rules = tmp_path / "rules.json"
+    write(rules, "/old")
+    ts = Sentry(None, "s", "e").load_rules(str(rules))
+    assert ts._ruleset is None
+    assert ts.init_app()._ruleset.match_trap("/old", "GET") is not None
+
+def test_reload_swaps_the_ruleset(tmp_path):
+    rules = tmp_path / "rules.json"
+    write(rules, "/old")
+    ts = Sentry(None, "s", "e").load_rules(str(rules), reload_interval=3600).init_app()
+
+    write(rules, "/new")
+    ts._rules_watcher.on_change()
+    assert ts._ruleset.match_trap("/old", "GET") is None
+    assert ts._ruleset.match_trap("/new", "GET") is not None
+
+def test_reload_waits_for_init_lock(tmp_path):
+    rules = tmp_path / "rules.json"
+    write(rules, "/old")
+    ts = Sentry(None, "s", "e").load_rules(str(rules), reload_interval=3600).init_app()
+    ruleset = ts._ruleset
+
+    write(rules, "/new")
+    with ts._init_lock:
+        reloader = threading.Thread(target=ts._rules_watcher.on_change)
+        reloader.start()
+        reloader.join(0.2)
+        # the file is parsed, but nothing is swapped while the lock is held
+        assert reloader.is_alive()
+        assert ts._ruleset is ruleset
+
+    reloader.join(5)
+    assert ts._ruleset.match_trap("/new", "GET") is not None
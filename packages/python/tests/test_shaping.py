@@ -0,0 +1,75 @@
+import json
+import time
+import hashlib
+
+from trappsec import Sentry
+from trappsec.shaping import EventShaper
+
+def sha256(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+def test_small_events_are_unchanged():
+    event = {"event": "trappsec.trap_hit", "path": "/admin", "metadata": {"a": [1, 2.5, None, True]}}
+    assert EventShaper().shape(dict(event)) == event
+
+def test_truncates_long_strings():
+    agent = "x" * 5000
+    event = EventShaper(max_length=100, lengths={"path": 10}).shape({"user_agent": agent, "path": "/" + "p" * 20})
+    assert event["user_agent"] == "x" * 100
+    assert event["path"] == "/" + "p" * 9
+    assert event["shaped"]["user_agent"] == {"length": 5000, "sha256": sha256(agent)}
+    assert event["shaped"]["path"]["length"] == 21
+
+def test_limits_depth():
+    deep = {"a": {"b": {"c": {"d": 1}}}}
+    event = EventShaper(max_depth=2).shape({"metadata": deep})
+    assert event["metadata"] == {"a": {"b": None}}
+    assert event["shaped"] == {"metadata.a.b": {"dropped": "depth"}}
+
+def test_limits_items():
+    event = EventShaper(max_items=3).shape({"metadata": {"ids": list(range(10)), "keys": {str(i): i for i in range(5)}}})
+    assert event["metadata"]["ids"] == [0, 1, 2]
+    assert event["metadata"]["keys"] == {"0": 0, "1": 1, "2": 2}
+    assert event["shaped"]["metadata.ids"] == {"length": 10}
+    assert event["shaped"]["metadata.keys"] == {"length": 5}
+
+def test_found_fields_values():
+    found = [{"type": "body", "field": "f%d" % i, "value": "v" * 50, "intent": None} for i in range(4)]
+    event = EventShaper(max_length=10, max_items=2).shape({"found_fields": found})
+    assert [f["field"] for f in event["found_fields"]] == ["f0", "f1"]
+    assert event["found_fields"][0]["value"] == "v" * 10
+    assert event["shaped"]["found_fields"] == {"length": 4}
+    assert event["shaped"]["found_fields.0.value"]["length"] == 50
+
+def test_non_json_values_are_stringified():
+    event = EventShaper().shape({"metadata": {"raw": b"bytes", "obj": object}})
+    assert event["metadata"]["raw"] == "bytes"
+    assert isinstance(event["metadata"]["obj"], str)
+
+def test_fits_max_bytes():
+    found = [{"type": "body", "field": "a", "value": "a" * 900}, {"type": "body", "field": "b", "value": "b" * 500}]
+    event = EventShaper(max_length=None, max_bytes=1000).shape({"event": "e", "metadata": {"m": "m" * 400}, "found_fields": found})
+    assert len(json.dumps(event)) <= 1000
+    assert event["metadata"] is None
+    assert event["shaped"]["metadata"]["dropped"] == "size"
+    # the largest value goes first, the other one still fits
+    assert event["found_fields"][0]["value"] is None
+    assert event["found_fields"][1]["value"] == "b" * 500
+
+def test_notes_are_bounded():
+    event = EventShaper(max_length=1, max_items=3).shape({"metadata": {str(i): "long" for i in range(3)}, "a": "aa", "b": "bb"})
+    assert len(event["shaped"]) == 4
+    assert event["shaped"]["..."] == {"more": 2}
+
+def test_off_by_default():
+    ts = Sentry(None, "s", "e")
+    events = []
+    ts._handlers = [type("H", (), {"emit": lambda self, e: events.append(e), "blocking": False})()]
+    ts._trigger({"timestamp": time.time(), "event": "trappsec.rule_hit", "type": "signal", "user_agent": "x" * 5000})
+    assert len(events[0]["user_agent"]) == 5000
+    assert "shaped" not in events[0]
+
+    ts.shape_events(max_length=10)
+    ts._trigger({"timestamp": time.time(), "event": "trappsec.rule_hit", "type": "signal", "user_agent": "x" * 5000})
+    assert events[1]["user_agent"] == "x" * 10
+    assert "user_agent" in events[1]["shaped"]
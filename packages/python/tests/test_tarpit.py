@@ -0,0 +1,91 @@
+import io
+import os
+import time
+
+import pytest
+
+from trappsec import Sentry
+from trappsec.wsgi import TrappsecMiddleware, TarpitSlots
+
+TARPIT = {"delay": 0.05, "drip_bytes": 4}
+
+def sentry(limit=1, app=None):
+    ts = Sentry(app, "s", "e")
+    ts.tarpit_limit = limit
+    ts._trigger = lambda ctx: None
+    ts.trap("/trap").methods("GET").tarpit(0.05, drip_bytes=4).if_unauthenticated(200, "0123456789", mime_type="text/plain")
+    return ts
+
+def test_drips_chunks():
+    slots = TarpitSlots(sentry())
+    chunks, release = slots.drip(b"0123456789", TARPIT)
+    start = time.monotonic()
+    assert list(chunks) == [b"0123", b"4567", b"89"]
+    assert time.monotonic() - start >= 0.04
+    release()
+
+def test_cap_and_release():
+    slots = TarpitSlots(sentry(limit=2))
+    first, second = slots.drip(b"a", TARPIT), slots.drip(b"b", TARPIT)
+    assert first is not None and second is not None
+    assert slots.drip(b"c", TARPIT) is None
+    first[1]()
+    third = slots.drip(b"c", TARPIT)
+    assert third is not None
+    second[1]()
+    third[1]()
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_slots_reset_in_forked_child():
+    slots = TarpitSlots(sentry())
+    _, release = slots.drip(b"a", TARPIT)
+    pid = os.fork()
+    if pid == 0:
+        # the slot is held by a response of the parent, which never ends here
+        os._exit(0 if slots.drip(b"b", TARPIT) is not None else 1)
+    assert os.waitpid(pid, 0)[1] == 0
+    assert slots.drip(b"b", TARPIT) is None
+    release()
+
+def wsgi_call(middleware):
+    environ = {"REQUEST_METHOD": "GET", "PATH_INFO": "/trap", "REMOTE_ADDR": "203.0.113.7", "wsgi.input": io.BytesIO()}
+    return middleware(environ, lambda status, headers, exc_info=None: None)
+
+def test_wsgi_falls_back_once_the_cap_is_reached():
+    middleware = TrappsecMiddleware(None, sentry())
+    tarpitted = wsgi_call(middleware)
+    assert hasattr(tarpitted, "close")
+
+    # every slot taken: answered at once, with a content-length
+    assert wsgi_call(middleware) == [b"0123456789"]
+
+    assert b"".join(tarpitted) == b"0123456789"
+    tarpitted.close()
+    again = wsgi_call(middleware)
+    assert hasattr(again, "close")
+    again.close()
+
+def test_wsgi_releases_when_closed_unread():
+    middleware = TrappsecMiddleware(None, sentry())
+    wsgi_call(middleware).close()
+    response = wsgi_call(middleware)
+    assert hasattr(response, "close")
+    response.close()
+
+def test_flask_falls_back_once_the_cap_is_reached():
+    flask = pytest.importorskip("flask")
+    app = flask.Flask(__name__)
+    sentry(app=app).init_app()
+    client = app.test_client()
+
+    # a dripped body has no content-length, an immediate one does
+    tarpitted = client.get("/trap", buffered=False)
+    assert "Content-Length" not in tarpitted.headers
+    immediate = client.get("/trap", buffered=False)
+    assert immediate.headers["Content-Length"] == "10" and immediate.data == b"0123456789"
+
+    assert tarpitted.get_data() == b"0123456789"
+    tarpitted.close()
+    again = client.get("/trap", buffered=False)
+    assert "Content-Length" not in again.headers
+    again.close()
@@ -0,0 +1,110 @@
+import pytest
+
+from trappsec import Sentry
+from trappsec.timeline import ActorTimeline, DistinctTrapsRule, SequenceRule
+
+T = 1700000000.0
+
+def hit(t, path, ip="1.1.1.1", user=None, event="trappsec.trap_hit", type="signal", intent=None):
+    # `t` is in seconds from a fixed epoch time
+    return {"timestamp": T + t, "event": event, "type": type, "path": path, "ip": ip, "user": user, "intent": intent}
+
+def test_distinct_traps_within_window():
+    timeline = ActorTimeline([DistinctTrapsRule("scan", 3, 60, intent="recon")])
+    assert timeline.record(hit(0, "/a")) == []
+    assert timeline.record(hit(10, "/a")) == []
+    assert timeline.record(hit(20, "/b")) == []
+    escalations = timeline.record(hit(30, "/c"))
+    assert len(escalations) == 1
+    escalation = escalations[0]
+    assert escalation["rule"] == "scan" and escalation["intent"] == "recon" and escalation["actor"] == "ip:1.1.1.1"
+    assert [e["path"] for e in escalation["events"]] == ["/a", "/b", "/c"]
+    assert escalation["events"][0]["timestamp"] == T + 10
+
+def test_distinct_traps_outside_window():
+    timeline = ActorTimeline([DistinctTrapsRule("scan", 3, 60)])
+    timeline.record(hit(0, "/a"))
+    timeline.record(hit(50, "/b"))
+    assert timeline.record(hit(61, "/c")) == []
+    assert len(timeline.record(hit(100, "/d"))) == 1
+
+def test_distinct_traps_only_counts_trap_hits():
+    timeline = ActorTimeline([DistinctTrapsRule("scan", 2, 60)])
+    timeline.record(hit(0, "/a", event="trappsec.watch_hit"))
+    assert timeline.record(hit(1, "/b")) == []
+
+def test_fires_once_per_window():
+    timeline = ActorTimeline([DistinctTrapsRule("scan", 2, 60)])
+    timeline.record(hit(0, "/a"))
+    assert len(timeline.record(hit(1, "/b"))) == 1
+    assert timeline.record(hit(2, "/c")) == []
+    assert len(timeline.record(hit(62, "/d"))) == 1
+
+def test_actors_are_separate():
+    timeline = ActorTimeline([DistinctTrapsRule("scan", 2, 60)])
+    timeline.record(hit(0, "/a", ip="1.1.1.1"))
+    assert timeline.record(hit(1, "/b", ip="2.2.2.2")) == []
+
+def test_user_and_both_keys():
+    timeline = ActorTimeline([DistinctTrapsRule("scan", 2, 60)], key="both")
+    timeline.record(hit(0, "/a", ip="1.1.1.1", user="alice"))
+    escalations = timeline.record(hit(1, "/b", ip="2.2.2.2", user="alice"))
+    assert [e["actor"] for e in escalations] == ["user:alice"]
+    assert len(timeline.history(user="alice")) == 2
+
+    with pytest.raises(ValueError):
+        ActorTimeline([], key="session")
+
+def test_sequence_order():
+    rule = SequenceRule("probe-then-login", {"path": "/.env"}, {"event": "trappsec.watch_hit", "type": "alert"}, 300)
+    timeline = ActorTimeline([rule])
+    # the wrong order never fires
+    timeline.record(hit(0, "/login", event="trappsec.watch_hit", type="alert"))
+    assert timeline.record(hit(1, "/.env")) == []
+
+    escalations = timeline.record(hit(2, "/login", event="trappsec.watch_hit", type="alert"))
+    assert [e["path"] for e in escalations[0]["events"]] == ["/.env", "/login"]
+
+def test_sequence_with_gaps_and_window():
+    rule = SequenceRule("seq", {"intent": "recon"}, {"path": "/admin"}, 60)
+    timeline = ActorTimeline([rule])
+    timeline.record(hit(0, "/x", intent="recon"))
+    timeline.record(hit(10, "/y"))
+    timeline.record(hit(20, "/z"))
+    assert len(timeline.record(hit(30, "/admin"))) == 1
+
+    timeline = ActorTimeline([rule])
+    timeline.record(hit(0, "/x", intent="recon"))
+    assert timeline.record(hit(61, "/admin")) == []
+
+def test_sequence_rejects_unknown_fields():
+    with pytest.raises(ValueError, match="cannot match"):
+        SequenceRule("seq", {"ip": "1.1.1.1"}, {"path": "/a"}, 60)
+
+def test_actor_cap_evicts_least_recent():
+    timeline = ActorTimeline([], max_actors=2)
+    timeline.record(hit(0, "/a", ip="1.1.1.1"))
+    timeline.record(hit(1, "/a", ip="2.2.2.2"))
+    timeline.record(hit(2, "/b", ip="1.1.1.1"))
+    timeline.record(hit(3, "/a", ip="3.3.3.3"))
+    assert timeline.history(ip="2.2.2.2") == []
+    assert len(timeline.history(ip="1.1.1.1")) == 2
+
+def test_event_cap_and_ttl():
+    timeline = ActorTimeline([], max_events=3, ttl=100)
+    for t in range(5):
+        timeline.record(hit(t, f"/{t}"))
+    assert [e[3] for e in timeline.history(ip="1.1.1.1")] == ["/2", "/3", "/4"]
+    timeline.record(hit(103, "/late"))
+    assert [e[3] for e in timeline.history(ip="1.1.1.1")] == ["/3", "/4", "/late"]
+
+def test_escalations_bypass_rate_limit():
+    ts = Sentry(None, "s", "e").timeline().rate_limit(1, 60).dedup(60)
+    ts.escalate("scan").distinct_traps(2, 60)
+    ts.init_app()
+    sent = []
+    ts._emit = sent.append
+    ts._trigger(hit(0, "/a", type="alert"))
+    ts._trigger(hit(1, "/b", type="alert"))
+    ts._trigger(hit(2, "/a", type="alert"))
+    assert [e["event"] for e in sent] == ["trappsec.trap_hit", "trappsec.escalation"]
@@ -0,0 +1,70 @@
+import json
+import atexit
+import threading
+
+import pytest
+
+pytest.importorskip("requests")
+
+from trappsec.handlers import WebhookHandler
+from trappsec.wire import decode
+
+class Session:
+    """records what the handler posts instead of sending it."""
+    def __init__(self):
+        self.posts = []
+        self.posted = threading.Event()
+
+    def post(self, url, data, headers, timeout):
+        self.posts.append((data, headers))
+        self.posted.set()
+
+def handler(monkeypatch, **kwargs):
+    registered = []
+    monkeypatch.setattr(atexit, "register", registered.append)
+    h = WebhookHandler("http://collector.invalid/events", **kwargs)
+    h.session = Session()
+    h.registered = registered
+    return h
+
+def sent(h):
+    return [e for data, headers in h.session.posts for e in decode(data, headers["Content-Type"])]
+
+def test_single_events_are_plain_json(monkeypatch):
+    h = handler(monkeypatch, secret="k")
+    h.emit({"event": "trappsec.trap_hit", "n": 1})
+    data, headers = h.session.posts[0]
+    assert json.loads(data) == {"event": "trappsec.trap_hit", "n": 1}
+    assert "x-trappsec-signature" in headers
+    assert h.registered == []
+
+def test_flush_on_batch_size(monkeypatch):
+    h = handler(monkeypatch, batch_size=3, flush_interval=60)
+    for i in range(3):
+        h.emit({"event": "e", "n": i})
+    assert h.session.posted.wait(2)
+    assert sent(h) == [{"event": "e", "n": i} for i in range(3)]
+
+def test_flush_on_interval(monkeypatch):
+    h = handler(monkeypatch, batch_size=100, flush_interval=0.05)
+    h.emit({"event": "e", "n": 1})
+    assert h.session.posted.wait(2)
+    assert sent(h) == [{"event": "e", "n": 1}]
+
+def test_flush_at_exit_in_batches(monkeypatch):
+    h = handler(monkeypatch, batch_size=2, flush_interval=60, codec="json")
+    assert h.registered == [h.flush]
+    with h._lock:
+        for i in range(5):
+            h._pending.append({"event": "e", "n": i})
+
+    h.registered[0]()
+    assert sent(h) == [{"event": "e", "n": i} for i in range(5)]
+    assert all(len(decode(data)) <= 2 for data, _ in h.session.posts)
+
+def test_full_queue_drops_oldest(monkeypatch):
+    h = handler(monkeypatch, batch_size=1000, flush_interval=60, max_pending=3)
+    for i in range(5):
+        h.emit({"event": "e", "n": i})
+    h.flush()
+    assert sent(h) == [{"event": "e", "n": i} for i in (2, 3, 4)]
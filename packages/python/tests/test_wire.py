@@ -0,0 +1,64 @@
+import hmac
+import json
+import hashlib
+
+import pytest
+
+from trappsec import wire
+from trappsec.wire import EventCodec, decode, verify
+
+APP = {"service": "billing", "environment": "production", "hostname": "worker-01"}
+
+def events():
+    return [
+        {"timestamp": 1706500123.4, "event": "trappsec.trap_hit", "type": "alert", "path": "/admin", "user": "alice", "app": APP},
+        {"timestamp": 1706500124.5, "event": "trappsec.watch_hit", "type": "signal", "path": "/profile",
+         "found_fields": [{"type": "body", "field": "is_admin", "value": True, "intent": None}], "app": APP},
+        {"timestamp": 1706500125.6, "event": "trappsec.trap_hit", "type": "signal", "path": "/admin", "app": dict(APP, hostname="worker-02")},
+    ]
+
+
+def codec(name):
+    if name != "json":
+        pytest.importorskip({"msgpack": "msgpack", "cbor": "cbor2"}[name])
+    return EventCodec(name)
+
+def test_envelope_layout():
+    envelope = json.loads(EventCodec("json").encode(events()))
+    assert envelope["v"] == wire.SCHEMA_VERSION
+    assert envelope["app"] == APP
+    # every key is listed once, in order of first use
+    assert envelope["keys"] == ["timestamp", "event", "type", "path", "user", "found_fields", "app"]
+    assert envelope["events"][0] == [0, 1706500123.4, 1, "trappsec.trap_hit", 2, "alert", 3, "/admin", 4, "alice"]
+    # an event from another app keeps its own block
+    assert envelope["events"][2][-2:] == [6, dict(APP, hostname="worker-02")]
+
+@pytest.mark.parametrize("name", ["json", "msgpack", "cbor"])
+def test_round_trip(name):
+    c = codec(name)
+    payload = c.encode(events())
+    assert isinstance(payload, bytes)
+    assert c.decode(payload) == events()
+    assert decode(payload, c.content_type + "; charset=utf-8") == events()
+
+def test_round_trip_without_app():
+    c = EventCodec("json")
+    plain = [{"event": "trappsec.heartbeat", "service": "billing"}]
+    assert json.loads(c.encode(plain))["app"] is None
+    assert c.decode(c.encode(plain)) == plain
+
+def test_decode_rejects_unknown_version_and_type():
+    with pytest.raises(ValueError):
+        EventCodec("json").decode(json.dumps({"v": 99, "keys": [], "events": []}).encode())
+    with pytest.raises(ValueError):
+        decode(b"{}", "text/plain")
+    with pytest.raises(ValueError):
+        EventCodec("xml")
+
+def test_verify():
+    payload = EventCodec("json").encode(events())
+    signature = hmac.new(b"s3cret", payload, hashlib.sha256).hexdigest()
+    assert verify(payload, signature, "s3cret")
+    assert not verify(payload + b" ", signature, "s3cret")
+    assert not verify(payload, signature, "other")
+    assert not verify(payload, None, "s3cret")
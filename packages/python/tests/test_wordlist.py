@@ -0,0 +1,58 @@
+import io
+import json
+
+import pytest
+
+from trappsec import Sentry
+from trappsec.wsgi import TrappsecMiddleware
+
+def app(environ, start_response):
+    start_response("200 OK", [])
+    return [b"app"]
+
+def call(ts, path, method="GET"):
+    status = []
+    environ = {"REQUEST_METHOD": method, "PATH_INFO": path, "REMOTE_ADDR": "203.0.113.7", "wsgi.input": io.BytesIO()}
+    body = b"".join(TrappsecMiddleware(app, ts)(environ, lambda s, h, exc_info=None: status.append(s)))
+    return status[0], body
+
+def test_entries(tmp_path):
+    wordlist = tmp_path / "common.txt"
+    wordlist.write_text("# comment\n\n.env\n/backup.zip\nadmin/*\n/search?q=1\n")
+    ts = Sentry(None, "s", "e")
+    config = ts.traps_from_wordlist(str(wordlist)).build()
+    assert config["path"] == "wordlist:common.txt"
+    assert config["paths"] == {"/.env", "/backup.zip", "/search"}
+    assert config["prefixes"] == ("/admin/",)
+
+def test_empty_wordlist():
+    with pytest.raises(ValueError, match="no paths"):
+        Sentry(None, "s", "e").traps_from_wordlist(["# nothing", ""])
+
+def test_matching():
+    ts = Sentry(None, "s", "e")
+    ts.traps_from_wordlist([".env", "/admin/*"]).methods("GET")
+    ruleset = ts.init_app()._ruleset
+    assert ruleset.match_trap("/.env", "GET") is not None
+    assert ruleset.match_trap("/admin/users/1", "GET") is not None
+    assert ruleset.match_trap("/.env", "POST") is None
+    assert ruleset.match_trap("/admin", "GET") is None
+
+def test_template_answers_scanners():
+    ts = Sentry(None, "s", "e")
+    ts.template("not_found", 404, {"error": "not found"})
+    ts.traps_from_wordlist([".env"], template="not_found", intent="recon")
+    ts._trigger = lambda ctx: None
+
+    status, body = call(ts, "/.env")
+    assert (status, json.loads(body)) == ("404 Not Found", {"error": "not found"})
+    trap = ts.init_app()._ruleset.match_trap("/.env", "GET")
+    assert trap["response.authenticated"]["status_code"] == 404
+    assert trap["intent"] == "recon"
+
+def test_if_unauthenticated_overrides_template():
+    ts = Sentry(None, "s", "e")
+    ts.template("not_found", 404, {"error": "not found"})
+    ts.traps_from_wordlist([".env"], template="not_found").if_unauthenticated(403, {"error": "forbidden"})
+    ts._trigger = lambda ctx: None
+    assert call(ts, "/.env")[0] == "403 Forbidden"
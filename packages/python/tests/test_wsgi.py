@@ -0,0 +1,121 @@
+import io
+import json
+
+import pytest
+
+from trappsec import Sentry
+from trappsec.wsgi import TrappsecMiddleware
+from trappsec.inspection import MAX_BODY_SIZE
+
+def echo(environ, start_response):
+    # reads the body like a framework would, then reports what it saw
+    if environ.get("wsgi.input_terminated"):
+        body = environ["wsgi.input"].read()
+    else:
+        body = environ["wsgi.input"].read(int(environ.get("CONTENT_LENGTH") or 0))
+    seen = {
+        "headers": {k: v for k, v in environ.items() if k.startswith("HTTP_")},
+        "query": environ.get("QUERY_STRING", ""),
+        "body": body.decode("latin-1"),
+        "content_length": environ.get("CONTENT_LENGTH"),
+    }
+    start_response("200 OK", [])
+    return [json.dumps(seen).encode()]
+
+def sentry():
+    ts = Sentry(None, "s", "e")
+    events = []
+    ts._trigger = events.append
+    ts.trap("/trap").methods("GET", "POST").if_unauthenticated(404, {"error": "not found"})
+    ts.watch("/profile").header("x-role").query("is_admin").body("is_admin").body("avatar")
+    return ts, events
+
+def call(middleware, path="/profile", method="POST", headers=None, query="", body=b""):
+    environ = {
+        "REQUEST_METHOD": method, "PATH_INFO": path, "QUERY_STRING": query, "REMOTE_ADDR": "203.0.113.7",
+        "CONTENT_LENGTH": str(len(body)), "wsgi.input": io.BytesIO(body),
+    }
+    environ.update(headers or {})
+    status = []
+    response = middleware(environ, lambda s, h, exc_info=None: status.append(s))
+    try:
+        data = b"".join(response)
+    finally:
+        if hasattr(response, "close"):
+            response.close()
+    return status[0], data
+
+def fields(events):
+    return [(f["type"], f["field"]) for e in events for f in e.get("found_fields", [])]
+
+def test_serves_traps():
+    ts, events = sentry()
+    status, body = call(TrappsecMiddleware(echo, ts), "/trap", "GET")
+    assert (status, json.loads(body)) == ("404 Not Found", {"error": "not found"})
+    assert events[0]["event"] == "trappsec.trap_hit"
+
+def test_passes_other_paths_through():
+    ts, events = sentry()
+    _, body = call(TrappsecMiddleware(echo, ts), "/other", "GET", query="is_admin=1")
+    assert json.loads(body)["query"] == "is_admin=1"
+    assert events == []
+
+def test_strips_headers_cookies_and_query():
+    ts, events = sentry()
+    ts.watch("/cookies").cookie("debug")
+    middleware = TrappsecMiddleware(echo, ts)
+
+    _, body = call(middleware, headers={"HTTP_X_ROLE": "admin", "HTTP_ACCEPT": "*/*"}, query="a=1&is_admin=true")
+    seen = json.loads(body)
+    assert seen["headers"] == {"HTTP_ACCEPT": "*/*"}
+    assert seen["query"] == "a=1"
+    assert fields(events) == [("header", "x-role"), ("query", "is_admin")]
+
+    _, body = call(middleware, "/cookies", headers={"HTTP_COOKIE": "session=abc; debug=1"})
+    assert json.loads(body)["headers"]["HTTP_COOKIE"] == "session=abc"
+    assert fields(events)[-1] == ("cookie", "debug")
+
+def test_strips_json_body():
+    ts, events = sentry()
+    data = json.dumps({"name": "n", "is_admin": True}).encode()
+    _, body = call(TrappsecMiddleware(echo, ts), headers={"CONTENT_TYPE": "application/json"}, body=data)
+    seen = json.loads(body)
+    assert json.loads(seen["body"]) == {"name": "n"}
+    assert seen["content_length"] == str(len(seen["body"]))
+    assert fields(events) == [("body", "is_admin")]
+
+def test_strips_form_body():
+    ts, events = sentry()
+    _, body = call(TrappsecMiddleware(echo, ts), headers={"CONTENT_TYPE": "application/x-www-form-urlencoded"}, body=b"name=n&is_admin=1")
+    assert json.loads(body)["body"] == "name=n"
+    assert fields(events) == [("body", "is_admin")]
+
+def multipart(*parts, boundary="XyZ"):
+    body = b""
+    for name, value in parts:
+        body += b"--%s\r\nContent-Disposition: form-data; name=\"%s\"\r\n\r\n%s\r\n" % (boundary.encode(), name.encode(), value)
+    return body + b"--%s--\r\n" % boundary.encode()
+
+def test_streams_multipart():
+    ts, events = sentry()
+    data = multipart(("name", b"n"), ("avatar", b"x" * 50000), ("is_admin", b"1"))
+    _, body = call(TrappsecMiddleware(echo, ts), headers={"CONTENT_TYPE": "multipart/form-data; boundary=XyZ"}, body=data)
+    seen = json.loads(body)["body"]
+    assert 'name="name"' in seen and "avatar" not in seen and "is_admin" not in seen
+    assert sorted(fields(events)) == [("body", "avatar"), ("body", "is_admin")]
+
+def test_multipart_inspected_when_app_skips_body():
+    ts, events = sentry()
+    def ignore(environ, start_response):
+        start_response("200 OK", [])
+        return [b"ok"]
+    data = multipart(("is_admin", b"1"))
+    call(TrappsecMiddleware(ignore, ts), headers={"CONTENT_TYPE": "multipart/form-data; boundary=XyZ"}, body=data)
+    assert fields(events) == [("body", "is_admin")]
+
+def test_body_over_limit_is_passed_through():
+    ts, events = sentry()
+    data = json.dumps({"is_admin": True, "pad": "x" * (MAX_BODY_SIZE + 100)}).encode()
+    _, body = call(TrappsecMiddleware(echo, ts), headers={"CONTENT_TYPE": "application/json"}, body=data)
+    assert json.loads(body)["body"].encode() == data
+    assert events == []
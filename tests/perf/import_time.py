@@ -0,0 +1,82 @@
+"""
+measures what `import trappsec` costs with `python -X importtime` and fails
+when it goes over budget, or when a module that should only be loaded on
+demand (webhook and otel dependencies, framework integrations) is imported.
+
+    python import_time.py --budget-ms 50 --runs 10
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+SRC = os.path.join(ROOT, "packages/python/src")
+
+# loaded by `add_webhook`, `add_otel` and the integrations, never by the import
+LAZY = ("requests", "urllib3", "opentelemetry", "flask", "fastapi", "starlette", "asyncio",
+        "trappsec.integrations", "trappsec.asgi", "trappsec.wsgi", "trappsec.geoip", "trappsec.beacon",
+        "trappsec.analyze", "trappsec.fake")
+
+def measure(statement: str) -> dict:
+    """
+    cumulative import time in microseconds of every module `statement` loaded,
+    leaving out what the interpreter imported at startup.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [SRC, os.environ.get("PYTHONPATH")])))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+        env=env, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    modules = {}
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package, indented by depth
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        modules[name.strip()] = int(cumulative)
+        # a top level import comes after its dependencies, anything before it belongs to `site`
+        if name[1:2] != " " and name.strip() == "site":
+            modules = {}
+    return modules
+
+def main():
+    parser = argparse.ArgumentParser(description="import-time budget for trappsec.")
+    parser.add_argument("--budget-ms", type=float, default=50, help="budget for the median cumulative time (default: 50)")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=10, help="slowest modules to show (default: 10)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    # the first run writes the bytecode cache, it isn't counted
+    measure("import trappsec")
+    runs = [measure("import trappsec") for _ in range(args.runs)]
+
+    totals = [run["trappsec"] / 1000 for run in runs]
+    median = statistics.median(totals)
+    fastest = runs[totals.index(min(totals))]
+    loaded = [m for m in LAZY if any(name == m or name.startswith(m + ".") for name in fastest)]
+
+    print(f"import trappsec: median {median:.1f}ms, min {min(totals):.1f}ms, max {max(totals):.1f}ms "
+          f"over {args.runs} runs (budget {args.budget_ms:g}ms)")
+    for name, cumulative in sorted(fastest.items(), key=lambda kv: -kv[1])[1:args.top + 1]:
+        print(f"  {cumulative / 1000:8.1f}ms  {name}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"median_ms": median, "runs_ms": totals, "budget_ms": args.budget_ms, "eagerly_loaded": loaded}, f, indent=2)
+
+    failed = False
+    if loaded:
+        print(f"FAIL: imported eagerly: {', '.join(loaded)}")
+        failed = True
+    if median > args.budget_ms:
+        print(f"FAIL: over budget by {median - args.budget_ms:.1f}ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
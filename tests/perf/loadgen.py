@@ -0,0 +1,141 @@
+"""
+asyncio load generator speaking plain HTTP/1.1 over keep-alive connections.
+drives a weighted mix of legitimate, trap and watch requests against the
+example apps and reports latency percentiles and throughput.
+
+    python loadgen.py --url http://127.0.0.1:8000 --connections 64 --duration 20
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+from urllib.parse import urlsplit
+
+def _request(method, path, headers=None, body=None, ctype=None):
+    return {"method": method, "path": path, "headers": headers or {}, "body": body, "ctype": ctype}
+
+# mirrors the routes, traps and watches shared by examples/flask and examples/fastapi
+TRAFFIC = {
+    "legit": [
+        _request("GET", "/api/v2/orders"),
+        _request("GET", "/api/v2/profile", {"x-user-id": "alice"}),
+        _request("POST", "/auth/register", body=b"email=legit%40example.com", ctype="application/x-www-form-urlencoded"),
+    ],
+    "trap": [
+        _request("GET", "/deployment/config", {"x-user-id": "alice"}),
+        _request("GET", "/deployment/metrics"),
+        _request("GET", "/api/v1/orders"),
+    ],
+    "watch": [
+        _request("POST", "/auth/register", body=b"email=x%40example.com&role=admin", ctype="application/x-www-form-urlencoded"),
+        _request("POST", "/api/v2/profile", {"x-user-id": "mallory"}, b'{"is_admin": true}', "application/json"),
+    ],
+}
+
+def _encode(req, host):
+    lines = [f"{req['method']} {req['path']} HTTP/1.1", f"Host: {host}", "User-Agent: trappsec-loadgen"]
+    lines += [f"{k}: {v}" for k, v in req["headers"].items()]
+    body = req["body"] or b""
+    if req["ctype"]:
+        lines.append(f"Content-Type: {req['ctype']}")
+    lines.append(f"Content-Length: {len(body)}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+async def _read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    headers = {}
+    for line in head.split(b"\r\n")[1:]:
+        if b":" in line:
+            k, v = line.split(b":", 1)
+            headers[k.strip().lower()] = v.strip()
+
+    if headers.get(b"transfer-encoding", b"").lower() == b"chunked":
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(int(headers.get(b"content-length", 0)))
+
+    return status, headers.get(b"connection", b"").lower() == b"close"
+
+async def _worker(host, port, payloads, deadline, latencies, errors):
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+
+            payload = random.choice(payloads)
+            start = time.perf_counter()
+            writer.write(payload)
+            status, close = await _read_response(reader)
+            latencies.append(time.perf_counter() - start)
+
+            if status >= 500:
+                errors.append(status)
+            if close:
+                writer.close()
+                writer = None
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            errors.append(type(e).__name__)
+            if writer is not None:
+                writer.close()
+            writer = None
+
+    if writer is not None:
+        writer.close()
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+async def run(url: str, connections: int = 64, duration: float = 10, mix: dict = None):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    mix = mix or {"legit": 80, "trap": 10, "watch": 10}
+
+    # pre-encode requests, weighting each category by its share of the mix
+    payloads = []
+    for kind, weight in mix.items():
+        for req in TRAFFIC[kind]:
+            payloads += [_encode(req, parts.netloc)] * max(1, int(weight))
+
+    latencies, errors = [], []
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*[_worker(host, port, payloads, deadline, latencies, errors) for _ in range(connections)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        "p999_ms": round(_percentile(latencies, 0.999) * 1000, 3) if latencies else None,
+    }
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for item in value.split(","):
+        kind, weight = item.split("=")
+        if kind not in TRAFFIC:
+            raise argparse.ArgumentTypeError(f"unknown traffic kind '{kind}', use {sorted(TRAFFIC)}")
+        mix[kind] = float(weight)
+    return mix
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--mix", type=parse_mix, default="legit=80,trap=10,watch=10")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args.url, args.connections, args.duration, args.mix)), indent=2))
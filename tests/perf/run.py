@@ -0,0 +1,91 @@
+"""
+runs the example apps under production servers with trappsec enabled and
+disabled, drives them with the load generator and prints a comparison.
+
+    python run.py --apps flask fastapi --workers 4 --duration 20 --sink-latency-ms 20
+"""
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import subprocess
+import urllib.request
+
+import loadgen
+from webhook_sink import WebhookSink
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def server_command(app: str, port: int, workers: int):
+    if app == "flask":
+        return [sys.executable, "-m", "gunicorn", "serve:app", "--bind", f"127.0.0.1:{port}",
+            "--workers", str(workers), "--worker-class", "gthread", "--threads", "8", "--log-level", "warning"]
+    return [sys.executable, "-m", "uvicorn", "serve:app", "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(workers), "--log-level", "warning", "--no-access-log"]
+
+def wait_until_ready(port: int, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/v2/orders", timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not become ready")
+
+def run_scenario(args, app: str, enabled: bool, sink: WebhookSink):
+    env = dict(os.environ, TRAPPSEC_BENCH_APP=app, TRAPPSEC_BENCH_WEBHOOK=f"http://127.0.0.1:{args.sink_port}/webhook")
+    if not enabled:
+        env["TRAPPSEC_BENCH_DISABLED"] = "1"
+
+    proc = subprocess.Popen(server_command(app, args.port, args.workers), cwd=HERE, env=env,
+        stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL, start_new_session=True)
+    try:
+        wait_until_ready(args.port)
+        asyncio.run(loadgen.run(f"http://127.0.0.1:{args.port}", args.connections, args.warmup, args.mix))
+
+        sink.reset()
+        result = asyncio.run(loadgen.run(f"http://127.0.0.1:{args.port}", args.connections, args.duration, args.mix))
+        result.update(app=app, trappsec="enabled" if enabled else "disabled", webhook=sink.stats())
+        return result
+    finally:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=30)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--apps", nargs="+", choices=["flask", "fastapi"], default=["flask", "fastapi"])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--mix", type=loadgen.parse_mix, default="legit=80,trap=10,watch=10")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--sink-port", type=int, default=5051)
+    parser.add_argument("--sink-latency-ms", type=float, default=0)
+    parser.add_argument("--sink-failure-rate", type=float, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show server stderr")
+    args = parser.parse_args()
+
+    sink = WebhookSink(("127.0.0.1", args.sink_port), args.sink_latency_ms, args.sink_failure_rate).start()
+
+    results = []
+    for app in args.apps:
+        for enabled in (False, True):
+            result = run_scenario(args, app, enabled, sink)
+            results.append(result)
+            print(f"{app:8} trappsec={result['trappsec']:8} {result['throughput_rps']:>9} rps  "
+                f"p50={result['p50_ms']}ms  p99={result['p99_ms']}ms  p999={result['p999_ms']}ms  "
+                f"errors={result['errors']}  webhook={result['webhook']}", flush=True)
+
+    sink.shutdown()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+loads one of the example apps for the load-test harness.
+
+production servers import `app` from here instead of running the example's
+`__main__` block, so the webhook is configured from the environment:
+
+    TRAPPSEC_BENCH_APP       flask | fastapi
+    TRAPPSEC_BENCH_WEBHOOK   webhook url, optional
+    TRAPPSEC_BENCH_DISABLED  when set, the example runs with trappsec turned off
+"""
+import os
+import sys
+import importlib.util
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, os.path.join(ROOT, "packages/python/src"))
+
+import trappsec
+
+class DisabledSentry:
+    # stands in for trappsec.Sentry to measure the example without trappsec
+    def __init__(self, *args, **kwargs):
+        self.default_responses = {}
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+def _load(name: str):
+    if os.environ.get("TRAPPSEC_BENCH_DISABLED"):
+        trappsec.Sentry = DisabledSentry
+
+    path = os.path.join(ROOT, "examples", name, "app.py")
+    spec = importlib.util.spec_from_file_location(f"example_{name}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    webhook = os.environ.get("TRAPPSEC_BENCH_WEBHOOK")
+    if webhook and not os.environ.get("TRAPPSEC_BENCH_DISABLED"):
+        module.ts.add_webhook(url=webhook)
+    return module.app
+
+app = _load(os.environ.get("TRAPPSEC_BENCH_APP", "flask"))
@@ -0,0 +1,85 @@
+"""
+local stand-in for a webhook collector. counts received events and can inject
+latency and failures to see how trappsec behaves when the collector struggles.
+
+    python webhook_sink.py --port 5051 --latency-ms 50 --failure-rate 0.1
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class SinkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.server
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if server.failure_rate and random.random() < server.failure_rate:
+            server.record(failed=True)
+            self.send_response(503)
+        else:
+            server.record(failed=False, size=len(body))
+            self.send_response(204)
+
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        stats = json.dumps(self.server.stats()).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(stats)))
+        self.end_headers()
+        self.wfile.write(stats)
+
+    def log_message(self, format, *args):
+        pass
+
+class WebhookSink(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms: float = 0, failure_rate: float = 0):
+        super().__init__(address, SinkHandler)
+        self.latency = latency_ms / 1000
+        self.failure_rate = failure_rate
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.received = 0
+            self.failed = 0
+            self.bytes = 0
+
+    def record(self, failed: bool, size: int = 0):
+        with self._lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.received += 1
+                self.bytes += size
+
+    def stats(self):
+        with self._lock:
+            return {"received": self.received, "failed": self.failed, "bytes": self.bytes}
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=5051)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--failure-rate", type=float, default=0)
+    args = parser.parse_args()
+
+    print(f"webhook sink listening on http://127.0.0.1:{args.port}/webhook")
+    WebhookSink(("127.0.0.1", args.port), args.latency_ms, args.failure_rate).serve_forever()
@@ -0,0 +1,115 @@
+"""
+measures what planting a large scanner wordlist costs at startup: the time to
+declare the traps and compile the ruleset, and the resident memory it adds,
+with `traps_from_wordlist` and with one `trap()` per path. each mode runs in
+a fresh interpreter, so earlier runs don't skew its memory.
+
+    python wordlist.py --paths 100000 --runs 3
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+SRC = os.path.join(ROOT, "packages/python/src")
+
+MODES = ("wordlist", "traps")
+
+def rss_kb() -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+def generate(path: str, count: int, seed: int = 1):
+    # shaped like scanner lists: a few levels deep, some extensions, some prefixes
+    rng = random.Random(seed)
+    words = ["admin", "backup", "config", "api", "v1", "v2", "old", "test", "dev", "internal", "wp", "cgi-bin",
+             "actuator", "debug", "private", "static", "uploads", "db", "logs", "tmp"]
+    extensions = ["", "", ".php", ".bak", ".zip", ".sql", ".env", ".old", ".json", ".yml"]
+    with open(path, "w") as f:
+        f.write("# generated by wordlist.py\n")
+        for i in range(count):
+            depth = rng.randint(1, 4)
+            parts = [rng.choice(words) for _ in range(depth - 1)] + [f"{rng.choice(words)}{i}{rng.choice(extensions)}"]
+            f.write("/".join(parts) + ("/*" if i % 1000 == 0 else "") + "\n")
+
+def entries(path: str) -> list:
+    # the paths the wordlist plants, with prefix entries reduced to the prefix itself
+    with open(path) as f:
+        lines = (line.strip() for line in f)
+        return ["/" + line.rstrip("*").lstrip("/") for line in lines if line and not line.startswith("#")]
+
+def child(mode: str, path: str):
+    sys.path.insert(0, SRC)
+    import trappsec
+
+    before = rss_kb()
+    start = time.perf_counter()
+
+    ts = trappsec.Sentry(None, "bench", "perf")
+    if mode == "wordlist":
+        ts.traps_from_wordlist(path).methods("GET")
+    else:
+        for entry in entries(path):
+            ts.trap(entry).methods("GET")
+    ts.init_app()
+
+    elapsed = time.perf_counter() - start
+    added = rss_kb() - before
+
+    # the first paths of the list and as many misses, in a fixed order
+    ruleset = ts._ruleset
+    hits = entries(path)[:10000]
+    misses = [p + "-miss" for p in hits]
+    start = time.perf_counter()
+    for p in hits + misses:
+        ruleset.match_trap(p, "GET")
+    match_us = (time.perf_counter() - start) / len(hits + misses) * 1e6
+
+    print(json.dumps({"startup_s": elapsed, "rss_mb": added / 1024, "match_us": match_us}))
+
+def measure(mode: str, path: str) -> dict:
+    proc = subprocess.run([sys.executable, __file__, "--child", mode, path],
+        stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return json.loads(proc.stdout)
+
+def main():
+    parser = argparse.ArgumentParser(description="startup cost of large trap wordlists.")
+    parser.add_argument("--paths", type=int, default=100000, help="paths in the generated wordlist (default: 100000)")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--wordlist", help="use this wordlist instead of generating one")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(*args.child)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.wordlist
+        if path is None:
+            path = os.path.join(tmp, "wordlist.txt")
+            generate(path, args.paths)
+
+        results = {}
+        for mode in args.modes:
+            runs = [measure(mode, path) for _ in range(args.runs)]
+            results[mode] = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+            print(f"{mode:>8}: startup {results[mode]['startup_s']:.2f}s, +{results[mode]['rss_mb']:.1f}MB rss, "
+                  f"match {results[mode]['match_us']:.2f}us (median of {args.runs} runs)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"paths": args.paths, "runs": args.runs, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()